@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before * 100
+
+def compare(baseline, candidate, threshold):
+    # A regression is a p95 increase or an rps drop beyond `threshold` percent
+    regressions = []
+    print(f"{'scenario':<22}" + "".join(f"{metric:>24}" for metric in METRICS))
+    for name, before in baseline['scenarios'].items():
+        after = candidate['scenarios'].get(name)
+        if after is None:
+            continue
+        cells = []
+        for metric in METRICS:
+            delta = change(before[metric], after[metric])
+            cells.append(f"{before[metric]} -> {after[metric]}" + (f" ({delta:+.1f}%)" if delta is not None else ""))
+        print(f"{name:<22}" + "".join(f"{cell:>24}" for cell in cells))
+
+        p95 = change(before['p95_ms'], after['p95_ms'])
+        rps = change(before['rps'], after['rps'])
+        if (p95 is not None and p95 > threshold) or (rps is not None and rps < -threshold) or after['errors'] > before['errors']:
+            regressions.append(name)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed p95 / rps change in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = compare(baseline, candidate, args.threshold)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
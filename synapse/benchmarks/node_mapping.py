@@ -0,0 +1,93 @@
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from neo4j.graph import Graph, Node
+
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from responses import dumps
+
+# Micro-benchmark of turning Neo4j records into the nodes the handlers return:
+# the dict copy + id + metadata decode the handlers used to repeat, against
+# NodeMapper. Reports time and allocated bytes per row for mapping alone and
+# for mapping + JSON encoding, on full nodes (by-id lookups) and on projected
+# rows (list and search endpoints).
+
+def make_records(rows, dimension, seed):
+    rng = random.Random(seed)
+    graph = Graph()
+    full, projected = [], []
+    for index in range(rows):
+        properties = {
+            'name': f"thing-{index}",
+            'description': f"description of thing {index}",
+            'created_at': '2024-01-01T00:00:00',
+            'updated_at': '2024-01-01T00:00:00',
+            'vector': [rng.random() for _ in range(dimension)],
+            'metadata': json.dumps({'brand': rng.choice(('Acme', 'Globex')), 'price': rng.randint(1, 100), 'tags': ['a', 'b']})
+        }
+        id = f"4:bench:{index}"
+        full.append({'t': Node(graph, id, index, ['Thing'], properties), 'id': id})
+        projected.append({'t': {**properties, 'vector': None}, 'id': id})
+    return full, projected
+
+def map_dicts(records, metadata_handler, projected):
+    # The mapping the handlers did before NodeMapper
+    nodes = []
+    for record in records:
+        node = dict(record['t'])
+        node['id'] = record['id']
+        if projected:
+            node.pop('vector', None)
+        node['metadata'] = metadata_handler.decode(node)
+        nodes.append(node)
+    return nodes
+
+def map_records(records, node_mapper, projected):
+    return [node_mapper.node(record['t'], record['id'], include_vector=False if projected else None) for record in records]
+
+def measure(function, repeat):
+    # Best wall time over `repeat` runs, and the bytes still allocated by the
+    # result of one traced run
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(timings), allocated, peak
+
+def run(rows, dimension, repeat, seed):
+    metadata_handler = MetadataHandler()
+    node_mapper = NodeMapper(metadata_handler)
+    full, projected = make_records(rows, dimension, seed)
+    results = {}
+    for shape, records, is_projected in (('full', full, False), ('projected', projected, True)):
+        for name, mapping in (('dict', lambda: map_dicts(records, metadata_handler, is_projected)),
+                              ('node_mapper', lambda: map_records(records, node_mapper, is_projected))):
+            results[f"{shape}/{name}/map"] = measure(mapping, repeat)
+            results[f"{shape}/{name}/map+json"] = measure(lambda: dumps(mapping()), repeat)
+
+    print(f"{'scenario':<32}{'us/row':>10}{'bytes/row':>12}{'peak bytes/row':>16}")
+    for name, (seconds, allocated, peak) in results.items():
+        print(f"{name:<32}{seconds / rows * 1e6:>10.2f}{allocated / rows:>12.0f}{peak / rows:>16.0f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and allocations of mapping Neo4j records to nodes.")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--vector-dimension", type=int, default=384)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    run(args.rows, args.vector_dimension, args.repeat, args.seed)
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.seed import GraphSeeder, WORDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+def summarize(latencies, errors, elapsed):
+    values = sorted(latencies)
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(values) / elapsed, 2) if elapsed else None,
+        'mean_ms': to_ms(sum(values) / len(values)) if values else None,
+        'p50_ms': to_ms(percentile(values, 0.50)),
+        'p95_ms': to_ms(percentile(values, 0.95)),
+        'p99_ms': to_ms(percentile(values, 0.99)),
+        'max_ms': to_ms(values[-1]) if values else None
+    }
+
+class Scenarios:
+    # Each scenario issues one request; ids come from the seeded graph
+    def __init__(self, seeder, relations_limit=100):
+        self.seeder = seeder
+        self.rng = seeder.rng
+        self.relations_limit = relations_limit
+
+    def _thing_id(self):
+        return self.rng.choice(self.seeder.ids['things'])
+
+    async def create_thing(self, client):
+        response = await client.post("/things/", json={
+            'name': f"{self.seeder.phrase(2)} new",
+            'description': self.seeder.phrase(8),
+            'metadata': self.seeder.metadata(),
+            'vector': self.seeder.vector()
+        })
+        if response.status_code == 200:
+            self.seeder.ids['things'].append(response.json()['id'])
+        return response
+
+    async def get_thing(self, client):
+        return await client.get(f"/things/{self._thing_id()}")
+
+    async def update_thing(self, client):
+        return await client.put(f"/things/{self._thing_id()}", json={'description': self.seeder.phrase(8)})
+
+    async def list_things(self, client):
+        return await client.get("/things/", params={'limit': 100})
+
+    async def search_things(self, client):
+        return await client.get("/things/search", params={'name': self.rng.choice(WORDS), 'limit': 20})
+
+    async def search_things_text(self, client):
+        return await client.get("/things/search", params={'q': self.rng.choice(WORDS), 'limit': 20})
+
+    async def similar_things(self, client):
+        return await client.post("/things/similar", json={'vector': self.seeder.vector(), 'top_n': 10})
+
+    async def similar_tasks(self, client):
+        return await client.post("/tasks/similar", json={'vector': self.seeder.vector(), 'top_n': 10})
+
+    async def relations_all(self, client):
+        return await client.get("/relations/all", params={'limit': self.relations_limit})
+
+    NAMES = (
+        'create_thing', 'get_thing', 'update_thing', 'list_things', 'search_things',
+        'search_things_text', 'similar_things', 'similar_tasks', 'relations_all'
+    )
+
+async def run_scenario(client, scenario, requests, concurrency, warmup):
+    for _ in range(warmup):
+        await scenario(client)
+
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await scenario(client)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args, client):
+    seeder = GraphSeeder(client, seed=args.seed, vector_dimension=args.vector_dimension, concurrency=args.concurrency)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'target': args.base_url or 'in-process',
+            'python': platform.python_version(),
+            'seed': args.seed,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'vector_dimension': args.vector_dimension
+        }
+    }
+    try:
+        results['seed'] = await seeder.seed(args.users, args.things, args.places, args.tasks, args.relations)
+        scenarios = Scenarios(seeder, args.relations_limit)
+        results['scenarios'] = {}
+        for name in args.scenarios:
+            results['scenarios'][name] = await run_scenario(client, getattr(scenarios, name), args.requests, args.concurrency, args.warmup)
+            logger.info(f"{name}: {results['scenarios'][name]}")
+    finally:
+        if not args.keep:
+            await seeder.cleanup()
+    return results
+
+async def main(args):
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+            return await run(args, client)
+
+    # In-process: the app (and its startup hooks) run in this event loop, still
+    # against the Neo4j instance configured in deps.py
+    from main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://synapse", timeout=timeout) as client:
+            return await run(args, client)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a synthetic graph and measure Synapse API latency and throughput.")
+    parser.add_argument("--base-url", help="Benchmark a running server (e.g. http://localhost:8000) instead of the app in-process")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--scenarios", nargs="+", choices=Scenarios.NAMES, default=list(Scenarios.NAMES))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--things", type=int, default=5000)
+    parser.add_argument("--places", type=int, default=500)
+    parser.add_argument("--tasks", type=int, default=1000)
+    parser.add_argument("--relations", type=int, default=10000)
+    parser.add_argument("--vector-dimension", type=int, default=128)
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--relations-limit", type=int, default=100, help="Page size for the relations_all scenario")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep the seeded graph instead of deleting it afterwards")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Results written to {output}")
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+WORDS = [
+    "alpha", "amber", "anchor", "arrow", "aspen", "atlas", "beacon", "birch", "bloom", "bolt",
+    "breeze", "bridge", "canyon", "cedar", "cinder", "cobalt", "comet", "coral", "crest", "delta",
+    "drift", "ember", "falcon", "fern", "flint", "forge", "frost", "garnet", "glacier", "harbor",
+    "hazel", "horizon", "indigo", "iris", "jade", "juniper", "lagoon", "lantern", "maple", "meadow",
+    "mesa", "nebula", "nova", "oak", "onyx", "orbit", "pebble", "pine", "prism", "quartz",
+    "raven", "ridge", "river", "sable", "sage", "slate", "spruce", "summit", "thistle", "tide",
+    "timber", "topaz", "tundra", "umber", "valley", "vapor", "willow", "zephyr"
+]
+CATEGORIES = ["tool", "book", "device", "furniture", "clothing", "food", "toy", "instrument"]
+RELATION_TYPES = ["OWNS", "LOCATED_IN", "RELATED_TO", "USES"]
+
+class GraphSeeder:
+    # Builds a reproducible synthetic graph through the public API, so the same
+    # seed works in-process and against a running server
+    def __init__(self, client, seed=42, vector_dimension=128, chunk_size=1000, concurrency=16):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.vector_dimension = vector_dimension
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.run_id = f"bench-{seed}-{int(time.time())}"
+        self.ids = {'users': [], 'things': [], 'places': [], 'tasks': [], 'relations': []}
+
+    def phrase(self, words=3):
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    def vector(self):
+        return [self.rng.uniform(-1.0, 1.0) for _ in range(self.vector_dimension)]
+
+    def metadata(self):
+        return {
+            'benchmark_run': self.run_id,
+            'category': self.rng.choice(CATEGORIES),
+            'rating': self.rng.randint(1, 5)
+        }
+
+    async def _bulk(self, path, items, id_key='id'):
+        ids = []
+        for start in range(0, len(items), self.chunk_size):
+            response = await self.client.post(path, json=items[start:start + self.chunk_size], params={'chunk_size': self.chunk_size})
+            response.raise_for_status()
+            body = response.json()
+            if body['errors']:
+                logger.warning(f"{path}: {len(body['errors'])} rows failed, first: {body['errors'][0]}")
+            ids.extend(created[id_key] for created in body['created'])
+        return ids
+
+    async def seed_users(self, count):
+        users = [
+            {'username': f"{self.run_id}-user-{i}", 'email': f"user{i}@{self.run_id}.example", 'metadata': self.metadata()}
+            for i in range(count)
+        ]
+        self.ids['users'] = await self._bulk("/users/bulk", users)
+
+    async def seed_things(self, count):
+        things = [
+            {'name': f"{self.phrase(2)} {i}", 'description': self.phrase(8), 'metadata': self.metadata(), 'vector': self.vector()}
+            for i in range(count)
+        ]
+        self.ids['things'] = await self._bulk("/things/bulk", things)
+
+    async def seed_places(self, count):
+        places = [
+            {'name': f"{self.phrase(2)} {i}", 'description': self.phrase(8), 'metadata': self.metadata()}
+            for i in range(count)
+        ]
+        self.ids['places'] = await self._bulk("/places/bulk", places)
+
+    async def seed_tasks(self, count):
+        tasks = [
+            {'title': f"{self.phrase(3)} {i}", 'description': self.phrase(8), 'metadata': self.metadata(), 'vector': self.vector()}
+            for i in range(count)
+        ]
+        self.ids['tasks'] = await self._bulk("/tasks/bulk", tasks)
+
+    async def seed_relations(self, count):
+        nodes = self.ids['users'] + self.ids['things'] + self.ids['places'] + self.ids['tasks']
+        if len(nodes) < 2:
+            return
+        relations = []
+        for _ in range(count):
+            source_id, target_id = self.rng.sample(nodes, 2)
+            relations.append({
+                'source_id': source_id,
+                'target_id': target_id,
+                'relation_type': self.rng.choice(RELATION_TYPES),
+                'properties': {'benchmark_run': self.run_id}
+            })
+        self.ids['relations'] = await self._bulk("/relations/bulk", relations, 'relation_id')
+
+    async def seed(self, users, things, places, tasks, relations):
+        timings = {}
+        for name, count, step in (
+            ('users', users, self.seed_users),
+            ('things', things, self.seed_things),
+            ('places', places, self.seed_places),
+            ('tasks', tasks, self.seed_tasks),
+            ('relations', relations, self.seed_relations)
+        ):
+            start = time.perf_counter()
+            await step(count)
+            timings[name] = {'requested': count, 'created': len(self.ids[name]), 'seconds': round(time.perf_counter() - start, 3)}
+            logger.info(f"Seeded {timings[name]['created']} {name} in {timings[name]['seconds']}s")
+        return timings
+
+    async def cleanup(self):
+        # Deleting the nodes detaches their relations as well
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def delete(path):
+            async with semaphore:
+                await self.client.delete(path)
+
+        paths = (
+            [f"/users/{id}" for id in self.ids['users']] +
+            [f"/things/{id}" for id in self.ids['things']] +
+            [f"/places/{id}" for id in self.ids['places']] +
+            [f"/tasks/{id}" for id in self.ids['tasks']]
+        )
+        await asyncio.gather(*(delete(path) for path in paths))
+        logger.info(f"Removed {len(paths)} seeded nodes")
@@ -1,21 +1,197 @@
-from handlers.DatabaseHandler import DatabaseHandler
+import json
+import os
+
+from handlers.AsyncDatabaseHandler import AsyncDatabaseHandler
 from handlers.UserHandler import UserHandler
 from handlers.ThingHandler import ThingHandler
 from handlers.PlaceHandler import PlaceHandler
+from handlers.TaskHandler import TaskHandler
 from handlers.FilterHandler import FilterHandler
+from handlers.VectorIndexHandler import VectorIndexHandler
+from handlers.SchemaHandler import SchemaHandler
+from handlers.MetadataHandler import MetadataHandler
+from handlers.CacheHandler import CacheHandler, LRUCache, RedisCache
+from handlers.MetricsHandler import MetricsHandler
+from handlers.QueryBuilder import QueryBuilder
+from handlers.GraphHandler import GraphHandler
+from handlers.SnapshotHandler import SnapshotHandler
+from handlers.EmbeddingHandler import EmbeddingHandler
+from handlers.EmbeddingPipelineHandler import EmbeddingPipelineHandler
+from handlers.CortexHandler import CortexHandler
+from handlers.NodeLoaderHandler import NodeLoaderHandler
+from ollama import AsyncClient
+
+# Every setting below can be overridden by an environment variable of the same
+# name; unset or empty keeps the default. "none" turns optional settings off.
+def env(name, default, parse=str):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return parse(value)
+
+def flag(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+def optional(parse):
+    return lambda value: None if value.lower() == "none" else parse(value)
+
+def names(value):
+    return tuple(name.strip() for name in value.split(",") if name.strip())
+
+NEO4J_URI = env("NEO4J_URI", "bolt://neuron:7687")
+NEO4J_USER = env("NEO4J_USER", "neo4j")
+NEO4J_PASSWORD = env("NEO4J_PASSWORD", "mxrg@neuron")
+NEO4J_MAX_CONNECTION_POOL_SIZE = env("NEO4J_MAX_CONNECTION_POOL_SIZE", 200, int)
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = env("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 30.0, float)
+NEO4J_MAX_CONNECTION_LIFETIME = env("NEO4J_MAX_CONNECTION_LIFETIME", 3600, int)
+# Connections opened at startup, before /health/ready reports ready; 0 only
+# checks that the database can be reached
+NEO4J_WARMUP_CONNECTIONS = env("NEO4J_WARMUP_CONNECTIONS", 0, int)
+
+# In-process vector index used by find_similar_things / find_similar_tasks:
+# "exact" (NumPy matrix search), "ivf" (approximate) or None to use the
+# gds.similarity.cosine scan inside Neo4j
+VECTOR_INDEX_KIND = env("VECTOR_INDEX_KIND", "exact", optional(str))
+VECTOR_INDEX_DIR = env("VECTOR_INDEX_DIR", "vector_index")
+
+# Create and query Neo4j native vector indexes (db.index.vector.queryNodes).
+# The dimension is taken from the stored vectors unless set here.
+NATIVE_VECTOR_INDEX = env("NATIVE_VECTOR_INDEX", False, flag)
+NATIVE_VECTOR_DIMENSION = env("NATIVE_VECTOR_DIMENSION", None, optional(int))
+
+# How metadata is stored: "json" (a JSON string in `metadata`) or "properties"
+# (flattened into native meta_* properties, see MetadataHandler). Existing data
+# is converted with `python migrate_metadata.py --to properties`.
+METADATA_STORAGE = env("METADATA_STORAGE", "json")
+# Metadata keys that get a range index per label for the `meta` search filters,
+# as JSON in the environment: {"Thing": ["brand"]}
+METADATA_INDEXED_KEYS = {
+    'Thing': [],
+    'Task': [],
+    'Place': [],
+    'User': [],
+    **env("METADATA_INDEXED_KEYS", {}, json.loads)
+}
+
+# Relationship types accepted by the relations endpoints, e.g. ("CREATED", "OWNS").
+# None accepts any type that is a plain identifier ([A-Za-z_][A-Za-z0-9_]*).
+# Comma-separated in the environment.
+RELATION_TYPES = env("RELATION_TYPES", None, optional(names))
+
+# Read-through cache for node lookups by id / name: "memory" (per-process LRU,
+# only for a single worker: other workers' writes do not invalidate it),
+# "redis" (shared between workers) or None to always hit Neo4j
+CACHE_BACKEND = env("CACHE_BACKEND", "memory", optional(str))
+CACHE_TTL = env("CACHE_TTL", 60.0, float)
+CACHE_MAX_ENTRIES = env("CACHE_MAX_ENTRIES", 10000, int)
+CACHE_REDIS_URL = env("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Queries slower than this (seconds) are logged to the "synapse.slow_query"
+# logger; None disables the log. Timings are exported at /metrics.
+SLOW_QUERY_THRESHOLD = env("SLOW_QUERY_THRESHOLD", 0.5, optional(float))
+
+OLLAMA_HOST = env("OLLAMA_HOST", "http://cortex:11434")
+# Concurrent chat / generate requests per model; more wait for a free slot
+CORTEX_MAX_CONCURRENCY_PER_MODEL = env("CORTEX_MAX_CONCURRENCY_PER_MODEL", 2, int)
+# Embeddings are cached by a hash of (model, text) in memory and in a SQLite
+# file (None keeps them in memory only). Texts that miss are sent in batches of
+# EMBEDDING_BATCH_SIZE with at most EMBEDDING_MAX_CONCURRENCY requests at once.
+EMBEDDING_STORE_PATH = env("EMBEDDING_STORE_PATH", "embeddings.sqlite", optional(str))
+EMBEDDING_CACHE_MAX_ENTRIES = env("EMBEDDING_CACHE_MAX_ENTRIES", 10000, int)
+EMBEDDING_BATCH_SIZE = env("EMBEDDING_BATCH_SIZE", 64, int)
+EMBEDDING_MAX_CONCURRENCY = env("EMBEDDING_MAX_CONCURRENCY", 4, int)
+# Things and Tasks created or edited without a vector are embedded in the
+# background with EMBEDDING_MODEL by EMBEDDING_WORKERS workers (0 disables it).
+# Bump EMBEDDING_VERSION when the embedded text changes and run
+# POST /embeddings/reembed to refresh the stored vectors.
+EMBEDDING_MODEL = env("EMBEDDING_MODEL", "nomic-embed-text")
+EMBEDDING_VERSION = env("EMBEDDING_VERSION", 1, int)
+EMBEDDING_WORKERS = env("EMBEDDING_WORKERS", 2, int)
+
+# By-id lookups arriving within NODE_LOADER_BATCH_WINDOW seconds of each other
+# are fetched with one query (at most NODE_LOADER_MAX_BATCH_SIZE ids each)
+NODE_LOADER_BATCH_WINDOW = env("NODE_LOADER_BATCH_WINDOW", 0.002, float)
+NODE_LOADER_MAX_BATCH_SIZE = env("NODE_LOADER_MAX_BATCH_SIZE", 1000, int)
+
+metrics_handler = MetricsHandler(SLOW_QUERY_THRESHOLD)
+
+# Initialize the db_handler; the driver is created on first use
+db_handler = AsyncDatabaseHandler(
+    uri=NEO4J_URI,
+    user=NEO4J_USER,
+    password=NEO4J_PASSWORD,
+    max_connection_pool_size=NEO4J_MAX_CONNECTION_POOL_SIZE,
+    connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+    max_connection_lifetime=NEO4J_MAX_CONNECTION_LIFETIME,
+    metrics_handler=metrics_handler
+)
 
-# Initialize the db_handler
-db_handler = DatabaseHandler(uri="bolt://neuron:7687", user="neo4j", password="mxrg@neuron")
+metadata_handler = MetadataHandler(METADATA_STORAGE)
+query_builder = QueryBuilder(metadata_handler, RELATION_TYPES)
+schema_handler = SchemaHandler(db_handler)
+if CACHE_BACKEND == "redis":
+    cache_handler = CacheHandler(RedisCache(CACHE_REDIS_URL, ttl=CACHE_TTL))
+elif CACHE_BACKEND == "memory":
+    cache_handler = CacheHandler(LRUCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL))
+else:
+    cache_handler = None
+vector_index_handler = VectorIndexHandler(db_handler, VECTOR_INDEX_DIR, kind=VECTOR_INDEX_KIND) if VECTOR_INDEX_KIND else None
+
+ollama_client = AsyncClient(host=OLLAMA_HOST)
+cortex_handler = CortexHandler(ollama_client, CORTEX_MAX_CONCURRENCY_PER_MODEL)
+embedding_handler = EmbeddingHandler(
+    ollama_client,
+    store_path=EMBEDDING_STORE_PATH,
+    max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_concurrency=EMBEDDING_MAX_CONCURRENCY
+)
+if EMBEDDING_WORKERS:
+    embedding_pipeline_handler = EmbeddingPipelineHandler(
+        db_handler,
+        embedding_handler,
+        EMBEDDING_MODEL,
+        version=EMBEDDING_VERSION,
+        workers=EMBEDDING_WORKERS,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        vector_index=vector_index_handler,
+        cache_handler=cache_handler
+    )
+else:
+    embedding_pipeline_handler = None
+
+node_loader_handler = NodeLoaderHandler(db_handler, metadata_handler, NODE_LOADER_BATCH_WINDOW, NODE_LOADER_MAX_BATCH_SIZE)
 
 # Initialize the handlers
-user_handler = UserHandler(db_handler)
-thing_handler = ThingHandler(db_handler)
-place_handler = PlaceHandler(db_handler)
-filter_handler = FilterHandler(db_handler)
+user_handler = UserHandler(db_handler, metadata_handler, cache_handler, query_builder, node_loader_handler)
+thing_handler = ThingHandler(db_handler, vector_index_handler, metadata_handler, cache_handler, query_builder, embedding_pipeline_handler, node_loader_handler)
+place_handler = PlaceHandler(db_handler, metadata_handler, cache_handler, query_builder, node_loader_handler)
+task_handler = TaskHandler(db_handler, vector_index_handler, metadata_handler, cache_handler, query_builder, embedding_pipeline_handler, node_loader_handler)
+filter_handler = FilterHandler(db_handler, metadata_handler, query_builder)
+graph_handler = GraphHandler(db_handler, metadata_handler, query_builder, vector_index_handler, cache_handler)
+snapshot_handler = SnapshotHandler(db_handler, query_builder)
 
 def get_db_handler():
     return db_handler
 
+def get_metrics_handler():
+    return metrics_handler
+
+def get_metadata_handler():
+    return metadata_handler
+
+def get_query_builder():
+    return query_builder
+
+def get_schema_handler():
+    return schema_handler
+
+def get_cache_handler():
+    return cache_handler
+
+def get_vector_index_handler():
+    return vector_index_handler
+
 def get_user_handler():
     return user_handler
 
@@ -25,5 +201,29 @@ def get_thing_handler():
 def get_place_handler():
     return place_handler
 
+def get_task_handler():
+    return task_handler
+
 def get_filter_handler():
     return filter_handler
+
+def get_graph_handler():
+    return graph_handler
+
+def get_snapshot_handler():
+    return snapshot_handler
+
+def get_ollama_client():
+    return ollama_client
+
+def get_cortex_handler():
+    return cortex_handler
+
+def get_embedding_handler():
+    return embedding_handler
+
+def get_embedding_pipeline_handler():
+    return embedding_pipeline_handler
+
+def get_node_loader_handler():
+    return node_loader_handler
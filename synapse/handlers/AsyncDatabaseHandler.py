@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+from neo4j import AsyncGraphDatabase, READ_ACCESS, WRITE_ACCESS
+from neo4j.exceptions import DriverError, Neo4jError
+
+class UnitOfWork:
+    # Handed to the functions passed to run_in_transaction; every run() takes
+    # part in the same transaction
+    def __init__(self, tx, db_handler):
+        self.tx = tx
+        self.db_handler = db_handler
+
+    async def run(self, query, parameters=None):
+        return await self.db_handler._run(self.tx, query, parameters)
+
+class AsyncDatabaseHandler:
+    def __init__(self, uri, user, password, max_connection_pool_size=100,
+                 connection_acquisition_timeout=60.0, max_connection_lifetime=3600,
+                 max_transaction_retry_time=15.0, metrics_handler=None):
+        self.metrics_handler = metrics_handler
+        self.uri = uri
+        self.auth = (user, password)
+        self.max_connection_pool_size = max_connection_pool_size
+        self.connection_acquisition_timeout = connection_acquisition_timeout
+        self.max_connection_lifetime = max_connection_lifetime
+        self.max_transaction_retry_time = max_transaction_retry_time
+        # Created on first use, so building the handlers needs no database
+        self._driver = None
+
+    @property
+    def driver(self):
+        if self._driver is None:
+            # Managed transactions (execute_read / execute_write) are retried by the
+            # driver on transient errors and lost connections, with exponential
+            # backoff and jitter, for at most max_transaction_retry_time seconds
+            self._driver = AsyncGraphDatabase.driver(
+                self.uri,
+                auth=self.auth,
+                max_connection_pool_size=self.max_connection_pool_size,
+                connection_acquisition_timeout=self.connection_acquisition_timeout,
+                max_connection_lifetime=self.max_connection_lifetime,
+                max_transaction_retry_time=self.max_transaction_retry_time
+            )
+        return self._driver
+
+    async def warm_up(self, connections=0):
+        # Fails when the database cannot be reached or the credentials are
+        # wrong, then opens `connections` pooled connections so the first
+        # requests do not pay for the handshakes
+        await self.driver.verify_connectivity()
+        connections = min(connections, self.max_connection_pool_size)
+        if not connections:
+            return
+        barrier = asyncio.Barrier(connections)
+
+        async def open_connection():
+            try:
+                async with self.driver.session() as session:
+                    # An open transaction keeps its connection out of the pool,
+                    # so every session holds its own until all of them are open
+                    async with await session.begin_transaction() as tx:
+                        result = await tx.run("RETURN 1")
+                        await result.consume()
+                        await barrier.wait()
+            except Exception:
+                await barrier.abort()
+                raise
+
+        await asyncio.gather(*(open_connection() for _ in range(connections)))
+
+    async def close(self):
+        if self._driver is not None:
+            await self._driver.close()
+            self._driver = None
+
+    async def _observe(self, query, parameters, start, rows, result=None, error=None):
+        # The summary is only fetched once the records have been read, so it adds no round trip
+        available_after = consumed_after = None
+        if result is not None:
+            summary = await result.consume()
+            available_after, consumed_after = summary.result_available_after, summary.result_consumed_after
+        self.metrics_handler.observe_query(query, parameters, time.perf_counter() - start, rows, available_after, consumed_after, error)
+
+    async def _run(self, runner, query, parameters=None):
+        # `runner` is a session (auto-commit) or a transaction
+        if not self.metrics_handler:
+            result = await runner.run(query, parameters)
+            return [record async for record in result]
+
+        start = time.perf_counter()
+        try:
+            result = await runner.run(query, parameters)
+            records = [record async for record in result]
+        except Exception as e:
+            await self._observe(query, parameters, start, 0, error=e)
+            raise
+        await self._observe(query, parameters, start, len(records), result)
+        return records
+
+    async def execute_query(self, query, parameters=None):
+        # Auto-commit and not retried; meant for schema statements and
+        # CALL { ... } IN TRANSACTIONS, which cannot run in a managed transaction
+        async with self.driver.session() as session:
+            return await self._run(session, query, parameters)
+
+    async def execute_read(self, query, parameters=None):
+        # Read transactions can be served by any member of a cluster
+        async with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            return await session.execute_read(self._run, query, parameters)
+
+    async def execute_write(self, query, parameters=None):
+        async with self.driver.session(default_access_mode=WRITE_ACCESS) as session:
+            return await session.execute_write(self._run, query, parameters)
+
+    async def execute_plan(self, query, parameters=None, profile=False):
+        # Returns the plan of EXPLAIN, or of PROFILE with rows and db hits per
+        # operator. PROFILE executes the query, so it runs as a read.
+        async def work(tx):
+            result = await tx.run(("PROFILE " if profile else "EXPLAIN ") + query, parameters)
+            summary = await result.consume()
+            return summary.profile if profile else summary.plan
+
+        async with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            return await session.execute_read(work)
+
+    async def run_in_transaction(self, work, *args, read=False, **kwargs):
+        # Calls work(unit_of_work, *args, **kwargs) inside one managed transaction
+        # and returns its result. On a transient error the whole function is
+        # called again, so it must not have side effects outside the transaction.
+        async def transaction_function(tx):
+            return await work(UnitOfWork(tx, self), *args, **kwargs)
+
+        async with self.driver.session(default_access_mode=READ_ACCESS if read else WRITE_ACCESS) as session:
+            if read:
+                return await session.execute_read(transaction_function)
+            return await session.execute_write(transaction_function)
+
+    async def stream_query(self, query, parameters=None):
+        # Yields records straight off the result cursor; the session stays open
+        # until the caller has consumed (or closed) the generator. Records that
+        # were already yielded cannot be replayed, so streams are not retried.
+        start = time.perf_counter()
+        rows = 0
+        async with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            try:
+                result = await session.run(query, parameters)
+                async for record in result:
+                    rows += 1
+                    yield record
+            except Exception as e:
+                if self.metrics_handler:
+                    await self._observe(query, parameters, start, rows, error=e)
+                raise
+            if self.metrics_handler:
+                await self._observe(query, parameters, start, rows, result)
+
+    async def _write_rows(self, query, rows, records, errors, raise_driver_errors=False):
+        # A chunk the database rejects is split in halves until the failing
+        # rows are isolated, so the valid rows around them are still written
+        try:
+            records.extend(await self.execute_write(query, {'rows': rows}))
+        except DriverError as e:
+            # Connection problems say nothing about the rows; the driver has
+            # already retried, so the chunk is reported and the next one tried,
+            # unless the caller has to stop at the last committed chunk
+            if raise_driver_errors:
+                raise
+            errors.extend({'index': row['index'], 'error': str(e)} for row in rows)
+        except (Neo4jError, TypeError, ValueError) as e:
+            if len(rows) == 1:
+                errors.append({'index': rows[0]['index'], 'error': str(e)})
+                return
+            middle = len(rows) // 2
+            await self._write_rows(query, rows[:middle], records, errors, raise_driver_errors)
+            await self._write_rows(query, rows[middle:], records, errors, raise_driver_errors)
+
+    async def execute_in_chunks(self, query, rows, chunk_size=1000, raise_driver_errors=False):
+        # Each chunk is sent as $rows and committed in its own transaction.
+        # Rows that fail are reported by their 'index', which every row must
+        # carry; the rest of their chunk is still committed. With
+        # raise_driver_errors a lost connection is raised instead of reported.
+        records = []
+        errors = []
+        for start in range(0, len(rows), chunk_size):
+            await self._write_rows(query, rows[start:start + chunk_size], records, errors, raise_driver_errors)
+        return records, errors
+
+    async def remove_all(self):
+        query = """
+        MATCH (n)
+        DETACH DELETE n
+        """
+        await self.execute_write(query)
@@ -0,0 +1,166 @@
+import copy
+import json
+import time
+from collections import OrderedDict
+
+from handlers.NodeMapper import serializable
+
+class LRUCache:
+    # Per-process: entries are only invalidated by writes made through this
+    # process, so with several API workers use RedisCache. Values are copied in
+    # and out, so callers can change what they get without touching the entry.
+    def __init__(self, max_entries=10000, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.version = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.tags.get(entry[2])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[entry[2]]
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        value, expires_at, _ = entry
+        if expires_at < time.monotonic():
+            self._discard(key)
+            self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return copy.deepcopy(value)
+
+    async def set(self, key, value, tag):
+        self._discard(key)
+        self.entries[key] = (copy.deepcopy(value), time.monotonic() + self.ttl, tag)
+        self.tags.setdefault(tag, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._discard(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+
+    async def invalidate(self, tag):
+        for key in list(self.tags.get(tag, ())):
+            self._discard(key)
+            self.stats['invalidations'] += 1
+
+    async def get_version(self):
+        return self.version
+
+    async def bump_version(self):
+        self.version += 1
+
+    async def clear(self):
+        self.entries.clear()
+        self.tags.clear()
+
+    async def get_stats(self):
+        return {**self.stats, 'entries': len(self.entries), 'max_entries': self.max_entries, 'graph_version': self.version}
+
+
+class RedisCache:
+    # Shared cache for several API workers; entries and their tag sets expire in Redis
+    def __init__(self, url, ttl=60.0, prefix='synapse:cache:'):
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    async def get(self, key):
+        value = await self.redis.get(self.prefix + key)
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return json.loads(value)
+
+    async def set(self, key, value, tag):
+        tag_key = f"{self.prefix}tag:{tag}"
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(self.prefix + key, json.dumps(value, default=serializable), ex=self.ttl)
+            pipe.sadd(tag_key, key)
+            pipe.expire(tag_key, self.ttl)
+            await pipe.execute()
+
+    async def invalidate(self, tag):
+        tag_key = f"{self.prefix}tag:{tag}"
+        keys = await self.redis.smembers(tag_key)
+        if keys:
+            await self.redis.delete(*[self.prefix + key.decode() for key in keys])
+            self.stats['invalidations'] += len(keys)
+        await self.redis.delete(tag_key)
+
+    async def get_version(self):
+        # Shared by all workers so a write on one of them retires every worker's subgraphs
+        return int(await self.redis.get(self.prefix + 'graph_version') or 0)
+
+    async def bump_version(self):
+        await self.redis.incr(self.prefix + 'graph_version')
+
+    async def clear(self):
+        async for key in self.redis.scan_iter(match=self.prefix + '*'):
+            if key.decode() != self.prefix + 'graph_version':
+                await self.redis.delete(key)
+
+    async def get_stats(self):
+        info = await self.redis.info('stats')
+        return {**self.stats, 'evictions': info.get('evicted_keys', 0), 'expirations': info.get('expired_keys', 0), 'graph_version': await self.get_version()}
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+class CacheHandler:
+    # Read-through cache for node lookups. Entries are tagged with the element id
+    # of the node they hold, so a write to that node drops every key pointing at
+    # it (by id and by name alike). Every invalidation also bumps the graph
+    # version; subgraphs are cached under the version they were read at, so any
+    # write makes them unreachable and they age out of the cache.
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def get(self, label, field, value):
+        return await self.backend.get(f"{label}:{field}:{value}")
+
+    async def set(self, label, field, value, node):
+        await self.backend.set(f"{label}:{field}:{value}", node, node['id'])
+
+    async def invalidate(self, *ids):
+        ids = [id for id in ids if id is not None]
+        for id in ids:
+            await self.backend.invalidate(id)
+        if ids:
+            await self.backend.bump_version()
+
+    async def graph_version(self):
+        return await self.backend.get_version()
+
+    async def get_subgraph(self, version, key):
+        return await self.backend.get(f"subgraph:{version}:{key}")
+
+    async def set_subgraph(self, version, key, id, subgraph):
+        # `version` is the one read before the query, so a write that lands
+        # meanwhile leaves this entry under an outdated version
+        await self.backend.set(f"subgraph:{version}:{key}", subgraph, id)
+
+    async def clear(self):
+        await self.backend.clear()
+
+    async def get_stats(self):
+        return await self.backend.get_stats()
+
+    async def close(self):
+        if hasattr(self.backend, 'close'):
+            await self.backend.close()
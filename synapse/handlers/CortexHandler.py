@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+class CortexHandler:
+    # Chat and generate calls to Ollama. Each model has its own semaphore, so a
+    # slow model only queues its own requests. Streams hold their slot until
+    # they finish or the client goes away; closing a stream closes the upstream
+    # HTTP response, which stops the generation in Ollama.
+    def __init__(self, client, max_concurrency_per_model=2):
+        self.client = client
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.semaphores = {}
+        self.stats = {}
+
+    @asynccontextmanager
+    async def _slot(self, model):
+        if model not in self.semaphores:
+            self.semaphores[model] = asyncio.Semaphore(self.max_concurrency_per_model)
+            self.stats[model] = {'running': 0, 'waiting': 0, 'requests': 0}
+        stats = self.stats[model]
+        stats['waiting'] += 1
+        try:
+            await self.semaphores[model].acquire()
+        finally:
+            stats['waiting'] -= 1
+        stats['running'] += 1
+        stats['requests'] += 1
+        try:
+            yield
+        finally:
+            stats['running'] -= 1
+            self.semaphores[model].release()
+
+    async def chat(self, model, messages):
+        async with self._slot(model):
+            response = await self.client.chat(model=model, messages=messages)
+        return response['message']['content']
+
+    async def generate(self, model, prompt):
+        async with self._slot(model):
+            response = await self.client.generate(model=model, prompt=prompt)
+        return response['response']
+
+    async def _stream(self, model, request, content):
+        # Yields the text of every chunk, then the final chunk's stats as a dict
+        async with self._slot(model):
+            parts = await request()
+            try:
+                async for part in parts:
+                    text = content(part)
+                    if text:
+                        yield text
+                    if part.get('done'):
+                        yield {key: part.get(key) for key in ('done_reason', 'total_duration', 'load_duration', 'prompt_eval_count', 'eval_count', 'eval_duration')}
+            finally:
+                # Runs on completion and on cancellation when the client disconnects
+                await parts.aclose()
+
+    def stream_chat(self, model, messages):
+        return self._stream(
+            model,
+            lambda: self.client.chat(model=model, messages=messages, stream=True),
+            lambda part: part['message']['content']
+        )
+
+    def stream_generate(self, model, prompt):
+        return self._stream(
+            model,
+            lambda: self.client.generate(model=model, prompt=prompt, stream=True),
+            lambda part: part['response']
+        )
+
+    def get_stats(self):
+        return {'max_concurrency_per_model': self.max_concurrency_per_model, 'models': self.stats}
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from handlers.VectorIndexHandler import pack_vector, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+def content_key(model, text):
+    # Embeddings only depend on the model and the exact text
+    return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+class EmbeddingStore:
+    # On-disk embedding cache in SQLite, vectors as float32 blobs. Calls run in
+    # a worker thread so the event loop never waits on the disk.
+    def __init__(self, path):
+        self.path = path
+        # Opened on first use, so importing the app does not touch the disk
+        self.connection = None
+        self.lock = asyncio.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """)
+            connection.commit()
+            self.connection = connection
+        return self.connection
+
+    def _get_many(self, keys):
+        found = {}
+        # SQLite limits the number of bound variables per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._connect().execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((key, unpack_vector(vector)) for key, vector in rows)
+        return found
+
+    def _set_many(self, rows):
+        connection = self._connect()
+        connection.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
+
+    async def get_many(self, keys):
+        async with self.lock:
+            return await asyncio.to_thread(self._get_many, keys)
+
+    async def set_many(self, model, vectors):
+        rows = [(key, model, pack_vector(vector), time.time()) for key, vector in vectors.items()]
+        async with self.lock:
+            await asyncio.to_thread(self._set_many, rows)
+
+    def count(self):
+        return self._connect().execute("SELECT count(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class EmbeddingHandler:
+    # Embeds texts with Ollama behind a two-level cache keyed on a hash of
+    # (model, text): an in-memory LRU and an optional SQLite store that survives
+    # restarts. Missing texts are deduplicated and sent in batches of
+    # batch_size to /api/embed, with at most max_concurrency requests in flight.
+    def __init__(self, client, store_path=None, max_entries=10000, batch_size=64, max_concurrency=4, max_prompts=1000):
+        self.client = client
+        self.store = EmbeddingStore(store_path) if store_path else None
+        self.max_entries = max_entries
+        self.batch_size = batch_size
+        self.max_prompts = max_prompts
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.entries = OrderedDict()
+        self.stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0, 'requests': 0}
+
+    def _remember(self, key, vector):
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def _embed_batch(self, model, texts):
+        async with self.semaphore:
+            self.stats['requests'] += 1
+            response = await self.client.embed(model=model, input=texts)
+        embeddings = response['embeddings']
+        # Pairing the vectors with their texts needs exactly one per text
+        if len(embeddings) != len(texts):
+            raise RuntimeError(f"Ollama returned {len(embeddings)} embeddings for {len(texts)} prompts with model '{model}'.")
+        return embeddings
+
+    async def embed(self, model, texts):
+        # Returns one vector per text, in order
+        if len(texts) > self.max_prompts:
+            raise ValueError(f"At most {self.max_prompts} prompts per request.")
+        keys = [content_key(model, text) for text in texts]
+        vectors = {}
+        for key in keys:
+            if key in self.entries and key not in vectors:
+                self.entries.move_to_end(key)
+                vectors[key] = self.entries[key]
+                self.stats['memory_hits'] += 1
+
+        missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+        if missing and self.store:
+            stored = await self.store.get_many(missing)
+            self.stats['store_hits'] += len(stored)
+            for key, vector in stored.items():
+                vectors[key] = vector
+                self._remember(key, vector)
+            missing = [key for key in missing if key not in stored]
+
+        if missing:
+            self.stats['misses'] += len(missing)
+            texts_by_key = dict(zip(keys, texts))
+            batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+            results = await asyncio.gather(*(self._embed_batch(model, [texts_by_key[key] for key in batch]) for batch in batches))
+            computed = {key: list(vector) for batch, embeddings in zip(batches, results) for key, vector in zip(batch, embeddings)}
+            for key, vector in computed.items():
+                vectors[key] = vector
+                self._remember(key, vector)
+            if self.store:
+                await self.store.set_many(model, computed)
+
+        return [vectors[key] for key in keys]
+
+    async def get_stats(self):
+        stats = {**self.stats, 'entries': len(self.entries), 'max_entries': self.max_entries}
+        if self.store:
+            async with self.store.lock:
+                stats['stored'] = await asyncio.to_thread(self.store.count)
+        return stats
+
+    def close(self):
+        if self.store:
+            self.store.close()
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# The text embedded for each label
+EMBEDDED_TEXT = {
+    'Thing': 'name',
+    'Task': 'title'
+}
+MAX_QUEUE_SIZE = 10000
+MAX_JOBS = 100
+MAX_RETRY_DELAY = 300.0
+SCAN_PAGE_SIZE = 1000
+
+class EmbeddingPipelineHandler:
+    # Computes node vectors in the background. Creates and updates only enqueue
+    # (label, id); workers take up to batch_size queued nodes at a time, read
+    # their current text, embed it through the EmbeddingHandler and write the
+    # vectors back with one UNWIND per label. Each node records the
+    # embedding_model and embedding_version its vector was made with, so a
+    # re-embed job can find the nodes that are out of date. A batch that fails
+    # is queued again with an exponential backoff, up to max_attempts times.
+    # Nodes that did not fit in the queue, or were lost with it on shutdown,
+    # are found again by a catch-up job: it queues every node without a vector
+    # or whose text changed after it was embedded.
+    def __init__(self, db_handler, embedding_handler, model, version=1, workers=2, batch_size=64, batch_window=0.05,
+                 vector_index=None, cache_handler=None, max_attempts=5, retry_delay=1.0, max_queue_size=MAX_QUEUE_SIZE):
+        self.db_handler = db_handler
+        self.embedding_handler = embedding_handler
+        self.model = model
+        self.version = version
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.vector_index = vector_index
+        self.cache_handler = cache_handler
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(max_queue_size)
+        # Set when enqueue dropped nodes; a catch-up job runs once the queue drains
+        self.overflowed = False
+        self.catch_up = None
+        # Nodes waiting in the queue, so a node updated twice is embedded once
+        self.pending = set()
+        self.tasks = []
+        self.jobs = {}
+        self.job_tasks = set()
+        # Failed attempts per (label, id), and the tasks waiting to queue them again
+        self.attempts = {}
+        self.retry_tasks = set()
+        self.stats = {'embedded': 0, 'retried': 0, 'failed': 0, 'dropped': 0, 'batches': 0}
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._start_catch_up()
+
+    async def stop(self):
+        tasks = [*self.tasks, *self.retry_tasks, *self.job_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+
+    def text(self, label, properties):
+        return "\n".join(value for value in (properties.get(EMBEDDED_TEXT[label]), properties.get('description')) if value)
+
+    def enqueue(self, label, *ids):
+        # Never waits, so creates and updates do not depend on how far behind
+        # the workers are; what does not fit is left to the catch-up job
+        for id in ids:
+            if (label, id) in self.pending:
+                continue
+            try:
+                self.queue.put_nowait((label, id))
+            except asyncio.QueueFull:
+                self.stats['dropped'] += 1
+                self.overflowed = True
+                continue
+            self.pending.add((label, id))
+
+    async def _put(self, label, id):
+        # For the jobs, which wait for room instead
+        if (label, id) not in self.pending:
+            self.pending.add((label, id))
+            await self.queue.put((label, id))
+
+    def _start_catch_up(self):
+        if self.catch_up is None or self.catch_up['state'] != 'running':
+            self.overflowed = False
+            self.catch_up = self._start_job(self._queue_missing, tuple(EMBEDDED_TEXT), False)
+
+    async def _next_batch(self):
+        # Waits for one node, then gathers whatever arrives within batch_window
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Updates from here on are queued again and picked up by a later batch
+        self.pending.difference_update(batch)
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            groups = {}
+            for label, id in batch:
+                groups.setdefault(label, []).append(id)
+            for label, ids in groups.items():
+                try:
+                    await self._embed(label, ids)
+                except Exception as e:
+                    logger.error(f"Embedding {len(ids)} {label} nodes failed: {str(e)}")
+                    self._retry(label, ids)
+            for _ in batch:
+                self.queue.task_done()
+            if self.overflowed and self.queue.empty():
+                self._start_catch_up()
+
+    def _retry(self, label, ids):
+        retry = []
+        for id in ids:
+            attempts = self.attempts.get((label, id), 0) + 1
+            if attempts >= self.max_attempts:
+                self.attempts.pop((label, id), None)
+                self.stats['failed'] += 1
+            else:
+                self.attempts[(label, id)] = attempts
+                retry.append(id)
+        if not retry:
+            return
+        attempts = max(self.attempts[(label, id)] for id in retry)
+        delay = min(self.retry_delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+        self.stats['retried'] += len(retry)
+        task = asyncio.create_task(self._requeue(label, retry, delay))
+        self.retry_tasks.add(task)
+        task.add_done_callback(self.retry_tasks.discard)
+
+    async def _requeue(self, label, ids, delay):
+        await asyncio.sleep(delay)
+        self.enqueue(label, *ids)
+
+    async def _embed(self, label, ids):
+        query = f"""
+        UNWIND $ids AS id
+        MATCH (n:{label})
+        WHERE elementId(n) = id
+        RETURN elementId(n) AS id, n.{EMBEDDED_TEXT[label]} AS {EMBEDDED_TEXT[label]}, n.description AS description
+        """
+        result = await self.db_handler.execute_read(query, {'ids': ids})
+        nodes = [(record['id'], self.text(label, record)) for record in result]
+        nodes = [(id, text) for id, text in nodes if text]
+        if not nodes:
+            for id in ids:
+                self.attempts.pop((label, id), None)
+            return
+
+        vectors = await self.embedding_handler.embed(self.model, [text for _, text in nodes])
+        if self.vector_index and label in self.vector_index.indexes:
+            self.vector_index.check_dimension(label, vectors[0])
+        query = f"""
+        UNWIND $rows AS row
+        MATCH (n:{label})
+        WHERE elementId(n) = row.id
+        SET n.vector = row.vector,
+            n.embedding_model = $model,
+            n.embedding_version = $version,
+            n.embedded_at = $embedded_at
+        RETURN elementId(n) AS id
+        """
+        rows = [{'id': id, 'vector': vector} for (id, _), vector in zip(nodes, vectors)]
+        result = await self.db_handler.execute_write(query, {
+            'rows': rows,
+            'model': self.model,
+            'version': self.version,
+            'embedded_at': datetime.now().isoformat()
+        })
+        written = {record['id'] for record in result}
+        if self.vector_index:
+            for row in rows:
+                if row['id'] in written:
+                    self.vector_index.add(label, row['id'], row['vector'])
+        if self.cache_handler:
+            await self.cache_handler.invalidate(*written)
+        for id in ids:
+            self.attempts.pop((label, id), None)
+        self.stats['embedded'] += len(written)
+        self.stats['batches'] += 1
+
+    def _scan_query(self, label, condition):
+        # One keyset page over the created_at index (as QueryBuilder.list_nodes)
+        return f"""
+        MATCH (n:{label})
+        WHERE n.created_at >= $from AND ($after_id IS NULL OR n.created_at > $from OR elementId(n) > $after_id)
+          AND ({condition})
+        RETURN elementId(n) AS id, n.created_at AS created_at
+        ORDER BY created_at, id
+        LIMIT $limit
+        """
+
+    async def _queue_missing(self, job, labels, force):
+        # Nodes with text to embed and no vector, or with a vector older than
+        # their last update. Client vectors have no embedded_at, so they stay.
+        await self._queue_nodes(job, labels, lambda label: f"""(n.vector IS NULL OR n.embedded_at < n.updated_at)
+          AND (n.{EMBEDDED_TEXT[label]} IS NOT NULL OR n.description IS NOT NULL)""", {})
+
+    async def _reembed(self, job, labels, force):
+        await self._queue_nodes(job, labels, lambda label: "$force OR n.embedding_model IS NULL OR n.embedding_model <> $model OR n.embedding_version <> $version",
+                                {'force': force, 'model': self.model, 'version': self.version})
+
+    async def _queue_nodes(self, job, labels, condition, parameters):
+        # Each page is read in its own transaction, which is closed before
+        # waiting for room in the queue
+        try:
+            for label in labels:
+                query = self._scan_query(label, condition(label))
+                page = {'from': '', 'after_id': None, 'limit': SCAN_PAGE_SIZE}
+                while True:
+                    result = await self.db_handler.execute_read(query, {**parameters, **page})
+                    for record in result:
+                        await self._put(label, record['id'])
+                        job['queued'] += 1
+                    if len(result) < SCAN_PAGE_SIZE:
+                        break
+                    page = {'from': result[-1]['created_at'], 'after_id': result[-1]['id'], 'limit': SCAN_PAGE_SIZE}
+            job['state'] = 'completed'
+        except Exception as e:
+            job['state'] = 'failed'
+            job['error'] = str(e)
+            logger.error(f"Embedding job {job['job_id']} failed: {str(e)}")
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+
+    def reembed(self, labels=tuple(EMBEDDED_TEXT), force=False):
+        # Queues every node whose vector was not made with the current model and
+        # version (all of them with force). Returns the job, which runs in the
+        # background; the vectors are written as the workers catch up.
+        for label in labels:
+            if label not in EMBEDDED_TEXT:
+                raise ValueError(f"Unknown label '{label}', expected one of {list(EMBEDDED_TEXT)}.")
+        return self._start_job(self._reembed, labels, force)
+
+    def _start_job(self, run, labels, force):
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'labels': list(labels),
+            'model': self.model,
+            'version': self.version,
+            'force': force,
+            'state': 'running',
+            'queued': 0,
+            'error': None,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None
+        }
+        self.jobs[job['job_id']] = job
+        while len(self.jobs) > MAX_JOBS:
+            del self.jobs[next(iter(self.jobs))]
+        task = asyncio.create_task(run(job, labels, force))
+        self.job_tasks.add(task)
+        task.add_done_callback(self.job_tasks.discard)
+        return job
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_status(self):
+        return {
+            **self.stats,
+            'model': self.model,
+            'version': self.version,
+            'queued': self.queue.qsize(),
+            'workers': len(self.tasks)
+        }
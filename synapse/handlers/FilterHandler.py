@@ -1,45 +1,156 @@
-import json
-from typing import Optional
+import re
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import QueryBuilder, NODE_LABELS
+
+PROPERTY = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+MAX_HOPS = 5
+DIRECTIONS = ('in', 'out', 'any')
+OPERATORS = {
+    'eq': '{field} = {param}',
+    'ne': '{field} <> {param}',
+    'lt': '{field} < {param}',
+    'lte': '{field} <= {param}',
+    'gt': '{field} > {param}',
+    'gte': '{field} >= {param}',
+    'in': '{field} IN {param}',
+    'contains': '{field} CONTAINS {param}',
+    'starts_with': '{field} STARTS WITH {param}',
+    'ends_with': '{field} ENDS WITH {param}',
+    'exists': '{field} IS NOT NULL'
+}
 
 class FilterHandler:
-    def __init__(self, db_handler):
+    # Compiles a filter into one parameterized read query. A filter selects
+    # elements `e` by label and predicates, and by related nodes reachable over
+    # given relation types within a hop range:
+    #
+    #   {"labels": ["Thing"],
+    #    "where": [{"field": "name", "op": "contains", "value": "lamp"},
+    #              {"field": "metadata.brand", "op": "eq", "value": "Acme"}],
+    #    "related": [{"direction": "in", "relation_types": ["OWNS"], "min_hops": 1, "max_hops": 1,
+    #                 "labels": ["User"], "where": [{"field": "username", "op": "eq", "value": "bob"}]}]}
+    #
+    # The first related filter with an equality predicate becomes the starting
+    # pattern so the query is anchored on an indexed lookup; the others become
+    # EXISTS subqueries. Results are ordered by element id and cut with LIMIT
+    # before properties are projected, with keyset pagination on the id. No
+    # index orders by element id, so without an anchor every node of the labels
+    # is matched and sorted before LIMIT applies.
+    def __init__(self, db_handler, metadata_handler=None, query_builder=None):
         self.db_handler = db_handler
+        self.metadata_handler = metadata_handler or MetadataHandler()
+        self.node_mapper = NodeMapper(self.metadata_handler)
+        self.query_builder = query_builder or QueryBuilder(self.metadata_handler)
 
-    def search_elements(self, username: Optional[str] = None, place_name: Optional[str] = None, thing_name: Optional[str] = None):
-        match_clauses = []
-        where_clauses = []
-        parameters = {}
+    def _field(self, var, field):
+        if field.startswith('metadata.'):
+            if self.metadata_handler.storage != 'properties':
+                raise ValueError("Metadata filters require the 'properties' metadata storage.")
+            name = self.metadata_handler.property_name(field[len('metadata.'):])
+        elif PROPERTY.match(field):
+            name = field
+        else:
+            raise ValueError(f"Invalid field '{field}'.")
+        return f"{var}.`{name.replace('`', '``')}`"
 
-        if username:
-            match_clauses.append("(u:User)-[r]->(e)")
-            where_clauses.append("u.username = $username")
-            parameters['username'] = username
+    def _predicates(self, var, predicates, parameters):
+        conditions = []
+        for predicate in predicates or []:
+            op = predicate.get('op', 'eq')
+            if op not in OPERATORS:
+                raise ValueError(f"Unknown operator '{op}', expected one of {list(OPERATORS)}.")
+            param = f"p{len(parameters)}"
+            if op != 'exists':
+                parameters[param] = predicate.get('value')
+            conditions.append(OPERATORS[op].format(field=self._field(var, predicate['field']), param=f"${param}"))
+        return conditions
 
-        if place_name:
-            match_clauses.append("(p:Place)-[r]->(e)")
-            where_clauses.append("p.name = $place_name")
-            parameters['place_name'] = place_name
+    def _labels(self, var, labels, default=()):
+        labels = [self.query_builder.label(label) for label in labels or default]
+        if not labels:
+            return var, []
+        if len(labels) == 1:
+            return f"{var}:{labels[0]}", []
+        # Several labels are an OR, expressed as a predicate
+        return var, ["(" + " OR ".join(f"{var}:{label}" for label in labels) + ")"]
 
-        if thing_name:
-            match_clauses.append("(t:Thing)")
-            where_clauses.append("t.name = $thing_name")
-            parameters['thing_name'] = thing_name
+    def _path(self, related, var):
+        # (e)<-[:A|B*1..2]-(n) for direction "in"
+        direction = related.get('direction', 'any')
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction '{direction}', expected one of {list(DIRECTIONS)}.")
+        min_hops = related.get('min_hops', 1)
+        max_hops = related.get('max_hops') or min_hops
+        if not 1 <= min_hops <= max_hops <= MAX_HOPS:
+            raise ValueError(f"Hops must satisfy 1 <= min_hops <= max_hops <= {MAX_HOPS}.")
+        types = "|".join(self.query_builder.relation_type(relation_type) for relation_type in related.get('relation_types') or [])
+        hops = "" if min_hops == max_hops == 1 else f"*{min_hops}..{max_hops}"
+        relationship = f"[{':' + types if types else ''}{hops}]"
+        node, conditions = self._labels(var, related.get('labels'))
+        left = "<-" if direction == 'in' else "-"
+        right = "->" if direction == 'out' else "-"
+        return f"(e){left}{relationship}{right}({node})", conditions
+
+    def compile(self, filter, after=None, limit=100):
+        parameters = {'after': after, 'limit': limit}
+        related = list(filter.get('related') or [])
+        anchor = next((item for item in related if any(p.get('op', 'eq') == 'eq' for p in item.get('where') or [])), None)
+
+        node, conditions = self._labels('e', filter.get('labels'), NODE_LABELS)
+        conditions += self._predicates('e', filter.get('where'), parameters)
+
+        if anchor:
+            related.remove(anchor)
+            path, anchor_conditions = self._path(anchor, 'anchor')
+            # The pattern is written from e; relabel it so the labels apply to e
+            match_clause = path.replace("(e)", f"({node})", 1)
+            conditions += anchor_conditions + self._predicates('anchor', anchor.get('where'), parameters)
+        else:
+            match_clause = f"({node})"
+
+        for index, item in enumerate(related):
+            var = f"n{index}"
+            path, path_conditions = self._path(item, var)
+            path_conditions += self._predicates(var, item.get('where'), parameters)
+            where = f" WHERE {' AND '.join(path_conditions)}" if path_conditions else ""
+            conditions.append(f"EXISTS {{ MATCH {path}{where} }}")
 
-        match_clause = " MATCH " + ", ".join(match_clauses) if match_clauses else ""
-        where_clause = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
-        
+        conditions.append("($after IS NULL OR elementId(e) > $after)")
         query = f"""
-        {match_clause}
-        {where_clause}
+        MATCH {match_clause}
+        WHERE {' AND '.join(conditions)}
+        WITH {"DISTINCT " if anchor else ""}e
+        ORDER BY elementId(e)
+        LIMIT $limit
         RETURN e, labels(e) AS labels, elementId(e) AS id
         """
-        result = self.db_handler.execute_query(query, parameters)
-        
+        return query, parameters
+
+    async def filter_elements(self, filter, after=None, limit=100):
+        query, parameters = self.compile(filter, after, limit)
+        result = await self.db_handler.execute_read(query, parameters)
+
         elements = []
         for record in result:
-            element = dict(record['e'])
-            element['id'] = record['id']
-            element['labels'] = record['labels']
-            elements.append(element)
-        
+            elements.append(self.node_mapper.node(record['e'], record['id'], labels=record['labels']))
         return elements
+
+    async def explain(self, filter, after=None, limit=100, profile=False):
+        # PROFILE runs the query; EXPLAIN only plans it
+        query, parameters = self.compile(filter, after, limit)
+        plan = await self.db_handler.execute_plan(query, parameters, profile)
+        return {'query': query, 'parameters': parameters, 'plan': plan}
+
+    async def search_elements(self, username=None, place_name=None, thing_name=None, after=None, limit=100):
+        # Elements related from the given user and/or place; thing_name narrows
+        # them to the Thing with that name
+        filter = {'related': []}
+        if username:
+            filter['related'].append({'direction': 'in', 'labels': ['User'], 'where': [{'field': 'username', 'op': 'eq', 'value': username}]})
+        if place_name:
+            filter['related'].append({'direction': 'in', 'labels': ['Place'], 'where': [{'field': 'name', 'op': 'eq', 'value': place_name}]})
+        if thing_name:
+            filter['labels'] = ['Thing']
+            filter['where'] = [{'field': 'name', 'op': 'eq', 'value': thing_name}]
+        return await self.filter_elements(filter, after, limit)
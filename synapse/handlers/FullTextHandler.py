@@ -0,0 +1,52 @@
+import re
+
+LUCENE_SPECIAL_CHARACTERS = re.compile(r'([+\-!(){}\[\]^"~*?:\\/&|])')
+LUCENE_OPERATORS = {'AND', 'OR', 'NOT', 'TO'}
+
+def escape_lucene_term(term):
+    if term in LUCENE_OPERATORS:
+        term = term.lower()
+    return LUCENE_SPECIAL_CHARACTERS.sub(r'\\\1', term)
+
+def build_lucene_query(text, fuzzy=False, prefix=False):
+    # Every term must match; prefix and fuzzy matching apply per term
+    clauses = []
+    for term in text.split():
+        term = escape_lucene_term(term)
+        if prefix and fuzzy:
+            clauses.append(f"({term}* OR {term}~)")
+        elif prefix:
+            clauses.append(f"{term}*")
+        elif fuzzy:
+            clauses.append(f"{term}~")
+        else:
+            clauses.append(term)
+    return " AND ".join(clauses)
+
+class FullTextHandler:
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+
+    async def query_nodes(self, index_name, text, fuzzy=False, prefix=False, skip=0, limit=20, conditions=None, parameters=None, projection='node'):
+        # `conditions` are extra Cypher predicates on the yielded `node`;
+        # `projection` is what is returned as `node`
+        lucene_query = build_lucene_query(text, fuzzy, prefix)
+        if not lucene_query:
+            return []
+
+        # Hits stream out of the index in score order, so SKIP/LIMIT stop early
+        query = f"""
+        CALL db.index.fulltext.queryNodes($index_name, $lucene_query)
+        YIELD node, score
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        RETURN {projection} AS node, elementId(node) AS id, score
+        SKIP $skip
+        LIMIT $limit
+        """
+        return await self.db_handler.execute_read(query, {
+            **(parameters or {}),
+            'index_name': index_name,
+            'lucene_query': lucene_query,
+            'skip': skip,
+            'limit': limit
+        })
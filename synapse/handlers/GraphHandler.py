@@ -0,0 +1,433 @@
+import asyncio
+import csv
+import json
+import logging
+import tempfile
+import uuid
+from datetime import datetime
+from handlers.NodeMapper import NodeMapper
+from handlers.SnapshotHandler import read_snapshot
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('ndjson', 'csv', 'msgpack')
+CSV_COLUMNS = ('type', 'label', 'key', 'relation_type', 'source_label', 'source', 'target_label', 'target', 'properties', 'metadata')
+MAX_JOBS = 100
+MAX_JOB_ERRORS = 1000
+MAX_DEPTH = 4
+# Bodies up to this size are spooled in memory, larger ones to a temporary file
+SPOOL_MEMORY_SIZE = 16 * 1024 * 1024
+SPOOL_CHUNK_SIZE = 1024 * 1024
+# Jobs live in memory only and are lost on restart; every job says so
+JOB_NOTE = "Job state is kept in memory and lost on restart. After a restart, upload the file again with skip_lines=<committed_line>."
+
+class ImportJob:
+    def __init__(self, job_id, format, batch_size):
+        self.job_id = job_id
+        self.format = format
+        self.batch_size = batch_size
+        self.state = 'running'
+        self.lines_read = 0
+        # Every line up to committed_line has been written; a resumed import
+        # skips them
+        self.committed_line = 0
+        self.nodes = 0
+        self.relations = 0
+        self.errors = []
+        self.error_count = 0
+        self.error = None
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+
+    def add_error(self, line, error):
+        self.error_count += 1
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'format': self.format,
+            'state': self.state,
+            'lines_read': self.lines_read,
+            'committed_line': self.committed_line,
+            'nodes': self.nodes,
+            'relations': self.relations,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'error': self.error,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'note': JOB_NOTE
+        }
+
+class GraphHandler:
+    def __init__(self, db_handler, metadata_handler, query_builder, vector_index=None, cache_handler=None):
+        self.db_handler = db_handler
+        self.metadata_handler = metadata_handler
+        self.node_mapper = NodeMapper(metadata_handler)
+        self.query_builder = query_builder
+        self.vector_index = vector_index
+        self.cache_handler = cache_handler
+        self.jobs = {}
+        self.import_tasks = set()
+
+    async def create_relations(self, relations, chunk_size=1000):
+        # `relations` is a list of (index, dict) like the bulk node endpoints;
+        # one UNWIND query per relation type, committed per chunk
+        groups = {}
+        errors = []
+        for index, relation in relations:
+            properties = dict(relation.get('properties') or {})
+            try:
+                self.query_builder.relation_type(relation['relation_type'])
+                metadata_properties = self.metadata_handler.encode(properties.pop('metadata', None))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+                continue
+            groups.setdefault(relation['relation_type'], []).append({
+                'index': index,
+                'source_id': relation['source_id'],
+                'target_id': relation['target_id'],
+                'metadata_properties': metadata_properties,
+                'properties': properties
+            })
+
+        created = []
+        for relation_type, rows in groups.items():
+            result, chunk_errors = await self.db_handler.execute_in_chunks(self.query_builder.create_relations(relation_type), rows, chunk_size)
+            errors.extend(chunk_errors)
+            failed = {error['index'] for error in chunk_errors}
+            found = {record['index'] for record in result}
+            errors.extend({'index': row['index'], 'error': "Source or target not found"} for row in rows if row['index'] not in found and row['index'] not in failed)
+            created.extend({'index': record['index'], 'relation_id': record['relation_id']} for record in result)
+            if self.cache_handler:
+                await self.cache_handler.invalidate(*{id for record in result for id in (record['source_id'], record['target_id'])})
+
+        created.sort(key=lambda record: record['index'])
+        errors.sort(key=lambda error: error['index'])
+        return created, errors
+
+    def _neighborhood_query(self, depth, relation_types):
+        # One CALL per hop, unrolled so every hop can be capped: the frontier is
+        # deduplicated and cut to $limit nodes, and each frontier node expands
+        # to at most $fanout relationships. The nodes are then cut to $limit
+        # (the start node first) and only edges between kept nodes are returned.
+        relationship = f"[r:{'|'.join(relation_types)}]" if relation_types else "[r]"
+        hops = "".join(f"""
+        CALL {{
+            WITH m{hop - 1}
+            UNWIND m{hop - 1} AS frontier
+            WITH DISTINCT frontier LIMIT $limit
+            CALL {{
+                WITH frontier
+                MATCH (frontier)-{relationship}-(m)
+                RETURN r, m LIMIT $fanout
+            }}
+            RETURN collect(r) AS r{hop}, collect(m) AS m{hop}
+        }}""" for hop in range(1, depth + 1))
+        return f"""
+        MATCH (start)
+        WHERE elementId(start) = $id
+        WITH start, [start] AS m0
+        {hops}
+        WITH {" + ".join(f"m{hop}" for hop in range(depth + 1))} AS nodes, {" + ".join(f"r{hop}" for hop in range(1, depth + 1))} AS relationships
+        CALL {{
+            WITH nodes
+            UNWIND nodes AS n
+            WITH DISTINCT n LIMIT $limit
+            RETURN collect(n) AS kept
+        }}
+        RETURN [n IN kept | {{id: elementId(n), labels: labels(n), properties: n {{.*, vector: null}}}}] AS nodes,
+               [r IN relationships WHERE startNode(r) IN kept AND endNode(r) IN kept |
+                {{relation_id: elementId(r), relation_type: type(r), source_id: elementId(startNode(r)), target_id: elementId(endNode(r)), properties: properties(r)}}] AS edges
+        """
+
+    async def get_neighborhood(self, id, depth=2, limit=200, fanout=25, relation_types=None, use_cache=True):
+        # Nodes within `depth` hops of `id` (either direction) and the edges
+        # between them, or None if the node does not exist. Vectors are left out.
+        if not 1 <= depth <= MAX_DEPTH:
+            raise ValueError(f"depth must be between 1 and {MAX_DEPTH}.")
+        relation_types = sorted({self.query_builder.relation_type(relation_type) for relation_type in relation_types or []})
+
+        cache_key = f"{id}:{depth}:{limit}:{fanout}:{'|'.join(relation_types)}"
+        use_cache = use_cache and self.cache_handler is not None
+        if use_cache:
+            version = await self.cache_handler.graph_version()
+            subgraph = await self.cache_handler.get_subgraph(version, cache_key)
+            if subgraph is not None:
+                return subgraph
+
+        query = self._neighborhood_query(depth, relation_types)
+        result = await self.db_handler.execute_read(query, {'id': id, 'limit': limit, 'fanout': fanout})
+        if not result:
+            return None
+
+        nodes = [
+            self.node_mapper.node(node['properties'], node['id'], include_vector=False, labels=node['labels'])
+            for node in result[0]['nodes']
+        ]
+
+        # An edge is reached once from each side when both ends are expanded
+        edges = {}
+        for edge in result[0]['edges']:
+            if edge['relation_id'] not in edges:
+                properties = dict(edge['properties'])
+                metadata = self.metadata_handler.decode(properties)
+                if metadata is not None:
+                    properties['metadata'] = metadata
+                edges[edge['relation_id']] = {**edge, 'properties': properties}
+
+        subgraph = {'id': id, 'depth': depth, 'nodes': nodes, 'edges': list(edges.values())}
+        if use_cache:
+            await self.cache_handler.set_subgraph(version, cache_key, id, subgraph)
+        return subgraph
+
+    def get_job(self, job_id):
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def get_jobs(self):
+        return [job.to_dict() for job in self.jobs.values()]
+
+    def _start_job(self, job_id, format, batch_size, resume):
+        job = self.jobs.get(job_id) if job_id else None
+        if resume:
+            if job is None:
+                raise LookupError(f"Import job '{job_id}' not found.")
+            if job.state == 'running':
+                raise ValueError(f"Import job '{job_id}' is still running.")
+            job.state = 'running'
+            job.error = None
+            job.finished_at = None
+            job.batch_size = batch_size
+            return job
+
+        if job is not None and job.state == 'running':
+            raise ValueError(f"Import job '{job_id}' is still running.")
+        job = ImportJob(job_id or uuid.uuid4().hex, format, batch_size)
+        self.jobs.pop(job.job_id, None)
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > MAX_JOBS:
+            del self.jobs[next(iter(self.jobs))]
+        return job
+
+    async def _lines(self, chunks):
+        # Splits a byte stream into decoded lines without reading it all
+        buffer = b''
+        async for chunk in chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                yield line.rstrip(b'\r').decode('utf-8')
+        if buffer:
+            yield buffer.decode('utf-8')
+
+    def _parse_csv(self, line, header):
+        # One record per line; properties and metadata columns hold JSON objects
+        values = next(csv.reader([line]))
+        item = {column: value for column, value in zip(header, values) if value != ''}
+        for column in ('properties', 'metadata'):
+            if column in item:
+                item[column] = json.loads(item[column])
+        return item
+
+    async def _text_records(self, chunks, format):
+        # Yields (line number, item, parse error) for NDJSON and CSV bodies
+        header = None
+        line_number = 0
+        async for line in self._lines(chunks):
+            line_number += 1
+            if format == 'csv' and header is None:
+                header = next(csv.reader([line]))
+                unknown = set(header) - set(CSV_COLUMNS)
+                if unknown:
+                    raise ValueError(f"Unknown CSV columns {sorted(unknown)}, expected {list(CSV_COLUMNS)}.")
+                continue
+            if not line.strip():
+                continue
+            try:
+                yield line_number, self._parse_csv(line, header) if format == 'csv' else json.loads(line), None
+            except ValueError as e:
+                yield line_number, None, str(e)
+
+    async def _records(self, chunks, format):
+        if format == 'msgpack':
+            async for number, item in read_snapshot(chunks):
+                yield number, item, None
+        else:
+            async for record in self._text_records(chunks, format):
+                yield record
+
+    def _node_row(self, line, item, timestamp):
+        label = self.query_builder.label(item.get('label'))
+        key = item.get('key')
+        if key is None:
+            raise ValueError("Node without key.")
+        properties = dict(item.get('properties') or {})
+        properties.pop('import_key', None)
+        if self.vector_index and label in self.vector_index.indexes:
+            self.vector_index.check_dimension(label, properties.get('vector'))
+        return label, {
+            'index': line,
+            'key': str(key),
+            'timestamp': timestamp,
+            'properties': properties,
+            # Metadata is only replaced when the record has some; snapshots carry it in `properties`
+            'metadata_properties': self.metadata_handler.encode(item['metadata']) if 'metadata' in item else {}
+        }
+
+    def _relation_row(self, line, item):
+        relation_type = self.query_builder.relation_type(item.get('relation_type'))
+        source_label = self.query_builder.label(item.get('source_label'))
+        target_label = self.query_builder.label(item.get('target_label'))
+        if item.get('source') is None or item.get('target') is None:
+            raise ValueError("Relation without source or target key.")
+        key = item.get('key')
+        properties = dict(item.get('properties') or {})
+        properties.pop('import_key', None)
+        return (relation_type, source_label, target_label, key is not None), {
+            'index': line,
+            'key': str(key) if key is not None else None,
+            'source': str(item['source']),
+            'target': str(item['target']),
+            'properties': properties,
+            'metadata_properties': self.metadata_handler.encode(item['metadata']) if 'metadata' in item else {}
+        }
+
+    async def _flush(self, job, nodes, relations):
+        # Nodes go first so relations in the same batch can find their endpoints.
+        # A lost connection fails the job, which then stays at the last
+        # committed_line; the merges make replaying this batch on resume harmless.
+        touched = set()
+        for label, rows in nodes.items():
+            result, errors = await self.db_handler.execute_in_chunks(self.query_builder.merge_nodes(label), rows, job.batch_size, raise_driver_errors=True)
+            for error in errors:
+                job.add_error(error['index'], error['error'])
+            job.nodes += len(result)
+            touched.update(record['id'] for record in result)
+            if self.vector_index and label in self.vector_index.indexes:
+                vectors = {row['index']: row['properties'].get('vector') for row in rows}
+                for record in result:
+                    self.vector_index.add(label, record['id'], vectors[record['index']])
+
+        for (relation_type, source_label, target_label, keyed), rows in relations.items():
+            query = self.query_builder.merge_relations(relation_type, source_label, target_label, keyed)
+            result, errors = await self.db_handler.execute_in_chunks(query, rows, job.batch_size, raise_driver_errors=True)
+            for error in errors:
+                job.add_error(error['index'], error['error'])
+            failed = {error['index'] for error in errors}
+            found = {record['index'] for record in result}
+            for row in rows:
+                if row['index'] not in found and row['index'] not in failed:
+                    job.add_error(row['index'], "Source or target not found")
+            job.relations += len(result)
+            touched.update(id for record in result for id in (record['source_id'], record['target_id']))
+
+        if self.cache_handler and touched:
+            await self.cache_handler.invalidate(*touched)
+        nodes.clear()
+        relations.clear()
+
+    async def import_graph(self, chunks, format='ndjson', batch_size=1000, job_id=None, resume=False, skip_lines=0):
+        # Spools `chunks` (an async iterator of bytes, the request body), then
+        # imports it in a background task, so the job outlives the request and
+        # is followed with get_job. Lines are
+        # {"type": "node", "label", "key", "properties", "metadata"} or
+        # {"type": "relation", "relation_type", "source_label", "source",
+        # "target_label", "target", "key", "properties", "metadata"}; CSV uses the same
+        # names as columns, and msgpack snapshots are decoded into the same items
+        # (lines are then snapshot records). Rows are buffered and written
+        # batch_size at a time. Nodes and keyed relations are merged on import_key,
+        # relations without a key on their type, so replaying lines after a
+        # failure is harmless.
+        job = self._start_job(job_id, format, batch_size, resume)
+        skip_lines = max(skip_lines, job.committed_line if resume else 0)
+        try:
+            spool = await self._spool(chunks)
+        except Exception as e:
+            # The client went away mid-upload
+            job.state = 'failed'
+            job.error = f"Upload interrupted: {str(e)}"
+            job.finished_at = datetime.now().isoformat()
+            return job.to_dict()
+
+        task = asyncio.create_task(self._import(job, spool, format, batch_size, skip_lines))
+        self.import_tasks.add(task)
+        task.add_done_callback(self.import_tasks.discard)
+        return job.to_dict()
+
+    async def stop(self):
+        tasks = list(self.import_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _spool(self, chunks):
+        spool = tempfile.SpooledTemporaryFile(SPOOL_MEMORY_SIZE)
+        try:
+            async for chunk in chunks:
+                await asyncio.to_thread(spool.write, chunk)
+        except BaseException:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool
+
+    async def _read_spool(self, spool):
+        while True:
+            chunk = await asyncio.to_thread(spool.read, SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    async def _import(self, job, spool, format, batch_size, skip_lines):
+        chunks = self._read_spool(spool)
+        timestamp = datetime.now().isoformat()
+        nodes = {}
+        relations = {}
+        buffered = 0
+        line_number = 0
+
+        try:
+            async for line_number, item, parse_error in self._records(chunks, format):
+                job.lines_read = line_number
+                if line_number <= skip_lines:
+                    continue
+                if parse_error:
+                    job.add_error(line_number, parse_error)
+                    continue
+
+                try:
+                    if item.get('type') == 'node':
+                        label, row = self._node_row(line_number, item, timestamp)
+                        nodes.setdefault(label, []).append(row)
+                    elif item.get('type') == 'relation':
+                        group, row = self._relation_row(line_number, item)
+                        relations.setdefault(group, []).append(row)
+                    else:
+                        raise ValueError(f"Unknown record type '{item.get('type')}', expected 'node' or 'relation'.")
+                except (ValueError, TypeError, AttributeError) as e:
+                    job.add_error(line_number, str(e))
+                    continue
+
+                buffered += 1
+                if buffered >= batch_size:
+                    await self._flush(job, nodes, relations)
+                    buffered = 0
+                    job.committed_line = line_number
+
+            await self._flush(job, nodes, relations)
+            job.committed_line = line_number
+            job.state = 'completed'
+        except Exception as e:
+            job.state = 'failed'
+            job.error = str(e)
+            logger.error(f"Import {job.job_id} failed after line {job.committed_line}: {str(e)}")
+        finally:
+            spool.close()
+            job.finished_at = datetime.now().isoformat()
+            if job.state == 'running':
+                # Cancelled on shutdown
+                job.state = 'failed'
+                job.error = "Import interrupted"
@@ -0,0 +1,170 @@
+import json
+
+class MetadataHandler:
+    # In "properties" storage a metadata key is flattened into a native property:
+    # scalars and homogeneous lists become meta_<key>, nested dicts are joined
+    # with "__" (meta_specs__ram), anything else is kept as JSON in metajson_<key>.
+    # The whole metadata is also kept as JSON in metadata_text, which only the
+    # full-text indexes read, since they cannot cover dynamic property names.
+    PREFIX = 'meta_'
+    JSON_PREFIX = 'metajson_'
+    TEXT_KEY = 'metadata_text'
+    SEPARATOR = '__'
+    STORAGES = ('json', 'properties')
+    OPERATORS = {
+        'eq': '=',
+        'ne': '<>',
+        'lt': '<',
+        'lte': '<=',
+        'gt': '>',
+        'gte': '>=',
+        'prefix': 'STARTS WITH'
+    }
+
+    def __init__(self, storage='json'):
+        if storage not in self.STORAGES:
+            raise ValueError(f"Unknown metadata storage '{storage}'. Expected one of {self.STORAGES}.")
+        self.storage = storage
+
+    def _is_storable(self, value):
+        scalar_types = (str, bool, int, float)
+        if isinstance(value, scalar_types):
+            return True
+        if isinstance(value, list) and value:
+            return all(isinstance(item, scalar_types) for item in value) and len({type(item) for item in value}) == 1
+        return False
+
+    def check_segment(self, segment, child=False, parent=False):
+        # Flattened names are split on "__" again when read back, so a key may
+        # not contain it, nor form it with the separator (a_ + b reads as a + _b)
+        if self.SEPARATOR in segment or (child and segment.startswith('_')) or (parent and segment.endswith('_')):
+            raise ValueError(f"Invalid metadata key '{segment}': keys cannot contain '{self.SEPARATOR}', and nested keys cannot start or end with '_'.")
+
+    def flatten(self, metadata, prefix=''):
+        for key, value in metadata.items():
+            nested = isinstance(value, dict) and bool(value)
+            self.check_segment(key, child=bool(prefix), parent=nested)
+            name = prefix + key
+            if nested:
+                yield from self.flatten(value, name + self.SEPARATOR)
+            elif self._is_storable(value):
+                yield self.PREFIX + name, value
+            else:
+                yield self.JSON_PREFIX + name, json.dumps(value)
+
+    def encode(self, metadata):
+        # Properties to SET on the node or relationship with +=
+        if self.storage == 'json':
+            return {'metadata': json.dumps(metadata) if metadata else None}
+        properties = dict(self.flatten(metadata or {}))
+        if metadata:
+            properties[self.TEXT_KEY] = json.dumps(metadata)
+        return properties
+
+    def is_metadata_key(self, key):
+        return key in ('metadata', self.TEXT_KEY) or key.startswith(self.PREFIX) or key.startswith(self.JSON_PREFIX)
+
+    def decode(self, properties):
+        # Pops every stored metadata property off `properties` and rebuilds the
+        # metadata dict. Both storages are read, so data can be migrated online.
+        raw = properties.pop('metadata', None)
+        metadata = json.loads(raw) if raw else None
+        properties.pop(self.TEXT_KEY, None)
+
+        for key in [key for key in properties if key != 'metadata' and self.is_metadata_key(key)]:
+            value = properties.pop(key)
+            if key.startswith(self.JSON_PREFIX):
+                name, value = key[len(self.JSON_PREFIX):], json.loads(value)
+            else:
+                name = key[len(self.PREFIX):]
+            if metadata is None:
+                metadata = {}
+            target = metadata
+            *parents, leaf = name.split(self.SEPARATOR)
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[leaf] = value
+        return metadata
+
+    def update_clause(self, var, keys=(), metadata_properties=None):
+        # Cypher that replaces the metadata of `var` with $metadata_properties.
+        # In "properties" storage, `keys` are the current keys of `var`: the
+        # metadata ones that are not written again are removed. Only metadata
+        # keys are named, quoted as identifiers.
+        if self.storage == 'json':
+            return f"SET {var} += $metadata_properties"
+        stale = [key for key in keys if self.is_metadata_key(key) and key not in (metadata_properties or {})]
+        remove = "REMOVE " + ", ".join(f"{var}.`{key.replace('`', '``')}`" for key in stale) if stale else ""
+        return f"""{remove}
+        SET {var} += $metadata_properties"""
+
+    def split_key(self, key):
+        # A metadata path names nested keys with '.'; a dot or backslash that is
+        # part of a key is escaped with a backslash (specs.ram, version\.major)
+        segments, current, escaped = [], [], False
+        for char in key:
+            if escaped:
+                current.append(char)
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '.':
+                segments.append(''.join(current))
+                current = []
+            else:
+                current.append(char)
+        if escaped:
+            raise ValueError(f"Invalid metadata key '{key}': it ends with an escape.")
+        segments.append(''.join(current))
+        return segments
+
+    def join_key(self, segments):
+        return '.'.join(segment.replace('\\', '\\\\').replace('.', '\\.') for segment in segments)
+
+    def property_name(self, key):
+        segments = self.split_key(key)
+        for index, segment in enumerate(segments):
+            self.check_segment(segment, child=index > 0, parent=index < len(segments) - 1)
+        return self.PREFIX + self.SEPARATOR.join(segments)
+
+    def match_conditions(self, var, metadata, parameters):
+        # Conditions for the `metadata` dict of the search endpoints
+        if self.storage == 'json':
+            parameters['metadata'] = json.dumps(metadata)
+            return [f"{var}.metadata CONTAINS $metadata"]
+        filters = []
+        for name, value in self.flatten(metadata):
+            # Values kept as JSON (null, empty or mixed lists) cannot be compared
+            if not name.startswith(self.PREFIX):
+                raise ValueError(f"Metadata key '{name[len(self.JSON_PREFIX):]}' cannot be matched: only strings, numbers, booleans and lists of one of them can.")
+            filters.append((self.join_key(name[len(self.PREFIX):].split(self.SEPARATOR)), 'eq', value))
+        return self.filter_conditions(var, filters, parameters)
+
+    def parse_filters(self, expressions):
+        # "key:value" or "key:op:value"; values are parsed as JSON when possible
+        filters = []
+        for expression in expressions:
+            parts = expression.split(':', 2)
+            if len(parts) < 2 or not parts[0]:
+                raise ValueError(f"Invalid metadata filter '{expression}', expected key:value or key:op:value.")
+            if len(parts) == 3 and parts[1] in self.OPERATORS:
+                key, op, value = parts
+            else:
+                key, op, value = parts[0], 'eq', ':'.join(parts[1:])
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+            filters.append((key, op, value))
+        return filters
+
+    def filter_conditions(self, var, filters, parameters):
+        if filters and self.storage != 'properties':
+            raise ValueError("Metadata filters require the 'properties' metadata storage.")
+        conditions = []
+        for key, op, value in filters:
+            param = f"meta_filter_{len(parameters)}"
+            parameters[param] = value
+            name = self.property_name(key).replace('`', '``')
+            conditions.append(f"{var}.`{name}` {self.OPERATORS[op]} ${param}")
+        return conditions
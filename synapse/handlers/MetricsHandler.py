@@ -0,0 +1,221 @@
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("synapse.slow_query")
+
+# Query texts remembered for the plan-cache estimate, least recently run
+# dropped first like the server's own plan cache
+MAX_TRACKED_QUERIES = 10000
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+NUMBER_LITERAL = re.compile(r"(?<![\w$`.])-?\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def normalize_query(query):
+    # Literals inlined by f-strings become "?", so queries that differ only in
+    # values share a fingerprint
+    query = STRING_LITERAL.sub("?", query)
+    query = NUMBER_LITERAL.sub("?", query)
+    return WHITESPACE.sub(" ", query).strip()
+
+@lru_cache(maxsize=2048)
+def fingerprint(query):
+    return hashlib.sha1(normalize_query(query).encode()).hexdigest()[:12]
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(labels):
+    return ",".join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{{{format_labels(labels + (('le', bound),))}}} {cumulative}")
+        lines.append(f"{name}_bucket{{{format_labels(labels + (('le', '+Inf'),))}}} {self.count}")
+        lines.append(f"{name}_sum{{{format_labels(labels)}}} {self.sum}")
+        lines.append(f"{name}_count{{{format_labels(labels)}}} {self.count}")
+        return lines
+
+class QueryStats:
+    def __init__(self, query, buckets):
+        self.query = normalize_query(query)
+        self.duration = Histogram(buckets)
+        self.rows = 0
+        self.errors = 0
+        self.slow = 0
+        self.available_after = 0.0
+        self.consumed_after = 0.0
+        self.max_duration = 0.0
+        # Distinct query texts seen for this fingerprint; more than one means
+        # values are interpolated into the text and each variant is planned anew
+        self.variants = 0
+
+class MetricsHandler:
+    def __init__(self, slow_query_threshold=0.5, buckets=DEFAULT_BUCKETS):
+        # slow_query_threshold is in seconds; None disables the slow-query log
+        self.slow_query_threshold = slow_query_threshold
+        self.buckets = buckets
+        self.queries = {}
+        self.requests = {}
+        self.request_counts = {}
+        self.query_texts = OrderedDict()
+        self.plan_cache = {'hits': 0, 'misses': 0}
+
+    def observe_query(self, query, parameters, duration, rows, available_after=None, consumed_after=None, error=None):
+        # available_after / consumed_after are the server timings in milliseconds
+        # from the result summary (None when the query failed)
+        key = fingerprint(query)
+        stats = self.queries.get(key)
+        if stats is None:
+            stats = self.queries[key] = QueryStats(query, self.buckets)
+        stats.duration.observe(duration)
+        # Neo4j caches plans by exact query text, so a text seen before should
+        # hit the plan cache (unless the server evicted it)
+        if query in self.query_texts:
+            self.plan_cache['hits'] += 1
+            self.query_texts.move_to_end(query)
+        else:
+            self.plan_cache['misses'] += 1
+            stats.variants += 1
+            self.query_texts[query] = None
+            if len(self.query_texts) > MAX_TRACKED_QUERIES:
+                self.query_texts.popitem(last=False)
+        stats.rows += rows
+        stats.max_duration = max(stats.max_duration, duration)
+        if available_after is not None:
+            stats.available_after += available_after / 1000
+        if consumed_after is not None:
+            stats.consumed_after += consumed_after / 1000
+        if error is not None:
+            stats.errors += 1
+
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            stats.slow += 1
+            # Parameter values may hold user data, only their names are logged
+            slow_query_logger.warning(
+                f"Slow query {key}: {duration * 1000:.1f} ms, {rows} rows, "
+                f"available after {available_after} ms, consumed after {consumed_after} ms, "
+                f"parameters {sorted(parameters or {})}: {stats.query[:500]}"
+            )
+
+    def observe_request(self, method, route, status, duration):
+        key = (method, route)
+        histogram = self.requests.get(key)
+        if histogram is None:
+            histogram = self.requests[key] = Histogram(self.buckets)
+        histogram.observe(duration)
+        count_key = (method, route, status)
+        self.request_counts[count_key] = self.request_counts.get(count_key, 0) + 1
+
+    def get_query_stats(self, sort_by='total', limit=50):
+        stats = [
+            {
+                'fingerprint': key,
+                'query': query.query,
+                'calls': query.duration.count,
+                'total_ms': round(query.duration.sum * 1000, 3),
+                'mean_ms': round(query.duration.sum / query.duration.count * 1000, 3),
+                'max_ms': round(query.max_duration * 1000, 3),
+                'rows': query.rows,
+                'variants': query.variants,
+                'errors': query.errors,
+                'slow': query.slow,
+                'server_available_ms': round(query.available_after * 1000, 3),
+                'server_consumed_ms': round(query.consumed_after * 1000, 3)
+            }
+            for key, query in self.queries.items()
+        ]
+        sort_keys = {'total': 'total_ms', 'mean': 'mean_ms', 'max': 'max_ms', 'calls': 'calls', 'rows': 'rows', 'variants': 'variants'}
+        stats.sort(key=lambda item: item[sort_keys[sort_by]], reverse=True)
+        return stats[:limit]
+
+    def get_plan_cache_stats(self):
+        # Client-side estimate: a miss is the first execution of a query text
+        executions = self.plan_cache['hits'] + self.plan_cache['misses']
+        unstable = sorted((item for item in self.queries.items() if item[1].variants > 1), key=lambda item: item[1].variants, reverse=True)
+        return {
+            **self.plan_cache,
+            'executions': executions,
+            'hit_rate': round(self.plan_cache['hits'] / executions, 4) if executions else None,
+            'distinct_queries': len(self.query_texts),
+            'fingerprints': len(self.queries),
+            'unstable': [
+                {'fingerprint': key, 'variants': stats.variants, 'query': stats.query}
+                for key, stats in unstable[:20]
+            ]
+        }
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = [
+            "# HELP synapse_http_request_duration_seconds Time spent handling a request, by route template.",
+            "# TYPE synapse_http_request_duration_seconds histogram"
+        ]
+        for (method, route), histogram in sorted(self.requests.items()):
+            lines.extend(histogram.render("synapse_http_request_duration_seconds", (('method', method), ('route', route))))
+
+        lines.append("# HELP synapse_http_requests_total Requests handled, by route template and status code.")
+        lines.append("# TYPE synapse_http_requests_total counter")
+        for (method, route, status), count in sorted(self.request_counts.items()):
+            lines.append(f"synapse_http_requests_total{{{format_labels((('method', method), ('route', route), ('status', status)))}}} {count}")
+
+        lines.append("# HELP synapse_neo4j_query_duration_seconds Client-side wall time of a Cypher query, by query fingerprint.")
+        lines.append("# TYPE synapse_neo4j_query_duration_seconds histogram")
+        for key, stats in sorted(self.queries.items()):
+            lines.extend(stats.duration.render("synapse_neo4j_query_duration_seconds", (('query', key),)))
+
+        counters = (
+            ('synapse_neo4j_query_rows_total', "Rows returned, by query fingerprint.", 'rows'),
+            ('synapse_neo4j_query_errors_total', "Failed queries, by query fingerprint.", 'errors'),
+            ('synapse_neo4j_slow_queries_total', "Queries above the slow-query threshold, by query fingerprint.", 'slow'),
+            ('synapse_neo4j_query_available_after_seconds_total', "Server time until the first record was available.", 'available_after'),
+            ('synapse_neo4j_query_consumed_after_seconds_total', "Server time until the result was consumed.", 'consumed_after')
+        )
+        for name, help_text, attribute in counters:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for key, stats in sorted(self.queries.items()):
+                lines.append(f"{name}{{{format_labels((('query', key),))}}} {getattr(stats, attribute)}")
+
+        lines.append("# HELP synapse_neo4j_query_variants Distinct query texts per fingerprint.")
+        lines.append("# TYPE synapse_neo4j_query_variants gauge")
+        for key, stats in sorted(self.queries.items()):
+            lines.append(f"synapse_neo4j_query_variants{{{format_labels((('query', key),))}}} {stats.variants}")
+
+        lines.append("# HELP synapse_neo4j_plan_cache_requests_total Query executions whose text was seen before (hit) or not (miss).")
+        lines.append("# TYPE synapse_neo4j_plan_cache_requests_total counter")
+        for result in ('hits', 'misses'):
+            lines.append(f"synapse_neo4j_plan_cache_requests_total{{{format_labels((('result', result),))}}} {self.plan_cache[result]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        self.queries.clear()
+        self.requests.clear()
+        self.request_counts.clear()
+        self.query_texts.clear()
+        self.plan_cache = {'hits': 0, 'misses': 0}
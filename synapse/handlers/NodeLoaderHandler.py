@@ -0,0 +1,103 @@
+import asyncio
+import logging
+
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import NODE_LABELS
+
+logger = logging.getLogger(__name__)
+
+class NodeLoaderHandler:
+    # Coalesces by-id lookups. Lookups made within batch_window of each other
+    # are fetched with one UNWIND $ids query per label (label None matches any
+    # node label), and a lookup for an id that is already queued or in flight
+    # waits for that query instead of sending its own.
+    def __init__(self, db_handler, metadata_handler, batch_window=0.002, max_batch_size=1000):
+        self.db_handler = db_handler
+        self.metadata_handler = metadata_handler
+        self.node_mapper = NodeMapper(metadata_handler)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        # label -> {id: future} waiting for the next dispatch
+        self.queued = {}
+        # (label, id) -> future, from queueing until the query has returned
+        self.futures = {}
+        self.timers = {}
+        self.tasks = set()
+        self.stats = {'loads': 0, 'shared': 0, 'queries': 0}
+
+    def _query(self, label):
+        if label:
+            return f"""
+            UNWIND $ids AS id
+            MATCH (n:{label})
+            WHERE elementId(n) = id
+            RETURN id, n, labels(n) AS labels
+            """
+        return f"""
+        UNWIND $ids AS id
+        MATCH (n)
+        WHERE elementId(n) = id AND ({" OR ".join(f"n:{label}" for label in NODE_LABELS)})
+        RETURN id, n, labels(n) AS labels
+        """
+
+    def _schedule(self, label):
+        if len(self.queued[label]) >= self.max_batch_size:
+            self._dispatch(label)
+        elif label not in self.timers:
+            self.timers[label] = asyncio.get_running_loop().call_later(self.batch_window, self._dispatch, label)
+
+    def _dispatch(self, label):
+        timer = self.timers.pop(label, None)
+        if timer:
+            timer.cancel()
+        batch = self.queued.pop(label, None)
+        if batch:
+            task = asyncio.create_task(self._fetch(label, batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _fetch(self, label, batch):
+        self.stats['queries'] += 1
+        try:
+            result = await self.db_handler.execute_read(self._query(label), {'ids': list(batch)})
+            found = {}
+            for record in result:
+                node = self.node_mapper.node(record['n'], record['id'])
+                if label is None:
+                    node['labels'] = record['labels']
+                found[record['id']] = node
+            for id, future in batch.items():
+                if not future.done():
+                    future.set_result(found.get(id))
+        except Exception as e:
+            logger.error(f"Loading {len(batch)} nodes failed: {str(e)}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            for id in batch:
+                self.futures.pop((label, id), None)
+
+    async def load(self, label, id):
+        # The node with element id `id` (and `label`, unless None) or None
+        if label is not None and label not in NODE_LABELS:
+            raise ValueError(f"Unknown label '{label}', expected one of {list(NODE_LABELS)}.")
+        self.stats['loads'] += 1
+        future = self.futures.get((label, id))
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.futures[(label, id)] = future
+            self.queued.setdefault(label, {})[id] = future
+            self._schedule(label)
+        else:
+            self.stats['shared'] += 1
+        # Shielded so one caller being cancelled does not cancel the others
+        node = await asyncio.shield(future)
+        # Callers get their own copy since the result is shared
+        return node.copy() if node is not None else None
+
+    async def load_many(self, label, ids):
+        return await asyncio.gather(*(self.load(label, id) for id in ids))
+
+    def get_stats(self):
+        return {**self.stats, 'in_flight': len(self.futures)}
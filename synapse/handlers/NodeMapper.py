@@ -0,0 +1,171 @@
+import copy
+from collections.abc import MutableMapping
+
+from handlers.VectorIndexHandler import encode_vector
+
+# Markers for metadata that has not been decoded yet or was not asked for, and
+# for keys deleted from a record
+UNDECODED = object()
+OMITTED = object()
+DELETED = object()
+MAX_LAYOUTS = 1024
+
+class NodeRecord(MutableMapping):
+    # A node as the handlers return it. The property map from the driver is
+    # kept as is rather than copied; the metadata is only decoded when it is
+    # read or the record is serialized, and keys set afterwards (similarity,
+    # score, labels, relations) go into a small overlay. Behaves like the dict
+    # it replaces: properties, then id and metadata, then the overlay.
+    __slots__ = ('id', '_properties', '_mapper', '_fields', '_vector', '_metadata', '_extra')
+
+    def __init__(self, id, properties, mapper, fields=None, include_vector=None, metadata=UNDECODED):
+        self.id = id
+        self._properties = properties
+        self._mapper = mapper
+        # Property names to keep, None for all of them
+        self._fields = fields
+        # None keeps the stored vector, False drops it, True encodes it as base64
+        self._vector = include_vector
+        self._metadata = metadata
+        self._extra = None
+
+    @property
+    def metadata(self):
+        if self._metadata is UNDECODED:
+            self._metadata = self._mapper.decode(self._properties)
+        return None if self._metadata is OMITTED else self._metadata
+
+    def __getitem__(self, key):
+        if self._extra and key in self._extra:
+            value = self._extra[key]
+            if value is DELETED:
+                raise KeyError(key)
+            return value
+        if key == 'id':
+            return self.id
+        if key == 'metadata':
+            if self._metadata is OMITTED:
+                raise KeyError(key)
+            return self.metadata
+        if key not in self._mapper.layout(self._properties, self._fields, self._vector)[0]:
+            raise KeyError(key)
+        value = self._properties[key]
+        if key == 'vector' and self._vector:
+            return encode_vector(value)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self[key] = DELETED
+
+    def _keys(self):
+        keys = list(self._mapper.layout(self._properties, self._fields, self._vector)[0])
+        keys.append('id')
+        if self._metadata is not OMITTED:
+            keys.append('metadata')
+        return keys
+
+    def __iter__(self):
+        keys = self._keys()
+        extra = self._extra or {}
+        for key in keys:
+            if extra.get(key) is not DELETED:
+                yield key
+        for key, value in extra.items():
+            if value is not DELETED and key not in keys:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"NodeRecord({self.to_dict()!r})"
+
+    def to_dict(self):
+        # Same as dict(record), without going through __getitem__ for each key
+        properties = self._properties
+        result = {key: properties[key] for key in self._mapper.layout(properties, self._fields, self._vector)[0]}
+        if self._vector and result.get('vector') is not None:
+            result['vector'] = encode_vector(result['vector'])
+        result['id'] = self.id
+        if self._metadata is not OMITTED:
+            result['metadata'] = self.metadata
+        if self._extra:
+            for key, value in self._extra.items():
+                if value is DELETED:
+                    result.pop(key, None)
+                else:
+                    result[key] = value
+        return result
+
+    def copy(self):
+        # Shares the properties from the driver, which are never written to
+        record = NodeRecord(self.id, self._properties, self._mapper, self._fields, self._vector, self._metadata)
+        if self._extra:
+            record._extra = dict(self._extra)
+        return record
+
+    def __deepcopy__(self, memo):
+        # The property map is shared as in copy(); the decoded metadata and the
+        # overlay are what callers change, so they are copied, keeping the markers
+        memo.update({id(marker): marker for marker in (UNDECODED, OMITTED, DELETED)})
+        record = self.copy()
+        record._metadata = copy.deepcopy(self._metadata, memo)
+        if self._extra:
+            record._extra = copy.deepcopy(self._extra, memo)
+        return record
+
+class NodeMapper:
+    # Turns the nodes of Neo4j records into NodeRecords, for every handler that
+    # returns nodes
+    def __init__(self, metadata_handler):
+        self.metadata_handler = metadata_handler
+        self.layouts = {}
+
+    def shown(self, name, fields, include_vector):
+        if name == 'vector':
+            return include_vector is not False
+        return not self.metadata_handler.is_metadata_key(name) and (fields is None or name in fields)
+
+    def layout(self, properties, fields=None, include_vector=None):
+        # (keys shown, metadata keys) of a property map, cached per key set
+        # since the rows of one query mostly share it
+        key = (tuple(properties.keys()), tuple(fields) if fields is not None else None, include_vector is False)
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = (
+                tuple(name for name in key[0] if self.shown(name, fields, include_vector)),
+                tuple(name for name in key[0] if self.metadata_handler.is_metadata_key(name))
+            )
+            if len(self.layouts) >= MAX_LAYOUTS:
+                self.layouts.clear()
+            self.layouts[key] = layout
+        return layout
+
+    def decode(self, properties):
+        # decode() pops the keys it reads, so it gets a map of just those
+        metadata_keys = self.layout(properties)[1]
+        return self.metadata_handler.decode({key: properties[key] for key in metadata_keys}) if metadata_keys else None
+
+    def node(self, properties, id, fields=None, include_vector=None, **extra):
+        # `properties` is a node or a map projection of one (see
+        # QueryBuilder.projection). With `fields`, only those properties are
+        # returned and the metadata only if it is one of them.
+        metadata = OMITTED if fields is not None and 'metadata' not in fields else UNDECODED
+        record = NodeRecord(id, properties, self, fields, include_vector, metadata)
+        for key, value in extra.items():
+            record[key] = value
+        return record
+
+def serializable(value):
+    # `default` hook for the JSON and msgpack encoders
+    if isinstance(value, NodeRecord):
+        return value.to_dict()
+    if isinstance(value, MutableMapping):
+        return dict(value)
+    return str(value)
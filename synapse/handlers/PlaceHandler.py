@@ -1,74 +1,97 @@
-import json
 from datetime import datetime
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import QueryBuilder
 
 class PlaceHandler:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, metadata_handler=None, cache_handler=None, query_builder=None, node_loader=None):
         self.db_handler = db_handler
+        self.cache_handler = cache_handler
+        # Batches concurrent by-id lookups into one query
+        self.node_loader = node_loader
+        self.metadata_handler = metadata_handler or MetadataHandler()
+        self.node_mapper = NodeMapper(self.metadata_handler)
+        self.query_builder = query_builder or QueryBuilder(self.metadata_handler)
 
-    def create_place(self, name, description, metadata=None):
+    async def create_place(self, name, description, metadata=None):
         created_at = datetime.now().isoformat()
         updated_at = created_at
-        metadata_json = json.dumps(metadata) if metadata else None
         
         query = """
         CREATE (p:Place {
             name: $name,
             description: $description,
             created_at: $created_at,
-            updated_at: $updated_at,
-            metadata: $metadata
+            updated_at: $updated_at
         })
+        SET p += $metadata_properties
         RETURN p, elementId(p) AS id
         """
-        result = self.db_handler.execute_query(query, {
+        result = await self.db_handler.execute_write(query, {
             'name': name,
             'description': description,
             'created_at': created_at,
             'updated_at': updated_at,
-            'metadata': metadata_json
+            'metadata_properties': self.metadata_handler.encode(metadata)
         })
         if result:
-            place = dict(result[0]['p'])
-            place['id'] = result[0]['id']
-            place['metadata'] = json.loads(place['metadata']) if place.get('metadata') else None
+            place = self.node_mapper.node(result[0]['p'], result[0]['id'])
             return place
         return None
 
-    def update_place(self, id, name=None, description=None, metadata=None):
+    async def create_places(self, places, chunk_size=1000):
+        created_at = datetime.now().isoformat()
+        rows = []
+        errors = []
+        for index, place in places:
+            try:
+                rows.append({
+                    'index': index,
+                    'name': place['name'],
+                    'description': place['description'],
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                    'metadata_properties': self.metadata_handler.encode(place.get('metadata'))
+                })
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        query = """
+        UNWIND $rows AS row
+        CREATE (p:Place {
+            name: row.name,
+            description: row.description,
+            created_at: row.created_at,
+            updated_at: row.updated_at
+        })
+        SET p += row.metadata_properties
+        RETURN row.index AS index, elementId(p) AS id
+        """
+        result, chunk_errors = await self.db_handler.execute_in_chunks(query, rows, chunk_size)
+        errors.extend(chunk_errors)
+        created = [{'index': record['index'], 'id': record['id']} for record in result]
+        return created, errors
+
+    async def update_place(self, id, name=None, description=None, metadata=None):
         updated_at = datetime.now().isoformat()
         
-        set_clauses = []
-        parameters = {'id': id, 'updated_at': updated_at}
-        
-        if name is not None:
-            set_clauses.append("p.name = $name")
-            parameters['name'] = name
-        if description is not None:
-            set_clauses.append("p.description = $description")
-            parameters['description'] = description
+        parameters = {
+            'id': id,
+            'properties': self.query_builder.properties(name=name, description=description, updated_at=updated_at)
+        }
         if metadata is not None:
-            metadata_json = json.dumps(metadata)
-            set_clauses.append("p.metadata = $metadata")
-            parameters['metadata'] = metadata_json
-        
-        set_clauses.append("p.updated_at = $updated_at")
-        set_clause = ", ".join(set_clauses)
-        
-        query = f"""
-        MATCH (p:Place)
-        WHERE elementId(p) = $id
-        SET {set_clause}
-        RETURN p, elementId(p) AS id
-        """
-        result = self.db_handler.execute_query(query, parameters)
+            parameters['metadata_properties'] = self.metadata_handler.encode(metadata)
+
+        work = self.query_builder.update_node('Place', 'p', metadata is not None)
+        result = await self.db_handler.run_in_transaction(work, parameters)
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
-            place = dict(result[0]['p'])
-            place['id'] = result[0]['id']
-            place['metadata'] = json.loads(place['metadata']) if place.get('metadata') else None
+            place = self.node_mapper.node(result[0]['p'], result[0]['id'])
             return place
         return None
 
-    def delete_place(self, id):
+    async def delete_place(self, id):
         query = """
         MATCH (p:Place)
         WHERE elementId(p) = $id
@@ -76,48 +99,68 @@ class PlaceHandler:
         DETACH DELETE p
         RETURN id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_write(query, {'id': id})
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
             return result[0]['id']
         return None
 
-    def get_place_by_id(self, id):
+    async def get_place_by_id(self, id):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Place', 'id', id)
+            if cached is not None:
+                return cached
+
+        if self.node_loader:
+            place = await self.node_loader.load('Place', id)
+            if place and self.cache_handler:
+                await self.cache_handler.set('Place', 'id', id, place)
+            return place
+
         query = """
         MATCH (p:Place)
         WHERE elementId(p) = $id
         RETURN p, elementId(p) AS id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_read(query, {'id': id})
         if result:
-            place = dict(result[0]['p'])
-            place['id'] = result[0]['id']
-            place['metadata'] = json.loads(place['metadata']) if place.get('metadata') else None
+            place = self.node_mapper.node(result[0]['p'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Place', 'id', id, place)
             return place
         return None
 
-    def get_place_by_name(self, name):
+    async def get_place_by_name(self, name):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Place', 'name', name)
+            if cached is not None:
+                return cached
+
         query = """
         MATCH (p:Place {name: $name})
         RETURN p, elementId(p) AS id
         """
-        result = self.db_handler.execute_query(query, {'name': name})
+        result = await self.db_handler.execute_read(query, {'name': name})
         if result:
-            place = dict(result[0]['p'])
-            place['id'] = result[0]['id']
-            place['metadata'] = json.loads(place['metadata']) if place.get('metadata') else None
+            place = self.node_mapper.node(result[0]['p'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Place', 'name', name, place)
             return place
         return None
 
-    def get_all_places(self):
-        query = """
-        MATCH (p:Place)
-        RETURN p, elementId(p) AS id
-        """
-        result = self.db_handler.execute_query(query)
+    async def get_all_places(self, after=None, limit=None):
+        # Returns (places, cursor of the next page or None)
+        query = self.query_builder.list_nodes('Place', 'p', limit=limit)
+        result = await self.db_handler.execute_read(query, self.query_builder.page_parameters(after, limit))
         places = []
         for record in result:
-            place = dict(record['p'])
-            place['id'] = record['id']
-            place['metadata'] = json.loads(place['metadata']) if place.get('metadata') else None
+            place = self.node_mapper.node(record['p'], record['id'])
             places.append(place)
-        return places
+        return places, self.query_builder.next_cursor(result, limit)
+
+    async def stream_all_places(self, page=None):
+        query = self.query_builder.list_nodes('Place', 'p')
+        async for record in self.db_handler.stream_query(query, page or self.query_builder.page_parameters()):
+            place = self.node_mapper.node(record['p'], record['id'])
+            yield place
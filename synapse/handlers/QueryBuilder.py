@@ -0,0 +1,207 @@
+import base64
+import binascii
+import json
+import re
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+NODE_LABELS = ('Thing', 'Task', 'Place', 'User')
+
+class QueryBuilder:
+    # Emits the dynamic queries of the handlers and routers from a fixed set of
+    # shapes. Values and property keys always travel as parameters (maps are
+    # applied with +=), so the query text only depends on which shape is used and
+    # Neo4j can reuse the cached plan. Labels and variables come from code.
+    def __init__(self, metadata_handler, relation_types=None):
+        self.metadata_handler = metadata_handler
+        # None allows any relation type that is a plain identifier
+        self.relation_types = frozenset(relation_types) if relation_types else None
+
+    def relation_type(self, relation_type):
+        # Relationship types cannot be parameterized in CREATE or in a pattern, so
+        # they are checked before being written into the query
+        if not relation_type or not IDENTIFIER.match(relation_type):
+            raise ValueError(f"Invalid relation type '{relation_type}'.")
+        if self.relation_types is not None and relation_type not in self.relation_types:
+            raise ValueError(f"Unknown relation type '{relation_type}', expected one of {sorted(self.relation_types)}.")
+        return relation_type
+
+    def label(self, label):
+        if label not in NODE_LABELS:
+            raise ValueError(f"Unknown label '{label}', expected one of {list(NODE_LABELS)}.")
+        return label
+
+    def properties(self, **fields):
+        # Fields left as None are not part of the update
+        return {key: value for key, value in fields.items() if value is not None}
+
+    def fields(self, value):
+        # Parses a comma-separated ?fields= value; None returns every property
+        if value is None:
+            return None
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        for field in fields:
+            if not IDENTIFIER.match(field):
+                raise ValueError(f"Invalid field '{field}'.")
+        return fields
+
+    def projection(self, var, fields=None, include_vector=False):
+        # Map projection for RETURN, so only the requested properties leave the
+        # database. The vector is nulled unless asked for, since .* cannot drop
+        # a key. Metadata stored as properties spans many keys, so asking for it
+        # falls back to .* and the NodeRecord trims the rest.
+        if fields is None or ('metadata' in fields and self.metadata_handler.storage == 'properties'):
+            return f"{var} {{.*{'' if include_vector else ', vector: null'}}}"
+        keys = [f".{field}" for field in fields if field not in ('id', 'vector')]
+        if include_vector:
+            keys.append(".vector")
+        return f"{var} {{{', '.join(keys)}}}" if keys else "{}"
+
+    def list_nodes(self, label, var, projection=None, limit=None):
+        # Keyset pagination over the created_at range index, with the element id
+        # breaking ties: a page is an index seek from the cursor rather than a
+        # scan and sort of the whole label. Parameters: see page_parameters().
+        return f"""
+        MATCH ({var}:{self.label(label)})
+        WHERE {var}.created_at >= $from AND ($after_id IS NULL OR {var}.created_at > $from OR elementId({var}) > $after_id)
+        RETURN {projection or var} AS {var}, elementId({var}) AS id, {var}.created_at AS created_at
+        ORDER BY created_at, id
+        {"LIMIT $limit" if limit else ""}
+        """
+
+    def page_parameters(self, after=None, limit=None):
+        # `after` is a cursor from next_cursor(); a bad one is a ValueError
+        if after is None:
+            return {'from': '', 'after_id': None, 'limit': limit}
+        try:
+            created_at, id = json.loads(base64.urlsafe_b64decode(after.encode('ascii')))
+        except (ValueError, TypeError, binascii.Error):
+            raise ValueError("Invalid cursor.")
+        if not isinstance(created_at, str) or not isinstance(id, str):
+            raise ValueError("Invalid cursor.")
+        return {'from': created_at, 'after_id': id, 'limit': limit}
+
+    def next_cursor(self, records, limit):
+        # Opaque X-Next-Cursor: the sort key of the last record of a full page
+        if not limit or len(records) < limit:
+            return None
+        last = records[-1]
+        return base64.urlsafe_b64encode(json.dumps([last['created_at'], last['id']]).encode('ascii')).decode('ascii')
+
+    def update_node(self, label, var, update_metadata=False):
+        # Transaction function for db_handler.run_in_transaction(work, parameters).
+        # Parameters: $id, $properties and, with update_metadata, $metadata_properties
+        return self._update(f"({var}:{label})", var, f"elementId({var}) = $id", f"{var}, elementId({var}) AS id", update_metadata)
+
+    def _update(self, pattern, var, condition, returns, update_metadata):
+        # Replacing metadata stored as properties has to remove the keys the
+        # element has now. The first query sets the other properties, which
+        # locks the element, and reads its keys; the second removes the stale
+        # ones by name and writes the new metadata.
+        async def work(unit_of_work, parameters):
+            if not update_metadata or self.metadata_handler.storage == 'json':
+                return await unit_of_work.run(f"""
+                MATCH {pattern}
+                WHERE {condition}
+                SET {var} += $properties
+                {self.metadata_handler.update_clause(var) if update_metadata else ""}
+                RETURN {returns}
+                """, parameters)
+            current = await unit_of_work.run(f"""
+            MATCH {pattern}
+            WHERE {condition}
+            SET {var} += $properties
+            RETURN keys({var}) AS keys
+            """, parameters)
+            if not current:
+                return []
+            return await unit_of_work.run(f"""
+            MATCH {pattern}
+            WHERE {condition}
+            {self.metadata_handler.update_clause(var, current[0]['keys'], parameters['metadata_properties'])}
+            RETURN {returns}
+            """, parameters)
+        return work
+
+    def create_relation(self, relation_type, source_label=None):
+        # Parameters: $source_id, $target_id, $properties, $metadata_properties
+        source = f"source:{source_label}" if source_label else "source"
+        return f"""
+        MATCH ({source}), (target)
+        WHERE elementId(source) = $source_id AND elementId(target) = $target_id
+        CREATE (source)-[r:{self.relation_type(relation_type)}]->(target)
+        SET r += $properties, r += $metadata_properties
+        RETURN elementId(r) AS relation_id
+        """
+
+    def create_relations(self, relation_type):
+        # Bulk shape for execute_in_chunks; rows carry index, source_id, target_id,
+        # properties and metadata_properties. Rows whose nodes are missing return nothing.
+        return f"""
+        UNWIND $rows AS row
+        MATCH (source) WHERE elementId(source) = row.source_id
+        MATCH (target) WHERE elementId(target) = row.target_id
+        CREATE (source)-[r:{self.relation_type(relation_type)}]->(target)
+        SET r += row.properties, r += row.metadata_properties
+        RETURN row.index AS index, elementId(r) AS relation_id, row.source_id AS source_id, row.target_id AS target_id
+        """
+
+    def merge_nodes(self, label):
+        # Import shape: nodes are matched on their import_key, so re-running an
+        # import updates them instead of creating duplicates
+        return f"""
+        UNWIND $rows AS row
+        MERGE (n:{self.label(label)} {{import_key: row.key}})
+        ON CREATE SET n.created_at = row.timestamp
+        SET n += row.properties, n += row.metadata_properties, n.updated_at = row.timestamp
+        RETURN row.index AS index, elementId(n) AS id
+        """
+
+    def merge_relations(self, relation_type, source_label, target_label, keyed=False):
+        # Import shape: endpoints are looked up by label and import_key. Keyed
+        # rows are merged on the relationship's own import_key, so parallel
+        # relationships of one type survive; without a key there is at most one
+        # relationship of the type between two nodes.
+        pattern = f"[r:{self.relation_type(relation_type)} {{import_key: row.key}}]" if keyed else f"[r:{self.relation_type(relation_type)}]"
+        return f"""
+        UNWIND $rows AS row
+        MATCH (source:{self.label(source_label)} {{import_key: row.source}})
+        MATCH (target:{self.label(target_label)} {{import_key: row.target}})
+        MERGE (source)-{pattern}->(target)
+        SET r += row.properties, r += row.metadata_properties
+        RETURN row.index AS index, elementId(r) AS relation_id, elementId(source) AS source_id, elementId(target) AS target_id
+        """
+
+    def update_relation(self, update_metadata=False):
+        # Transaction function like update_node. Parameters: $relation_id,
+        # $properties (null values remove the property) and, with
+        # update_metadata, $metadata_properties
+        return self._update("()-[r]->()", 'r', "elementId(r) = $relation_id",
+                            "elementId(r) AS relation_id, elementId(startNode(r)) AS source_id, elementId(endNode(r)) AS target_id", update_metadata)
+
+    def get_relations(self, source_id=None, target_id=None, relation_type=None):
+        # Anchored on a node when an id is given, with the type as a parameter;
+        # otherwise the validated type goes into the pattern so the relationship
+        # type index can be used. Returns (query, parameters).
+        parameters = {'source_id': source_id, 'target_id': target_id, 'relation_type': relation_type}
+        if source_id and target_id:
+            match_clause = "(source)-[r]->(target)"
+            where_clause = "elementId(source) = $source_id AND elementId(target) = $target_id"
+        elif source_id:
+            match_clause = "(source)-[r]->()"
+            where_clause = "elementId(source) = $source_id"
+        elif target_id:
+            match_clause = "()-[r]->(target)"
+            where_clause = "elementId(target) = $target_id"
+        elif relation_type:
+            return f"""
+            MATCH ()-[r:{self.relation_type(relation_type)}]->()
+            RETURN r, elementId(r) AS relation_id
+            """, parameters
+        else:
+            raise ValueError("Either source_id, target_id, or relation_type must be provided")
+
+        return f"""
+        MATCH {match_clause}
+        WHERE {where_clause} AND ($relation_type IS NULL OR type(r) = $relation_type)
+        RETURN r, elementId(r) AS relation_id
+        """, parameters
@@ -0,0 +1,152 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SchemaHandler:
+    UNIQUE_CONSTRAINTS = {
+        'user_username_unique': ('User', 'username')
+    }
+    RANGE_INDEXES = {
+        'thing_name': ('Thing', 'name'),
+        'task_title': ('Task', 'title'),
+        'place_name': ('Place', 'name'),
+        # The list endpoints page on (created_at, elementId)
+        'thing_created_at': ('Thing', 'created_at'),
+        'task_created_at': ('Task', 'created_at'),
+        'place_created_at': ('Place', 'created_at'),
+        'user_created_at': ('User', 'created_at'),
+        # Nodes loaded through POST /graph/import are merged on import_key
+        'thing_import_key': ('Thing', 'import_key'),
+        'task_import_key': ('Task', 'import_key'),
+        'place_import_key': ('Place', 'import_key'),
+        'user_import_key': ('User', 'import_key')
+    }
+    # Text indexes back the CONTAINS filters of search_things / search_tasks
+    TEXT_INDEXES = {
+        'thing_name_text': ('Thing', 'name'),
+        'thing_description_text': ('Thing', 'description'),
+        'task_title_text': ('Task', 'title'),
+        'task_description_text': ('Task', 'description')
+    }
+    # Full-text (Lucene) indexes queried by the text search mode; metadata is
+    # in `metadata` or, with the "properties" storage, in `metadata_text`
+    FULLTEXT_INDEXES = {
+        'thing_fulltext': ('Thing', ('name', 'description', 'metadata', 'metadata_text')),
+        'task_fulltext': ('Task', ('title', 'description', 'metadata', 'metadata_text'))
+    }
+    VECTOR_INDEXES = {
+        'Thing': 'thing_vector_index',
+        'Task': 'task_vector_index'
+    }
+
+    def __init__(self, db_handler):
+        self.db_handler = db_handler
+
+    async def get_indexes(self):
+        query = """
+        SHOW INDEXES
+        YIELD name, type, entityType, labelsOrTypes, properties, state, options
+        RETURN name, type, entityType, labelsOrTypes, properties, state, options
+        """
+        result = await self.db_handler.execute_query(query)
+        return [dict(record) for record in result]
+
+    async def get_constraints(self):
+        query = """
+        SHOW CONSTRAINTS
+        YIELD name, type, entityType, labelsOrTypes, properties, ownedIndex
+        RETURN name, type, entityType, labelsOrTypes, properties, ownedIndex
+        """
+        result = await self.db_handler.execute_query(query)
+        return [dict(record) for record in result]
+
+    async def ensure_schema(self):
+        # Names and properties come from the class constants above, never from requests
+        for name, (label, prop) in self.UNIQUE_CONSTRAINTS.items():
+            await self.db_handler.execute_query(
+                f"CREATE CONSTRAINT {name} IF NOT EXISTS FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+            )
+        for name, (label, prop) in self.RANGE_INDEXES.items():
+            await self.db_handler.execute_query(
+                f"CREATE RANGE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})"
+            )
+        for name, (label, prop) in self.TEXT_INDEXES.items():
+            await self.db_handler.execute_query(
+                f"CREATE TEXT INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})"
+            )
+        # A full-text index made for other properties is recreated, since
+        # IF NOT EXISTS only compares names
+        existing = {index['name']: index['properties'] for index in await self.get_indexes()}
+        for name, (label, props) in self.FULLTEXT_INDEXES.items():
+            if name in existing and list(existing[name] or []) != list(props):
+                logger.info(f"Recreating full-text index {name} on {list(props)}")
+                await self.db_handler.execute_query(f"DROP INDEX {name} IF EXISTS")
+            properties = ", ".join(f"n.{prop}" for prop in props)
+            await self.db_handler.execute_query(
+                f"CREATE FULLTEXT INDEX {name} IF NOT EXISTS FOR (n:{label}) ON EACH [{properties}]"
+            )
+
+        indexes = await self.get_indexes()
+        pending = [index['name'] for index in indexes if index['state'] != 'ONLINE']
+        if pending:
+            logger.info(f"Waiting for indexes to come online: {pending}")
+            await self.db_handler.execute_query("CALL db.awaitIndexes(300)")
+        logger.info(f"Schema ready: {len(indexes)} indexes")
+
+    async def ensure_metadata_indexes(self, indexed_keys, metadata_handler):
+        # Range indexes on flattened meta_* properties, e.g. thing_meta_brand
+        for label, keys in indexed_keys.items():
+            for key in keys:
+                prop = metadata_handler.property_name(key)
+                name = f"{label.lower()}_{prop}"
+                await self.db_handler.execute_query(
+                    f"CREATE RANGE INDEX `{name}` IF NOT EXISTS FOR (n:{label}) ON (n.`{prop}`)"
+                )
+
+    async def get_vector_dimensions(self, label):
+        query = f"""
+        MATCH (n:{label})
+        WHERE n.vector IS NOT NULL
+        RETURN size(n.vector) AS dimension, count(*) AS count
+        """
+        result = await self.db_handler.execute_query(query)
+        return {record['dimension']: record['count'] for record in result}
+
+    async def ensure_vector_index(self, label, dimension=None, similarity_function='cosine'):
+        index_name = self.VECTOR_INDEXES[label]
+
+        dimensions = await self.get_vector_dimensions(label)
+        if len(dimensions) > 1:
+            raise ValueError(f"{label} vectors have mixed dimensions {dimensions}, refusing to create '{index_name}'.")
+        data_dimension = next(iter(dimensions), None)
+        if dimension is not None and data_dimension is not None and dimension != data_dimension:
+            raise ValueError(f"Configured dimension {dimension} does not match the {data_dimension}-dimensional {label} vectors in the graph.")
+        dimension = dimension or data_dimension
+        if dimension is None:
+            logger.warning(f"No {label} vectors found and no dimension configured, skipping '{index_name}'")
+            return None
+
+        existing = [
+            index for index in await self.get_indexes()
+            if index['type'] == 'VECTOR' and index['labelsOrTypes'] == [label] and index['properties'] == ['vector']
+        ]
+        if existing:
+            index_name = existing[0]['name']
+            index_dimension = existing[0]['options']['indexConfig']['vector.dimensions']
+            if index_dimension != dimension:
+                raise ValueError(f"Vector index '{index_name}' has dimension {index_dimension}, expected {dimension}.")
+        else:
+            # Index options cannot be parameterized; dimension is an int and the rest are constants
+            query = f"""
+            CREATE VECTOR INDEX {index_name} IF NOT EXISTS
+            FOR (n:{label}) ON (n.vector)
+            OPTIONS {{indexConfig: {{
+                `vector.dimensions`: {int(dimension)},
+                `vector.similarity_function`: '{similarity_function}'
+            }}}}
+            """
+            await self.db_handler.execute_query(query)
+            logger.info(f"Created vector index '{index_name}' on :{label}(vector) with dimension {dimension}")
+
+        await self.db_handler.execute_query("CALL db.awaitIndex($name, 300)", {'name': index_name})
+        return index_name, dimension
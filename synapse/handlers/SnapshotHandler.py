@@ -0,0 +1,175 @@
+import io
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from handlers.QueryBuilder import NODE_LABELS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 'synapse-snapshot'
+SNAPSHOT_VERSION = 2
+# Vector bytes per snapshot version: float64 since version 2, so the values
+# Neo4j stores come back exactly; version 1 files hold float32
+VECTOR_DTYPES = {1: '<f4', 2: '<f8'}
+EXPORT_FORMATS = ('msgpack', 'arrow')
+
+async def read_snapshot(chunks):
+    # Decodes a msgpack snapshot from an async iterator of bytes and yields
+    # (record number, item) in the shape GraphHandler.import_graph expects; the
+    # header and trailer records are skipped
+    import msgpack
+
+    unpacker = msgpack.Unpacker(raw=False)
+    number = 0
+    dtype = VECTOR_DTYPES[1]
+    async for chunk in chunks:
+        unpacker.feed(chunk)
+        for record in unpacker:
+            number += 1
+            kind = record.get('kind')
+            if kind == 'header':
+                if record.get('format') != SNAPSHOT_FORMAT or record.get('version') not in VECTOR_DTYPES:
+                    raise ValueError(f"Not a {SNAPSHOT_FORMAT} file of version {list(VECTOR_DTYPES)}.")
+                dtype = VECTOR_DTYPES[record['version']]
+            elif kind == 'node':
+                properties = record['properties']
+                if record.get('vector') is not None:
+                    properties['vector'] = np.frombuffer(record['vector'], dtype=dtype).tolist()
+                yield number, {'type': 'node', 'label': record['label'], 'key': record['key'], 'properties': properties}
+            elif kind == 'relation':
+                yield number, {
+                    'type': 'relation',
+                    'relation_type': record['type'],
+                    'key': record.get('key'),
+                    'source_label': record['source_label'],
+                    'source': record['source'],
+                    'target_label': record['target_label'],
+                    'target': record['target'],
+                    'properties': record['properties']
+                }
+
+class SnapshotHandler:
+    # Streams the graph out as a snapshot. Nodes and relationships are read from
+    # one cursor each and encoded chunk by chunk, so memory does not grow with
+    # the graph. Nodes and relationships are keyed by import_key (or their
+    # element id), which is what POST /graph/import merges on when the snapshot
+    # is loaded again.
+    def __init__(self, db_handler, query_builder):
+        self.db_handler = db_handler
+        self.query_builder = query_builder
+
+    def _node_query(self, label):
+        # A node with several exported labels is written once, under the first
+        # of them in export order ($earlier holds the labels before this one)
+        return f"""
+        MATCH (n:{self.query_builder.label(label)})
+        WHERE NOT any(label IN labels(n) WHERE label IN $earlier)
+        RETURN elementId(n) AS id, coalesce(n.import_key, elementId(n)) AS key, properties(n) AS properties
+        """
+
+    def _relation_query(self):
+        # Only relationships between exported nodes; each endpoint is named by
+        # the label it was exported under (see _node_query)
+        return """
+        MATCH (source)-[r]->(target)
+        WITH source, r, target,
+             [label IN $labels WHERE label IN labels(source)] AS source_labels,
+             [label IN $labels WHERE label IN labels(target)] AS target_labels
+        WHERE size(source_labels) > 0 AND size(target_labels) > 0
+        RETURN elementId(r) AS id, coalesce(r.import_key, elementId(r)) AS key, type(r) AS type, properties(r) AS properties,
+               source_labels[0] AS source_label, coalesce(source.import_key, elementId(source)) AS source,
+               target_labels[0] AS target_label, coalesce(target.import_key, elementId(target)) AS target
+        """
+
+    async def _records(self, labels):
+        for position, label in enumerate(labels):
+            async for record in self.db_handler.stream_query(self._node_query(label), {'earlier': list(labels[:position])}):
+                properties = dict(record['properties'])
+                vector = properties.pop('vector', None)
+                properties.pop('import_key', None)
+                yield {
+                    'kind': 'node',
+                    'id': record['id'],
+                    'label': label,
+                    'key': record['key'],
+                    'properties': properties,
+                    'vector': np.asarray(vector, dtype=VECTOR_DTYPES[SNAPSHOT_VERSION]).tobytes() if vector is not None else None
+                }
+        async for record in self.db_handler.stream_query(self._relation_query(), {'labels': list(labels)}):
+            properties = dict(record['properties'])
+            properties.pop('import_key', None)
+            yield {
+                'kind': 'relation',
+                'id': record['id'],
+                'key': record['key'],
+                'type': record['type'],
+                'source_label': record['source_label'],
+                'source': record['source'],
+                'target_label': record['target_label'],
+                'target': record['target'],
+                'properties': properties
+            }
+
+    async def export_msgpack(self, labels=NODE_LABELS, chunk_size=1000):
+        # A sequence of msgpack maps: header, nodes, relations, trailer with counts
+        import msgpack
+
+        # Temporal values are not msgpack types; they are written as ISO strings
+        packer = msgpack.Packer(default=str)
+        buffer = [packer.pack({'kind': 'header', 'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION, 'created_at': datetime.now().isoformat(), 'labels': list(labels)})]
+        counts = {'node': 0, 'relation': 0}
+        async for record in self._records(labels):
+            counts[record['kind']] += 1
+            buffer.append(packer.pack(record))
+            if len(buffer) >= chunk_size:
+                yield b''.join(buffer)
+                buffer = []
+        buffer.append(packer.pack({'kind': 'trailer', 'nodes': counts['node'], 'relations': counts['relation']}))
+        yield b''.join(buffer)
+        logger.info(f"Exported {counts['node']} nodes and {counts['relation']} relations")
+
+    async def export_arrow(self, labels=NODE_LABELS, chunk_size=1000):
+        # Arrow IPC stream with one row per node or relation, for offline
+        # analysis (pyarrow, pandas, polars, DuckDB). Properties are JSON strings
+        # because every element may have different keys.
+        import pyarrow as pa
+
+        schema = pa.schema([
+            ('kind', pa.string()),
+            ('id', pa.string()),
+            ('label', pa.string()),
+            ('key', pa.string()),
+            ('type', pa.string()),
+            ('source_label', pa.string()),
+            ('source', pa.string()),
+            ('target_label', pa.string()),
+            ('target', pa.string()),
+            ('properties', pa.string()),
+            ('vector', pa.list_(pa.float64()))
+        ])
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+
+        def drain():
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data
+
+        rows = []
+        async for record in self._records(labels):
+            record['properties'] = json.dumps(record['properties'], default=str)
+            if record.get('vector') is not None:
+                record['vector'] = np.frombuffer(record['vector'], dtype=VECTOR_DTYPES[SNAPSHOT_VERSION]).tolist()
+            rows.append(record)
+            if len(rows) >= chunk_size:
+                writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+                rows = []
+                yield drain()
+        if rows:
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+        writer.close()
+        yield drain()
@@ -1,15 +1,40 @@
-import json
+import asyncio
 from datetime import datetime
 from typing import List
+from handlers.FullTextHandler import FullTextHandler
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import QueryBuilder
 
 class TaskHandler:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, vector_index=None, metadata_handler=None, cache_handler=None, query_builder=None, embedding_pipeline=None, node_loader=None):
         self.db_handler = db_handler
+        self.cache_handler = cache_handler
+        # Batches concurrent by-id lookups into one query
+        self.node_loader = node_loader
+        # Fills in the vector of tasks created or edited without one
+        self.embedding_pipeline = embedding_pipeline
+        self.metadata_handler = metadata_handler or MetadataHandler()
+        self.node_mapper = NodeMapper(self.metadata_handler)
+        self.query_builder = query_builder or QueryBuilder(self.metadata_handler)
+        self.vector_index = vector_index
+        self.full_text_handler = FullTextHandler(db_handler)
+        # (index name, dimension) once a native Neo4j vector index is in use
+        self.native_vector_index = None
+
+    def _check_vector(self, vector):
+        if vector is None:
+            return
+        if self.native_vector_index and len(vector) != self.native_vector_index[1]:
+            raise ValueError(f"Vector has dimension {len(vector)}, index expects {self.native_vector_index[1]}.")
+        if self.vector_index:
+            self.vector_index.check_dimension('Task', vector)
+
+    async def create_task(self, title, description, metadata=None, vector=None):
+        self._check_vector(vector)
 
-    def create_task(self, title, description, metadata=None, vector=None):
         created_at = datetime.now().isoformat()
         updated_at = created_at
-        metadata_json = json.dumps(metadata) if metadata else None
         
         query = """
         CREATE (task:Task {
@@ -17,88 +42,144 @@ class TaskHandler:
             description: $description,
             created_at: $created_at,
             updated_at: $updated_at,
-            metadata: $metadata,
             vector: $vector
         })
+        SET task += $metadata_properties
         RETURN task, elementId(task) AS id
         """
-        result = self.db_handler.execute_query(query, {
+        result = await self.db_handler.execute_write(query, {
             'title': title,
             'description': description,
             'created_at': created_at,
             'updated_at': updated_at,
-            'metadata': metadata_json,
+            'metadata_properties': self.metadata_handler.encode(metadata),
             'vector': vector
         })
         if result:
-            task = dict(result[0]['task'])
-            task['id'] = result[0]['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
+            task = self.node_mapper.node(result[0]['task'], result[0]['id'])
+            if self.vector_index:
+                self.vector_index.add('Task', task['id'], vector)
+            if vector is None and self.embedding_pipeline:
+                self.embedding_pipeline.enqueue('Task', task['id'])
             return task
         return None
 
-    def get_task_by_id(self, id):
+    async def create_tasks(self, tasks, chunk_size=1000):
+        created_at = datetime.now().isoformat()
+        rows = []
+        errors = []
+        for index, task in tasks:
+            try:
+                self._check_vector(task.get('vector'))
+                rows.append({
+                    'index': index,
+                    'title': task['title'],
+                    'description': task['description'],
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                    'metadata_properties': self.metadata_handler.encode(task.get('metadata')),
+                    'vector': task.get('vector')
+                })
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        query = """
+        UNWIND $rows AS row
+        CREATE (task:Task {
+            title: row.title,
+            description: row.description,
+            created_at: row.created_at,
+            updated_at: row.updated_at,
+            vector: row.vector
+        })
+        SET task += row.metadata_properties
+        RETURN row.index AS index, elementId(task) AS id
+        """
+        result, chunk_errors = await self.db_handler.execute_in_chunks(query, rows, chunk_size)
+        errors.extend(chunk_errors)
+        created = [{'index': record['index'], 'id': record['id']} for record in result]
+        if self.vector_index:
+            vectors = {row['index']: row['vector'] for row in rows}
+            for record in created:
+                self.vector_index.add('Task', record['id'], vectors[record['index']])
+        if self.embedding_pipeline:
+            missing = {row['index'] for row in rows if row['vector'] is None}
+            self.embedding_pipeline.enqueue('Task', *[record['id'] for record in created if record['index'] in missing])
+        return created, errors
+
+    async def get_task_by_id(self, id):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Task', 'id', id)
+            if cached is not None:
+                return cached
+
+        if self.node_loader:
+            task = await self.node_loader.load('Task', id)
+            if task and self.cache_handler:
+                await self.cache_handler.set('Task', 'id', id, task)
+            return task
+
         query = """
         MATCH (task:Task)
         WHERE elementId(task) = $id
         RETURN task, elementId(task) AS id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_read(query, {'id': id})
         if result:
-            task = dict(result[0]['task'])
-            task['id'] = result[0]['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
+            task = self.node_mapper.node(result[0]['task'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Task', 'id', id, task)
             return task
         return None
 
-    def get_task_by_title(self, title):
+    async def get_task_by_title(self, title):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Task', 'title', title)
+            if cached is not None:
+                return cached
+
         query = """
         MATCH (task:Task {title: $title})
         RETURN task, elementId(task) AS id
         """
-        result = self.db_handler.execute_query(query, {'title': title})
+        result = await self.db_handler.execute_read(query, {'title': title})
         if result:
-            task = dict(result[0]['task'])
-            task['id'] = result[0]['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
+            task = self.node_mapper.node(result[0]['task'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Task', 'title', title, task)
             return task
         return None
 
-    def update_task(self, id, title=None, description=None, metadata=None):
+    async def update_task(self, id, title=None, description=None, metadata=None, vector=None):
+        self._check_vector(vector)
+
         updated_at = datetime.now().isoformat()
         
-        set_clauses = []
-        parameters = {'id': id, 'updated_at': updated_at}
-        
-        if title is not None:
-            set_clauses.append("task.title = $title")
-            parameters['title'] = title
-        if description is not None:
-            set_clauses.append("task.description = $description")
-            parameters['description'] = description
+        parameters = {
+            'id': id,
+            'properties': self.query_builder.properties(title=title, description=description, vector=vector, updated_at=updated_at)
+        }
+        if vector is not None:
+            # Not made by the embedding pipeline, so not refreshed by its catch-up job
+            parameters['properties'].update(embedding_model=None, embedding_version=None, embedded_at=None)
         if metadata is not None:
-            metadata_json = json.dumps(metadata)
-            set_clauses.append("task.metadata = $metadata")
-            parameters['metadata'] = metadata_json
-        
-        set_clauses.append("task.updated_at = $updated_at")
-        set_clause = ", ".join(set_clauses)
-        
-        query = f"""
-        MATCH (task:Task)
-        WHERE elementId(task) = $id
-        SET {set_clause}
-        RETURN task, elementId(task) AS id
-        """
-        result = self.db_handler.execute_query(query, parameters)
+            parameters['metadata_properties'] = self.metadata_handler.encode(metadata)
+
+        work = self.query_builder.update_node('Task', 'task', metadata is not None)
+        result = await self.db_handler.run_in_transaction(work, parameters)
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
-            task = dict(result[0]['task'])
-            task['id'] = result[0]['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
+            task = self.node_mapper.node(result[0]['task'], result[0]['id'])
+            if self.vector_index:
+                self.vector_index.add('Task', task['id'], vector)
+            # The stored vector is recomputed when the embedded text changed
+            if vector is None and (title is not None or description is not None) and self.embedding_pipeline:
+                self.embedding_pipeline.enqueue('Task', task['id'])
             return task
         return None
 
-    def delete_task(self, id):
+    async def delete_task(self, id):
         query = """
         MATCH (task:Task)
         WHERE elementId(task) = $id
@@ -106,14 +187,21 @@ class TaskHandler:
         DETACH DELETE task
         RETURN id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_write(query, {'id': id})
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
+            if self.vector_index:
+                self.vector_index.remove('Task', result[0]['id'])
             return result[0]['id']
         return None
 
-    def search_tasks(self, title=None, description=None, metadata=None):
+    async def search_tasks(self, title=None, description=None, metadata=None, text=None, fuzzy=False, prefix=False, skip=0, limit=None, meta_filters=None, fields=None, include_vector=False):
+        if text:
+            return await self._full_text_search_tasks(text, fuzzy, prefix, skip, limit or 20, meta_filters, fields, include_vector)
+
         conditions = []
-        parameters = {}
+        parameters = {'skip': skip}
         
         if title:
             conditions.append("task.title CONTAINS $title")
@@ -122,32 +210,49 @@ class TaskHandler:
             conditions.append("task.description CONTAINS $description")
             parameters['description'] = description
         if metadata:
-            conditions.append("task.metadata CONTAINS $metadata")
-            parameters['metadata'] = json.dumps(metadata)
+            conditions.extend(self.metadata_handler.match_conditions('task', metadata, parameters))
+        conditions.extend(self.metadata_handler.filter_conditions('task', meta_filters or [], parameters))
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
         query = f"""
         MATCH (task:Task)
         WHERE {where_clause}
-        RETURN task, elementId(task) AS id
+        RETURN {self.query_builder.projection('task', fields, include_vector)} AS task, elementId(task) AS id
+        SKIP $skip
+        {"LIMIT $limit" if limit else ""}
         """
-        result = self.db_handler.execute_query(query, parameters)
+        if limit:
+            parameters['limit'] = limit
+        result = await self.db_handler.execute_read(query, parameters)
         tasks = []
         for record in result:
-            task = dict(record['task'])
-            task['id'] = record['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
+            task = self.node_mapper.node(record['task'], record['id'], fields, include_vector)
             tasks.append(task)
         return tasks
 
-    def find_similar_tasks(self, vector: List[float], top_n=5):
-        run_similarity_query = """
+    async def _full_text_search_tasks(self, text, fuzzy=False, prefix=False, skip=0, limit=20, meta_filters=None, fields=None, include_vector=False):
+        parameters = {}
+        conditions = self.metadata_handler.filter_conditions('node', meta_filters or [], parameters)
+        result = await self.full_text_handler.query_nodes('task_fulltext', text, fuzzy, prefix, skip, limit, conditions, parameters, self.query_builder.projection('node', fields, include_vector))
+        tasks = []
+        for record in result:
+            task = self.node_mapper.node(record['node'], record['id'], fields, include_vector, score=record['score'])
+            tasks.append(task)
+        return tasks
+
+    async def find_similar_tasks(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        if self.native_vector_index:
+            return await self._find_similar_tasks_native(vector, top_n, fields, include_vector)
+        if self.vector_index:
+            return await self._find_similar_tasks_in_index(vector, top_n, fields, include_vector)
+
+        run_similarity_query = f"""
         WITH $vector AS target_vector
         MATCH (task:Task)
         WHERE task.vector IS NOT NULL
         WITH task, gds.similarity.cosine(task.vector, target_vector) AS similarity
-        RETURN task, elementId(task) AS id, similarity
+        RETURN {self.query_builder.projection('task', fields, include_vector)} AS task, elementId(task) AS id, similarity
         ORDER BY similarity DESC
         LIMIT $top_n
         """
@@ -156,13 +261,58 @@ class TaskHandler:
             'vector': vector,
             'top_n': top_n
         }
-        result = self.db_handler.execute_query(run_similarity_query, parameters)
+        result = await self.db_handler.execute_read(run_similarity_query, parameters)
 
         similar_tasks = []
         for record in result:
-            task = dict(record['task'])
-            task['id'] = record['id']
-            task['similarity'] = record['similarity']
+            task = self.node_mapper.node(record['task'], record['id'], fields, include_vector, similarity=record['similarity'])
             similar_tasks.append(task)
         
         return similar_tasks
+
+    async def _find_similar_tasks_native(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        self._check_vector(vector)
+
+        # queryNodes reports cosine as (1 + cos) / 2; convert it back so the
+        # similarity matches the other search paths
+        query = f"""
+        CALL db.index.vector.queryNodes($index_name, $top_n, $vector)
+        YIELD node AS task, score
+        RETURN {self.query_builder.projection('task', fields, include_vector)} AS task, elementId(task) AS id, 2 * score - 1 AS similarity
+        """
+        result = await self.db_handler.execute_read(query, {
+            'index_name': self.native_vector_index[0],
+            'top_n': top_n,
+            'vector': vector
+        })
+
+        similar_tasks = []
+        for record in result:
+            task = self.node_mapper.node(record['task'], record['id'], fields, include_vector, similarity=record['similarity'])
+            similar_tasks.append(task)
+
+        return similar_tasks
+
+    async def _find_similar_tasks_in_index(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        # Scoring a large index takes long enough to stall other requests
+        hits = await asyncio.to_thread(self.vector_index.search, 'Task', vector, top_n)
+        if not hits:
+            return []
+
+        query = f"""
+        UNWIND $ids AS id
+        MATCH (task:Task)
+        WHERE elementId(task) = id
+        RETURN {self.query_builder.projection('task', fields, include_vector)} AS task, elementId(task) AS id
+        """
+        result = await self.db_handler.execute_read(query, {'ids': [id for id, _ in hits]})
+        found = {record['id']: record['task'] for record in result}
+
+        similar_tasks = []
+        for id, similarity in hits:
+            if id not in found:
+                continue
+            task = self.node_mapper.node(found[id], id, fields, include_vector, similarity=similarity)
+            similar_tasks.append(task)
+
+        return similar_tasks
@@ -1,15 +1,40 @@
-import json
+import asyncio
 from datetime import datetime
 from typing import List
+from handlers.FullTextHandler import FullTextHandler
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import QueryBuilder
 
 class ThingHandler:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, vector_index=None, metadata_handler=None, cache_handler=None, query_builder=None, embedding_pipeline=None, node_loader=None):
         self.db_handler = db_handler
+        self.cache_handler = cache_handler
+        # Batches concurrent by-id lookups into one query
+        self.node_loader = node_loader
+        # Fills in the vector of things created or edited without one
+        self.embedding_pipeline = embedding_pipeline
+        self.metadata_handler = metadata_handler or MetadataHandler()
+        self.node_mapper = NodeMapper(self.metadata_handler)
+        self.query_builder = query_builder or QueryBuilder(self.metadata_handler)
+        self.vector_index = vector_index
+        self.full_text_handler = FullTextHandler(db_handler)
+        # (index name, dimension) once a native Neo4j vector index is in use
+        self.native_vector_index = None
+
+    def _check_vector(self, vector):
+        if vector is None:
+            return
+        if self.native_vector_index and len(vector) != self.native_vector_index[1]:
+            raise ValueError(f"Vector has dimension {len(vector)}, index expects {self.native_vector_index[1]}.")
+        if self.vector_index:
+            self.vector_index.check_dimension('Thing', vector)
+
+    async def create_thing(self, name, description, metadata=None, vector=None):
+        self._check_vector(vector)
 
-    def create_thing(self, name, description, metadata=None, vector=None):
         created_at = datetime.now().isoformat()
         updated_at = created_at
-        metadata_json = json.dumps(metadata) if metadata else None
         
         query = """
         CREATE (t:Thing {
@@ -17,102 +42,218 @@ class ThingHandler:
             description: $description,
             created_at: $created_at,
             updated_at: $updated_at,
-            metadata: $metadata,
             vector: $vector
         })
+        SET t += $metadata_properties
         RETURN t, elementId(t) AS id
         """
-        result = self.db_handler.execute_query(query, {
+        result = await self.db_handler.execute_write(query, {
             'name': name,
             'description': description,
             'created_at': created_at,
             'updated_at': updated_at,
-            'metadata': metadata_json,
+            'metadata_properties': self.metadata_handler.encode(metadata),
             'vector': vector
         })
         if result:
-            thing = dict(result[0]['t'])
-            thing['id'] = result[0]['id']
-            thing['metadata'] = json.loads(thing['metadata']) if thing.get('metadata') else None
+            thing = self.node_mapper.node(result[0]['t'], result[0]['id'])
+            if self.vector_index:
+                self.vector_index.add('Thing', thing['id'], vector)
+            if vector is None and self.embedding_pipeline:
+                self.embedding_pipeline.enqueue('Thing', thing['id'])
             return thing
         return None
 
-    def get_thing_by_id(self, id):
+    async def create_thing_with_relations(self, name, description, metadata=None, vector=None, relations=None):
+        # Creates the thing and its relations in one transaction: if a target is
+        # missing, nothing is written. `relations` holds dicts with target_id,
+        # relation_type and optional metadata; the thing is their source.
+        self._check_vector(vector)
+        relations = relations or []
+        relation_queries = [self.query_builder.create_relation(relation['relation_type'], 'Thing') for relation in relations]
+
+        created_at = datetime.now().isoformat()
+        create_query = """
+        CREATE (t:Thing {
+            name: $name,
+            description: $description,
+            created_at: $created_at,
+            updated_at: $updated_at,
+            vector: $vector
+        })
+        SET t += $metadata_properties
+        RETURN t, elementId(t) AS id
+        """
+        parameters = {
+            'name': name,
+            'description': description,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'metadata_properties': self.metadata_handler.encode(metadata),
+            'vector': vector
+        }
+
+        async def work(unit_of_work):
+            result = await unit_of_work.run(create_query, parameters)
+            thing = self.node_mapper.node(result[0]['t'], result[0]['id'], relations=[])
+            for relation, relation_query in zip(relations, relation_queries):
+                created = await unit_of_work.run(relation_query, {
+                    'source_id': thing['id'],
+                    'target_id': relation['target_id'],
+                    'properties': {},
+                    'metadata_properties': self.metadata_handler.encode(relation.get('metadata'))
+                })
+                if not created:
+                    raise LookupError(f"Target '{relation['target_id']}' not found.")
+                thing['relations'].append({
+                    'relation_id': created[0]['relation_id'],
+                    'relation_type': relation['relation_type'],
+                    'target_id': relation['target_id']
+                })
+            return thing
+
+        thing = await self.db_handler.run_in_transaction(work)
+        # Side effects outside the graph only happen once the transaction has committed
+        if self.vector_index:
+            self.vector_index.add('Thing', thing['id'], vector)
+        if vector is None and self.embedding_pipeline:
+            self.embedding_pipeline.enqueue('Thing', thing['id'])
+        if self.cache_handler:
+            await self.cache_handler.invalidate(*[relation['target_id'] for relation in relations])
+        return thing
+
+    async def create_things(self, things, chunk_size=1000):
+        created_at = datetime.now().isoformat()
+        rows = []
+        errors = []
+        for index, thing in things:
+            try:
+                self._check_vector(thing.get('vector'))
+                rows.append({
+                    'index': index,
+                    'name': thing['name'],
+                    'description': thing['description'],
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                    'metadata_properties': self.metadata_handler.encode(thing.get('metadata')),
+                    'vector': thing.get('vector')
+                })
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+
+        query = """
+        UNWIND $rows AS row
+        CREATE (t:Thing {
+            name: row.name,
+            description: row.description,
+            created_at: row.created_at,
+            updated_at: row.updated_at,
+            vector: row.vector
+        })
+        SET t += row.metadata_properties
+        RETURN row.index AS index, elementId(t) AS id
+        """
+        result, chunk_errors = await self.db_handler.execute_in_chunks(query, rows, chunk_size)
+        errors.extend(chunk_errors)
+        created = [{'index': record['index'], 'id': record['id']} for record in result]
+        if self.vector_index:
+            vectors = {row['index']: row['vector'] for row in rows}
+            for record in created:
+                self.vector_index.add('Thing', record['id'], vectors[record['index']])
+        if self.embedding_pipeline:
+            missing = {row['index'] for row in rows if row['vector'] is None}
+            self.embedding_pipeline.enqueue('Thing', *[record['id'] for record in created if record['index'] in missing])
+        return created, errors
+
+    async def get_thing_by_id(self, id):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Thing', 'id', id)
+            if cached is not None:
+                return cached
+
+        if self.node_loader:
+            thing = await self.node_loader.load('Thing', id)
+            if thing and self.cache_handler:
+                await self.cache_handler.set('Thing', 'id', id, thing)
+            return thing
+
         query = """
         MATCH (t:Thing)
         WHERE elementId(t) = $id
         RETURN t, elementId(t) AS id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_read(query, {'id': id})
         if result:
-            thing = dict(result[0]['t'])
-            thing['id'] = result[0]['id']
-            thing['metadata'] = json.loads(thing['metadata']) if thing.get('metadata') else None
+            thing = self.node_mapper.node(result[0]['t'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Thing', 'id', id, thing)
             return thing
         return None
 
-    def get_thing_by_name(self, name):
+    async def get_thing_by_name(self, name):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('Thing', 'name', name)
+            if cached is not None:
+                return cached
+
         query = """
         MATCH (t:Thing {name: $name})
         RETURN t, elementId(t) AS id
         """
-        result = self.db_handler.execute_query(query, {'name': name})
+        result = await self.db_handler.execute_read(query, {'name': name})
         if result:
-            thing = dict(result[0]['t'])
-            thing['id'] = result[0]['id']
-            thing['metadata'] = json.loads(thing['metadata']) if thing.get('metadata') else None
+            thing = self.node_mapper.node(result[0]['t'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('Thing', 'name', name, thing)
             return thing
         return None
 
-    def get_all_things(self):
-        query = """
-        MATCH (task:Thing)
-        RETURN task, elementId(task) AS id
-        """
-        result = self.db_handler.execute_query(query)
+    async def get_all_things(self, after=None, limit=None, fields=None, include_vector=False):
+        # Returns (things, cursor of the next page or None)
+        query = self.query_builder.list_nodes('Thing', 't', self.query_builder.projection('t', fields, include_vector), limit)
+        result = await self.db_handler.execute_read(query, self.query_builder.page_parameters(after, limit))
         things = []
         for record in result:
-            task = dict(record['task'])
-            task['id'] = record['id']
-            task['metadata'] = json.loads(task['metadata']) if task.get('metadata') else None
-            things.append(task)
-        return things
+            thing = self.node_mapper.node(record['t'], record['id'], fields, include_vector)
+            things.append(thing)
+        return things, self.query_builder.next_cursor(result, limit)
+
+    async def stream_all_things(self, page=None, fields=None, include_vector=False):
+        query = self.query_builder.list_nodes('Thing', 't', self.query_builder.projection('t', fields, include_vector))
+        async for record in self.db_handler.stream_query(query, page or self.query_builder.page_parameters()):
+            thing = self.node_mapper.node(record['t'], record['id'], fields, include_vector)
+            yield thing
+
+    async def update_thing(self, id, name=None, description=None, metadata=None, vector=None):
+        self._check_vector(vector)
 
-    def update_thing(self, id, name=None, description=None, metadata=None):
         updated_at = datetime.now().isoformat()
         
-        set_clauses = []
-        parameters = {'id': id, 'updated_at': updated_at}
-        
-        if name is not None:
-            set_clauses.append("t.name = $name")
-            parameters['name'] = name
-        if description is not None:
-            set_clauses.append("t.description = $description")
-            parameters['description'] = description
+        parameters = {
+            'id': id,
+            'properties': self.query_builder.properties(name=name, description=description, vector=vector, updated_at=updated_at)
+        }
+        if vector is not None:
+            # Not made by the embedding pipeline, so not refreshed by its catch-up job
+            parameters['properties'].update(embedding_model=None, embedding_version=None, embedded_at=None)
         if metadata is not None:
-            metadata_json = json.dumps(metadata)
-            set_clauses.append("t.metadata = $metadata")
-            parameters['metadata'] = metadata_json
-        
-        set_clauses.append("t.updated_at = $updated_at")
-        set_clause = ", ".join(set_clauses)
-        
-        query = f"""
-        MATCH (t:Thing)
-        WHERE elementId(t) = $id
-        SET {set_clause}
-        RETURN t, elementId(t) AS id
-        """
-        result = self.db_handler.execute_query(query, parameters)
+            parameters['metadata_properties'] = self.metadata_handler.encode(metadata)
+
+        work = self.query_builder.update_node('Thing', 't', metadata is not None)
+        result = await self.db_handler.run_in_transaction(work, parameters)
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
-            thing = dict(result[0]['t'])
-            thing['id'] = result[0]['id']
-            thing['metadata'] = json.loads(thing['metadata']) if thing.get('metadata') else None
+            thing = self.node_mapper.node(result[0]['t'], result[0]['id'])
+            if self.vector_index:
+                self.vector_index.add('Thing', thing['id'], vector)
+            # The stored vector is recomputed when the embedded text changed
+            if vector is None and (name is not None or description is not None) and self.embedding_pipeline:
+                self.embedding_pipeline.enqueue('Thing', thing['id'])
             return thing
         return None
 
-    def delete_thing(self, id):
+    async def delete_thing(self, id):
         query = """
         MATCH (t:Thing)
         WHERE elementId(t) = $id
@@ -120,14 +261,21 @@ class ThingHandler:
         DETACH DELETE t
         RETURN id
         """
-        result = self.db_handler.execute_query(query, {'id': id})
+        result = await self.db_handler.execute_write(query, {'id': id})
+        if self.cache_handler:
+            await self.cache_handler.invalidate(id)
         if result:
+            if self.vector_index:
+                self.vector_index.remove('Thing', result[0]['id'])
             return result[0]['id']
         return None
 
-    def search_things(self, name=None, description=None, metadata=None):
+    async def search_things(self, name=None, description=None, metadata=None, text=None, fuzzy=False, prefix=False, skip=0, limit=None, meta_filters=None, fields=None, include_vector=False):
+        if text:
+            return await self._full_text_search_things(text, fuzzy, prefix, skip, limit or 20, meta_filters, fields, include_vector)
+
         conditions = []
-        parameters = {}
+        parameters = {'skip': skip}
         
         if name:
             conditions.append("t.name CONTAINS $name")
@@ -136,32 +284,49 @@ class ThingHandler:
             conditions.append("t.description CONTAINS $description")
             parameters['description'] = description
         if metadata:
-            conditions.append("t.metadata CONTAINS $metadata")
-            parameters['metadata'] = json.dumps(metadata)
+            conditions.extend(self.metadata_handler.match_conditions('t', metadata, parameters))
+        conditions.extend(self.metadata_handler.filter_conditions('t', meta_filters or [], parameters))
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
         query = f"""
         MATCH (t:Thing)
         WHERE {where_clause}
-        RETURN t, elementId(t) AS id
+        RETURN {self.query_builder.projection('t', fields, include_vector)} AS t, elementId(t) AS id
+        SKIP $skip
+        {"LIMIT $limit" if limit else ""}
         """
-        result = self.db_handler.execute_query(query, parameters)
+        if limit:
+            parameters['limit'] = limit
+        result = await self.db_handler.execute_read(query, parameters)
+        things = []
+        for record in result:
+            thing = self.node_mapper.node(record['t'], record['id'], fields, include_vector)
+            things.append(thing)
+        return things
+
+    async def _full_text_search_things(self, text, fuzzy=False, prefix=False, skip=0, limit=20, meta_filters=None, fields=None, include_vector=False):
+        parameters = {}
+        conditions = self.metadata_handler.filter_conditions('node', meta_filters or [], parameters)
+        result = await self.full_text_handler.query_nodes('thing_fulltext', text, fuzzy, prefix, skip, limit, conditions, parameters, self.query_builder.projection('node', fields, include_vector))
         things = []
         for record in result:
-            thing = dict(record['t'])
-            thing['id'] = record['id']
-            thing['metadata'] = json.loads(thing['metadata']) if thing.get(['metadata']) else None
+            thing = self.node_mapper.node(record['node'], record['id'], fields, include_vector, score=record['score'])
             things.append(thing)
         return things
 
-    def find_similar_things(self, vector: List[float], top_n=5):
-        run_similarity_query = """
+    async def find_similar_things(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        if self.native_vector_index:
+            return await self._find_similar_things_native(vector, top_n, fields, include_vector)
+        if self.vector_index:
+            return await self._find_similar_things_in_index(vector, top_n, fields, include_vector)
+
+        run_similarity_query = f"""
         WITH $vector AS target_vector
         MATCH (t:Thing)
         WHERE t.vector IS NOT NULL
         WITH t, gds.similarity.cosine(t.vector, target_vector) AS similarity
-        RETURN t, elementId(t) AS id, similarity
+        RETURN {self.query_builder.projection('t', fields, include_vector)} AS t, elementId(t) AS id, similarity
         ORDER BY similarity DESC
         LIMIT $top_n
         """
@@ -170,13 +335,58 @@ class ThingHandler:
             'vector': vector,
             'top_n': top_n
         }
-        result = self.db_handler.execute_query(run_similarity_query, parameters)
+        result = await self.db_handler.execute_read(run_similarity_query, parameters)
 
         similar_things = []
         for record in result:
-            thing = dict(record['t'])
-            thing['id'] = record['id']
-            thing['similarity'] = record['similarity']
+            thing = self.node_mapper.node(record['t'], record['id'], fields, include_vector, similarity=record['similarity'])
             similar_things.append(thing)
         
         return similar_things
+
+    async def _find_similar_things_native(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        self._check_vector(vector)
+
+        # queryNodes reports cosine as (1 + cos) / 2; convert it back so the
+        # similarity matches the other search paths
+        query = f"""
+        CALL db.index.vector.queryNodes($index_name, $top_n, $vector)
+        YIELD node AS t, score
+        RETURN {self.query_builder.projection('t', fields, include_vector)} AS t, elementId(t) AS id, 2 * score - 1 AS similarity
+        """
+        result = await self.db_handler.execute_read(query, {
+            'index_name': self.native_vector_index[0],
+            'top_n': top_n,
+            'vector': vector
+        })
+
+        similar_things = []
+        for record in result:
+            thing = self.node_mapper.node(record['t'], record['id'], fields, include_vector, similarity=record['similarity'])
+            similar_things.append(thing)
+
+        return similar_things
+
+    async def _find_similar_things_in_index(self, vector: List[float], top_n=5, fields=None, include_vector=False):
+        # Scoring a large index takes long enough to stall other requests
+        hits = await asyncio.to_thread(self.vector_index.search, 'Thing', vector, top_n)
+        if not hits:
+            return []
+
+        query = f"""
+        UNWIND $ids AS id
+        MATCH (t:Thing)
+        WHERE elementId(t) = id
+        RETURN {self.query_builder.projection('t', fields, include_vector)} AS t, elementId(t) AS id
+        """
+        result = await self.db_handler.execute_read(query, {'ids': [id for id, _ in hits]})
+        found = {record['id']: record['t'] for record in result}
+
+        similar_things = []
+        for id, similarity in hits:
+            if id not in found:
+                continue
+            thing = self.node_mapper.node(found[id], id, fields, include_vector, similarity=similarity)
+            similar_things.append(thing)
+
+        return similar_things
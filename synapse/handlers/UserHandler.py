@@ -1,123 +1,188 @@
-import json
 from datetime import datetime
+from neo4j.exceptions import ConstraintError
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeMapper import NodeMapper
+from handlers.QueryBuilder import QueryBuilder
 
 class UserHandler:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, metadata_handler=None, cache_handler=None, query_builder=None, node_loader=None):
         self.db_handler = db_handler
+        self.cache_handler = cache_handler
+        # Batches concurrent by-id lookups into one query
+        self.node_loader = node_loader
+        self.metadata_handler = metadata_handler or MetadataHandler()
+        self.node_mapper = NodeMapper(self.metadata_handler)
+        self.query_builder = query_builder or QueryBuilder(self.metadata_handler)
         
-    def create_user(self, username, email, metadata=None):
-        # Check if a user with the same username already exists
-        existing_user = self.get_user_by_username(username)
-        if existing_user:
-            raise ValueError(f"User with username '{username}' already exists.")
-        
+    async def create_user(self, username, email, metadata=None):
         created_at = datetime.now().isoformat()
         updated_at = created_at
-        metadata_json = json.dumps(metadata) if metadata else None
         
         query = """
         CREATE (u:User {
             username: $username,
             email: $email,
             created_at: $created_at,
-            updated_at: $updated_at,
-            metadata: $metadata
+            updated_at: $updated_at
         })
+        SET u += $metadata_properties
         RETURN elementId(u) AS id
         """
-        result = self.db_handler.execute_query(query, {
-            'username': username,
-            'email': email,
-            'created_at': created_at,
-            'updated_at': updated_at,
-            'metadata': metadata_json
-        })
+        # Duplicate usernames are rejected by the user_username_unique constraint
+        try:
+            result = await self.db_handler.execute_write(query, {
+                'username': username,
+                'email': email,
+                'created_at': created_at,
+                'updated_at': updated_at,
+                'metadata_properties': self.metadata_handler.encode(metadata)
+            })
+        except ConstraintError:
+            raise ValueError(f"User with username '{username}' already exists.")
 
         if result:
             return result[0]['id']
         return None
 
-    def get_all_users(self):
+    async def create_users(self, users, chunk_size=1000):
+        created_at = datetime.now().isoformat()
+        rows = []
+        errors = []
+        seen_usernames = set()
+        for index, user in users:
+            if user['username'] in seen_usernames:
+                errors.append({'index': index, 'error': f"Duplicate username '{user['username']}' in request."})
+                continue
+            try:
+                metadata_properties = self.metadata_handler.encode(user.get('metadata'))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+                continue
+            seen_usernames.add(user['username'])
+            rows.append({
+                'index': index,
+                'username': user['username'],
+                'email': user['email'],
+                'created_at': created_at,
+                'updated_at': created_at,
+                'metadata_properties': metadata_properties
+            })
+
+        # Rows whose username is already taken are skipped and reported below
         query = """
-        MATCH (u:User)
-        RETURN u, elementId(u) AS id
+        UNWIND $rows AS row
+        WITH row
+        WHERE NOT EXISTS { MATCH (:User {username: row.username}) }
+        CREATE (u:User {
+            username: row.username,
+            email: row.email,
+            created_at: row.created_at,
+            updated_at: row.updated_at
+        })
+        SET u += row.metadata_properties
+        RETURN row.index AS index, elementId(u) AS id
         """
-        results = self.db_handler.execute_query(query)
+        result, chunk_errors = await self.db_handler.execute_in_chunks(query, rows, chunk_size)
+        created = [{'index': record['index'], 'id': record['id']} for record in result]
+
+        accounted = {error['index'] for error in chunk_errors} | {record['index'] for record in created}
+        errors.extend(chunk_errors)
+        errors.extend(
+            {'index': row['index'], 'error': f"User with username '{row['username']}' already exists."}
+            for row in rows if row['index'] not in accounted
+        )
+        errors.sort(key=lambda error: error['index'])
+        return created, errors
+
+    async def get_all_users(self, after=None, limit=None):
+        # Returns (users, cursor of the next page or None)
+        query = self.query_builder.list_nodes('User', 'u', limit=limit)
+        result = await self.db_handler.execute_read(query, self.query_builder.page_parameters(after, limit))
         users = []
-        for result in results:
-            user = dict(result['u'])
-            user['id'] = result['id']
-            user['metadata'] = json.loads(user['metadata']) if user.get('metadata') else None
+        for record in result:
+            user = self.node_mapper.node(record['u'], record['id'])
             users.append(user)
-        return users
+        return users, self.query_builder.next_cursor(result, limit)
+
+    async def stream_all_users(self, page=None):
+        query = self.query_builder.list_nodes('User', 'u')
+        async for record in self.db_handler.stream_query(query, page or self.query_builder.page_parameters()):
+            user = self.node_mapper.node(record['u'], record['id'])
+            yield user
+
+    async def get_user_by_username(self, username):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('User', 'username', username)
+            if cached is not None:
+                return cached
 
-    def get_user_by_username(self, username):
         query = """
         MATCH (u:User {username: $username})
         RETURN u, elementId(u) AS id
         """
-        result = self.db_handler.execute_query(query, {'username': username})
+        result = await self.db_handler.execute_read(query, {'username': username})
         if result:
-            user = dict(result[0]['u'])
-            user['id'] = result[0]['id']
-            user['metadata'] = json.loads(user['metadata']) if user.get('metadata') else None
+            user = self.node_mapper.node(result[0]['u'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('User', 'username', username, user)
             return user
         return None
 
-    def get_user_by_id(self, user_id):
+    async def get_user_by_id(self, user_id):
+        if self.cache_handler:
+            cached = await self.cache_handler.get('User', 'id', user_id)
+            if cached is not None:
+                return cached
+
+        if self.node_loader:
+            user = await self.node_loader.load('User', user_id)
+            if user and self.cache_handler:
+                await self.cache_handler.set('User', 'id', user_id, user)
+            return user
+
         query = """
         MATCH (u:User)
         WHERE elementId(u) = $user_id
         RETURN u, elementId(u) AS id
         """
-        result = self.db_handler.execute_query(query, {'user_id': user_id})
+        result = await self.db_handler.execute_read(query, {'user_id': user_id})
         if result:
-            user = dict(result[0]['u'])
-            user['id'] = result[0]['id']
-            user['metadata'] = json.loads(user['metadata']) if user.get('metadata') else None
+            user = self.node_mapper.node(result[0]['u'], result[0]['id'])
+            if self.cache_handler:
+                await self.cache_handler.set('User', 'id', user_id, user)
             return user
         return None
 
-    def update_user(self, user_id, username=None, email=None, metadata=None):
+    async def update_user(self, user_id, username=None, email=None, metadata=None):
         updated_at = datetime.now().isoformat()
         
-        set_clauses = []
-        parameters = {'user_id': user_id, 'updated_at': updated_at}
-        
-        if username is not None:
-            set_clauses.append("u.username = $username")
-            parameters['username'] = username
-        if email is not None:
-            set_clauses.append("u.email = $email")
-            parameters['email'] = email
+        parameters = {
+            'id': user_id,
+            'properties': self.query_builder.properties(username=username, email=email, updated_at=updated_at)
+        }
         if metadata is not None:
-            metadata_json = json.dumps(metadata)
-            set_clauses.append("u.metadata = $metadata")
-            parameters['metadata'] = metadata_json
-        
-        set_clauses.append("u.updated_at = $updated_at")
-        set_clause = ", ".join(set_clauses)
-        
-        query = f"""
-        MATCH (u:User)
-        WHERE elementId(u) = $user_id
-        SET {set_clause}
-        RETURN u, elementId(u) AS id
-        """
-        result = self.db_handler.execute_query(query, parameters)
+            parameters['metadata_properties'] = self.metadata_handler.encode(metadata)
+
+        work = self.query_builder.update_node('User', 'u', metadata is not None)
+        try:
+            result = await self.db_handler.run_in_transaction(work, parameters)
+        except ConstraintError:
+            raise ValueError(f"User with username '{username}' already exists.")
+        if self.cache_handler:
+            await self.cache_handler.invalidate(user_id)
         if result:
-            user = dict(result[0]['u'])
-            user['id'] = result[0]['id']
-            user['metadata'] = json.loads(user['metadata']) if user.get('metadata') else None
+            user = self.node_mapper.node(result[0]['u'], result[0]['id'])
             return user
         return None
 
-    def delete_user(self, user_id):
+    async def delete_user(self, user_id):
         query = """
         MATCH (u:User)
         WHERE elementId(u) = $user_id
         DETACH DELETE u
         RETURN elementId(u) AS id
         """
-        result = self.db_handler.execute_query(query, {'user_id': user_id})
+        result = await self.db_handler.execute_write(query, {'user_id': user_id})
+        if self.cache_handler:
+            await self.cache_handler.invalidate(user_id)
         return result[0]['id'] if result else None
@@ -0,0 +1,343 @@
+import asyncio
+import base64
+import json
+import os
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def pack_vector(vector):
+    # Vectors are stored as little-endian float32, a quarter of their JSON size
+    return np.asarray(vector, dtype='<f4').tobytes() if vector is not None else None
+
+def unpack_vector(data):
+    return np.frombuffer(data, dtype='<f4').tolist() if data is not None else None
+
+def encode_vector(vector):
+    # For JSON responses: base64 of the float32 bytes
+    return base64.b64encode(pack_vector(vector)).decode('ascii') if vector is not None else None
+
+class ExactVectorIndex:
+    kind = 'exact'
+
+    def __init__(self, dimension=None, capacity=1024):
+        self.dimension = dimension
+        self.vectors = np.zeros((capacity, dimension or 0), dtype=np.float32)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.ids = []
+        self.slots = {}
+        self.free_slots = []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def check_dimension(self, vector):
+        if self.dimension is not None and len(vector) != self.dimension:
+            raise ValueError(f"Vector has dimension {len(vector)}, index expects {self.dimension}.")
+
+    def _normalize(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _allocate_slot(self):
+        if self.free_slots:
+            return self.free_slots.pop()
+        slot = len(self.ids)
+        if slot >= len(self.active):
+            capacity = max(1024, len(self.active) * 2)
+            vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+            vectors[:slot] = self.vectors[:slot]
+            active = np.zeros(capacity, dtype=bool)
+            active[:slot] = self.active[:slot]
+            self.vectors, self.active = vectors, active
+        self.ids.append(None)
+        return slot
+
+    def add(self, id, vector):
+        if self.dimension is None:
+            self.dimension = len(vector)
+            self.vectors = np.zeros((len(self.active), self.dimension), dtype=np.float32)
+        self.check_dimension(vector)
+        slot = self.slots.get(id)
+        if slot is None:
+            slot = self._allocate_slot()
+            self.slots[id] = slot
+            self.ids[slot] = id
+        self.vectors[slot] = self._normalize(vector)
+        self.active[slot] = True
+        return slot
+
+    def add_many(self, ids, vectors):
+        for id, vector in zip(ids, vectors):
+            self.add(id, vector)
+
+    def remove(self, id):
+        slot = self.slots.pop(id, None)
+        if slot is None:
+            return False
+        self.active[slot] = False
+        self.ids[slot] = None
+        self.free_slots.append(slot)
+        return True
+
+    def _candidate_slots(self, query):
+        # None scores every slot
+        return None
+
+    def search(self, vector, top_n=5):
+        if not self.slots:
+            return []
+        self.check_dimension(vector)
+        query = self._normalize(vector)
+        candidates = self._candidate_slots(query)
+        if candidates is None:
+            # Scores the stored matrix in place; indexing it with the active
+            # slots would copy every vector on each query
+            size = len(self.ids)
+            scores = self.vectors[:size] @ query
+            scores[~self.active[:size]] = -np.inf
+            count = len(self.slots)
+        else:
+            if len(candidates) == 0:
+                return []
+            scores = self.vectors[candidates] @ query
+            count = len(candidates)
+        top_n = min(top_n, count)
+        best = np.argpartition(-scores, top_n - 1)[:top_n]
+        best = best[np.argsort(-scores[best])]
+        slots = best if candidates is None else candidates[best]
+        return [(self.ids[slot], float(scores[i])) for slot, i in zip(slots, best)]
+
+    def state(self):
+        size = len(self.ids)
+        return {
+            'kind': np.array(self.kind),
+            'dimension': np.array(self.dimension or 0),
+            'vectors': self.vectors[:size],
+            'active': self.active[:size],
+            'ids': np.array([id or '' for id in self.ids], dtype=str)
+        }
+
+    def load_state(self, state):
+        self.dimension = int(state['dimension']) or None
+        self.vectors = np.array(state['vectors'], dtype=np.float32)
+        self.active = np.array(state['active'], dtype=bool)
+        self.ids = [str(id) if active else None for id, active in zip(state['ids'], self.active)]
+        self.slots = {id: slot for slot, id in enumerate(self.ids) if id is not None}
+        self.free_slots = [slot for slot, id in enumerate(self.ids) if id is None]
+
+
+class IVFVectorIndex(ExactVectorIndex):
+    # Inverted-file index: vectors are bucketed by their nearest k-means centroid
+    # and a query only scores the buckets of its `nprobe` closest centroids.
+    kind = 'ivf'
+
+    def __init__(self, dimension=None, capacity=1024, nlist=1024, nprobe=16, train_iterations=10):
+        super().__init__(dimension, capacity)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.centroids = None
+        self.assignments = np.full(capacity, -1, dtype=np.int32)
+        # Background k-means task, and the slots written while it runs
+        self.training = None
+        self.changed = set()
+
+    def _allocate_slot(self):
+        slot = super()._allocate_slot()
+        if len(self.assignments) < len(self.active):
+            assignments = np.full(len(self.active), -1, dtype=np.int32)
+            assignments[:len(self.assignments)] = self.assignments
+            self.assignments = assignments
+        return slot
+
+    def add(self, id, vector):
+        slot = super().add(id, vector)
+        if self.centroids is not None:
+            self.assignments[slot] = int(np.argmax(self.centroids @ self.vectors[slot]))
+        elif self.training is not None:
+            self.changed.add(slot)
+        elif len(self.slots) >= self.nlist * 39:
+            self.start_training()
+        return slot
+
+    def _fit(self, vectors, slots):
+        # k-means over a sample of `slots`; returns the centroids and the list
+        # of every slot. Only reads `vectors`, so it can run in a thread.
+        nlist = min(self.nlist, len(slots))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(slots, size=min(len(slots), nlist * 256), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(self.train_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for list_no in range(nlist):
+                members = sample[labels == list_no]
+                if len(members):
+                    centroids[list_no] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+        assignments = np.empty(len(slots), dtype=np.int32)
+        for start in range(0, len(slots), 65536):
+            batch = slots[start:start + 65536]
+            assignments[start:start + 65536] = np.argmax(vectors[batch] @ centroids.T, axis=1)
+        return centroids, assignments
+
+    def _install(self, centroids, slots, assignments):
+        self.centroids = centroids
+        self.assignments[:] = -1
+        self.assignments[slots] = assignments
+        # Slots added or overwritten during training get their list now
+        for slot in self.changed:
+            if self.active[slot]:
+                self.assignments[slot] = int(np.argmax(centroids @ self.vectors[slot]))
+        self.changed = set()
+        logger.info(f"Trained IVF index with {len(centroids)} lists over {len(slots)} vectors")
+
+    def train(self):
+        slots = np.flatnonzero(self.active[:len(self.ids)])
+        if len(slots) == 0:
+            return
+        centroids, assignments = self._fit(self.vectors, slots)
+        self._install(centroids, slots, assignments)
+
+    def start_training(self):
+        # Training takes seconds on large indexes, so it runs in a worker thread
+        # and the index stays exact until the centroids are swapped in
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.train()
+            return
+        self.changed = set()
+        self.training = loop.create_task(self._train_in_background())
+
+    async def _train_in_background(self):
+        slots = np.flatnonzero(self.active[:len(self.ids)])
+        try:
+            centroids, assignments = await asyncio.to_thread(self._fit, self.vectors, slots)
+            self._install(centroids, slots, assignments)
+        except Exception as e:
+            logger.error(f"Training the IVF index failed: {str(e)}")
+        finally:
+            self.training = None
+
+    def _candidate_slots(self, query):
+        size = len(self.ids)
+        if self.centroids is None:
+            return super()._candidate_slots(query)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.flatnonzero(self.active[:size] & np.isin(self.assignments[:size], probes))
+
+    def state(self):
+        state = super().state()
+        state['assignments'] = self.assignments[:len(self.ids)]
+        if self.centroids is not None:
+            state['centroids'] = self.centroids
+        return state
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.assignments = np.array(state['assignments'], dtype=np.int32)
+        self.centroids = np.array(state['centroids'], dtype=np.float32) if 'centroids' in state else None
+
+
+INDEX_KINDS = {
+    ExactVectorIndex.kind: ExactVectorIndex,
+    IVFVectorIndex.kind: IVFVectorIndex
+}
+
+class VectorIndexHandler:
+    def __init__(self, db_handler, directory, kind='exact', labels=('Thing', 'Task'), **index_options):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown vector index kind '{kind}'. Expected one of {sorted(INDEX_KINDS)}.")
+        self.db_handler = db_handler
+        self.directory = directory
+        self.kind = kind
+        self.index_options = index_options
+        self.indexes = {label: self._new_index() for label in labels}
+
+    def _new_index(self):
+        return INDEX_KINDS[self.kind](**self.index_options)
+
+    def _path(self, label):
+        return os.path.join(self.directory, f"{label}.npz")
+
+    async def load_or_build(self):
+        for label in self.indexes:
+            if os.path.exists(self._path(label)) and await self.load(label):
+                continue
+            await self.rebuild(label)
+            await self.save(label)
+
+    async def _mark(self, label):
+        # What the stored index must match to be current: the number of nodes
+        # with a vector and the latest update / embedding time among them. A
+        # write that missed the file (a crash after it) changes one of them.
+        query = f"""
+        MATCH (n:{label})
+        WHERE n.vector IS NOT NULL
+        RETURN count(n) AS count, max(n.updated_at) AS updated_at, max(n.embedded_at) AS embedded_at
+        """
+        result = await self.db_handler.execute_read(query)
+        record = result[0]
+        return json.dumps({'count': record['count'], 'updated_at': record['updated_at'], 'embedded_at': record['embedded_at']}, default=str)
+
+    async def load(self, label):
+        with np.load(self._path(label)) as state:
+            if str(state['kind']) != self.kind:
+                logger.warning(f"Stored {label} vector index is '{state['kind']}', rebuilding as '{self.kind}'")
+                return False
+            if 'mark' not in state.files or str(state['mark']) != await self._mark(label):
+                logger.warning(f"Stored {label} vector index is out of date with the graph, rebuilding")
+                return False
+            index = self._new_index()
+            index.load_state({key: state[key] for key in state.files})
+        self.indexes[label] = index
+        logger.info(f"Loaded {label} vector index with {len(index)} vectors")
+        return True
+
+    async def rebuild(self, label):
+        query = f"""
+        MATCH (n:{label})
+        WHERE n.vector IS NOT NULL
+        RETURN elementId(n) AS id, n.vector AS vector
+        """
+        result = await self.db_handler.execute_read(query)
+        index = self._new_index()
+        index.add_many([record['id'] for record in result], [record['vector'] for record in result])
+        if isinstance(index, IVFVectorIndex):
+            if index.training is not None:
+                await index.training
+            elif index.centroids is None and len(index):
+                await asyncio.to_thread(index.train)
+        self.indexes[label] = index
+        logger.info(f"Built {label} vector index with {len(index)} vectors")
+
+    async def save(self, label=None):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in [label] if label else self.indexes:
+            # The mark is read before the state, so a write in between makes
+            # the file look stale rather than current
+            mark = await self._mark(name)
+            # Write to a temporary file first so a crash never leaves a truncated index
+            path = self._path(name)
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, mark=np.array(mark), **self.indexes[name].state())
+            os.replace(path + '.tmp', path)
+
+    def check_dimension(self, label, vector):
+        if vector is not None:
+            self.indexes[label].check_dimension(vector)
+
+    def add(self, label, id, vector):
+        if vector is not None:
+            self.indexes[label].add(id, vector)
+
+    def remove(self, label, id):
+        self.indexes[label].remove(id)
+
+    def search(self, label, vector, top_n=5):
+        return self.indexes[label].search(vector, top_n)
@@ -1,20 +1,86 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from responses import FastJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import logging
+import time
 
-from deps import get_db_handler
+from deps import get_db_handler, get_schema_handler, get_vector_index_handler, get_thing_handler, get_task_handler, get_metadata_handler, get_cache_handler, get_metrics_handler, get_embedding_handler, get_embedding_pipeline_handler, get_graph_handler
+from deps import NATIVE_VECTOR_INDEX, NATIVE_VECTOR_DIMENSION, METADATA_STORAGE, METADATA_INDEXED_KEYS, NEO4J_WARMUP_CONNECTIONS
 from routers.user_router import router as user_router
 from routers.thing_router import router as thing_router
 from routers.relations_router import router as relations_router
 from routers.place_router import router as place_router
+from routers.task_router import router as task_router
 from routers.filter_router import router as filter_router
 from routers.cortex_router import router as cortex_router
+from routers.schema_router import router as schema_router
+from routers.cache_router import router as cache_router
+from routers.metrics_router import router as metrics_router
+from routers.graph_router import router as graph_router
+from routers.nodes_router import router as nodes_router
+from routers.health_router import router as health_router
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Create constraints and indexes, then the native vector indexes;
+# a dimension mismatch aborts startup
+async def bootstrap_schema():
+    schema_handler = get_schema_handler()
+    await schema_handler.ensure_schema()
+    if METADATA_STORAGE == "properties":
+        await schema_handler.ensure_metadata_indexes(METADATA_INDEXED_KEYS, get_metadata_handler())
+    if not NATIVE_VECTOR_INDEX:
+        return
+    for label, handler in (('Thing', get_thing_handler()), ('Task', get_task_handler())):
+        handler.native_vector_index = await schema_handler.ensure_vector_index(label, NATIVE_VECTOR_DIMENSION)
+
+# Load the persisted vector index, or build it from the graph on first start
+async def load_vector_index():
+    vector_index_handler = get_vector_index_handler()
+    if vector_index_handler:
+        await vector_index_handler.load_or_build()
+
+# Stop the background work, persist the vector index and close the connections
+async def close_handlers():
+    await get_graph_handler().stop()
+    embedding_pipeline_handler = get_embedding_pipeline_handler()
+    if embedding_pipeline_handler:
+        await embedding_pipeline_handler.stop()
+    vector_index_handler = get_vector_index_handler()
+    if vector_index_handler:
+        await vector_index_handler.save()
+    cache_handler = get_cache_handler()
+    if cache_handler:
+        await cache_handler.close()
+    get_embedding_handler().close()
+    db_handler = get_db_handler()
+    await db_handler.close()
+
+# /health/ready reports ready between startup and shutdown. Startup checks the
+# database and warms up the connection pool first, so it fails fast on a bad
+# configuration and the first requests find open connections.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    await get_db_handler().warm_up(NEO4J_WARMUP_CONNECTIONS)
+    await bootstrap_schema()
+    await load_vector_index()
+    embedding_pipeline_handler = get_embedding_pipeline_handler()
+    if embedding_pipeline_handler:
+        embedding_pipeline_handler.start()
+    app.state.ready = True
+    logger.info("Startup complete")
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await close_handlers()
+
+# orjson-backed JSON for every endpoint that does not build its own response
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
 
 # Configure CORS
 origins = [
@@ -28,23 +94,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor of the list endpoints
 )
 
+# Record request latency per route template (e.g. /things/{id}), so ids do not
+# end up as metric labels
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    get_metrics_handler().observe_request(
+        request.method,
+        route.path if route else "unmatched",
+        response.status_code,
+        time.perf_counter() - start
+    )
+    return response
+
 # Include routers
 app.include_router(user_router)
 app.include_router(thing_router)
 app.include_router(relations_router)
 app.include_router(place_router)
+app.include_router(task_router)
 app.include_router(filter_router)
 app.include_router(cortex_router)
-
-# Ensure the database connection is closed gracefully on shutdown
-def close_db_handler():
-    db_handler = get_db_handler()
-    db_handler.close()
-
-import atexit
-atexit.register(close_db_handler)
+app.include_router(schema_router)
+app.include_router(cache_router)
+app.include_router(metrics_router)
+app.include_router(graph_router)
+app.include_router(nodes_router)
+app.include_router(health_router)
 
 # Run the app with Uvicorn
 if __name__ == "__main__":
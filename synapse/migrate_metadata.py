@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import logging
+
+from deps import get_db_handler, get_schema_handler
+from handlers.MetadataHandler import MetadataHandler
+from handlers.QueryBuilder import QueryBuilder
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LABELS = ('Thing', 'Task', 'Place', 'User')
+
+def migration_row(record, target):
+    properties = dict(record['properties'])
+    stale = [key for key in properties if target.is_metadata_key(key)]
+    encoded = {key: value for key, value in target.encode(target.decode(properties)).items() if value is not None}
+    if set(stale) == set(encoded):
+        return None
+    # Old keys are set to null (removed) unless the new storage writes them again.
+    # The old values go along so the write can tell whether they changed since.
+    return {
+        'id': record['id'],
+        'old': {key: record['properties'][key] for key in stale},
+        'properties': {**{key: None for key in stale}, **encoded}
+    }
+
+async def backfill_created_at(db_handler, labels, batch_size):
+    # Nodes written before created_at was set everywhere are never listed (nor
+    # migrated, since node_batches pages on it). One pass over each label,
+    # committed in batches so it does not build a single huge transaction.
+    for label in labels:
+        result = await db_handler.execute_query(f"""
+        MATCH (n:{label}) WHERE n.created_at IS NULL
+        CALL {{ WITH n SET n.created_at = coalesce(n.updated_at, '') }} IN TRANSACTIONS OF $batch_size ROWS
+        RETURN count(n) AS backfilled
+        """, {'batch_size': batch_size})
+        logger.info(f"(n:{label}): backfilled created_at on {result[0]['backfilled']}")
+
+async def node_batches(db_handler, query_builder, label, batch_size):
+    # Keyset pages over the created_at range index (see QueryBuilder.list_nodes),
+    # so every batch is an index seek rather than a scan of the label
+    query = query_builder.list_nodes(label, 'n', 'properties(n)', batch_size)
+    after = None
+    while True:
+        result = await db_handler.execute_read(query, query_builder.page_parameters(after, batch_size))
+        if result:
+            yield [{'id': record['id'], 'properties': record['n']} for record in result]
+        after = query_builder.next_cursor(result, batch_size)
+        if after is None:
+            break
+
+async def relationship_batches(db_handler, batch_size):
+    # Relationships have no index to page on, so they are read in a single
+    # streamed scan and cut into batches as they come off the cursor
+    query = """
+    MATCH ()-[n]->()
+    RETURN elementId(n) AS id, properties(n) AS properties
+    """
+    batch = []
+    async for record in db_handler.stream_query(query):
+        batch.append({'id': record['id'], 'properties': record['properties']})
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def migrate(db_handler, target, match, batches):
+    # Rewrites one batch per transaction. Reads understand both storages, so the
+    # API can keep serving meanwhile; an element whose metadata changed since it
+    # was read is left alone (it was written in the storage the API is configured
+    # for). The metadata itself is compared, as relationships have no updated_at.
+    write_query = f"""
+    UNWIND $rows AS row
+    MATCH {match}
+    WHERE elementId(n) = row.id
+    AND all(key IN keys(row.old) WHERE n[key] = row.old[key])
+    AND size([key IN keys(n) WHERE key IN ['metadata', '{MetadataHandler.TEXT_KEY}']
+        OR key STARTS WITH '{MetadataHandler.PREFIX}' OR key STARTS WITH '{MetadataHandler.JSON_PREFIX}']) = size(keys(row.old))
+    SET n += row.properties
+    RETURN count(n) AS migrated
+    """
+    scanned = migrated = 0
+    async for batch in batches:
+        scanned += len(batch)
+        rows = []
+        for record in batch:
+            try:
+                row = migration_row(record, target)
+            except ValueError as e:
+                # Keys the target storage cannot hold; the element keeps its current storage
+                logger.warning(f"{match}: skipping {record['id']}: {str(e)}")
+                continue
+            if row:
+                rows.append(row)
+        if rows:
+            written = await db_handler.execute_write(write_query, {'rows': rows})
+            migrated += written[0]['migrated']
+        logger.info(f"{match}: scanned {scanned}, migrated {migrated}")
+    return migrated
+
+async def main(target_storage, labels, relationships, batch_size):
+    db_handler = get_db_handler()
+    try:
+        # Creates the created_at indexes the node batches page on
+        await get_schema_handler().ensure_schema()
+        await backfill_created_at(db_handler, labels, batch_size)
+        if target_storage is None:
+            return
+        target = MetadataHandler(target_storage)
+        query_builder = QueryBuilder(target)
+        for label in labels:
+            await migrate(db_handler, target, f"(n:{label})", node_batches(db_handler, query_builder, label, batch_size))
+        if relationships:
+            await migrate(db_handler, target, "()-[n]->()", relationship_batches(db_handler, batch_size))
+    finally:
+        await db_handler.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill created_at and convert stored metadata between the json and properties storages.")
+    # Without --to only the created_at backfill runs
+    parser.add_argument("--to", dest="target", choices=MetadataHandler.STORAGES)
+    parser.add_argument("--labels", nargs="+", default=list(LABELS))
+    parser.add_argument("--skip-relationships", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.target, args.labels, not args.skip_relationships, args.batch_size))
@@ -0,0 +1,73 @@
+import json
+
+from fastapi.responses import JSONResponse, Response
+
+from handlers.NodeMapper import serializable
+
+MSGPACK_MEDIA_TYPES = ("application/x-msgpack", "application/vnd.msgpack", "application/msgpack")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(content):
+    # orjson when installed, several times faster than the json module on the
+    # large lists the API returns. Node records become dicts, other unknown
+    # types strings.
+    if orjson is not None:
+        return orjson.dumps(content, default=serializable, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, default=serializable, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+def arrow_column(pa, name, values):
+    # Maps and values of mixed types become JSON strings; vectors are float32 lists
+    if name == 'vector' and not any(isinstance(value, str) for value in values):
+        return pa.array(values, type=pa.list_(pa.float32()))
+    if any(isinstance(value, dict) for value in values):
+        return pa.array([json.dumps(value, default=str) if value is not None else None for value in values], type=pa.string())
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([json.dumps(value, default=str) if value is not None else None for value in values], type=pa.string())
+
+def arrow_table(rows):
+    # Column-wise: the values are appended to one list per key (in order of
+    # first appearance) in a single pass over the records, padded with None
+    # where a record has no such key, then turned into one Arrow array each
+    import pyarrow as pa
+
+    columns = {}
+    for index, row in enumerate(rows):
+        for key, value in (row if type(row) is dict else serializable(row)).items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * index
+            column.append(value)
+        for column in columns.values():
+            if len(column) <= index:
+                column.append(None)
+    return pa.table({name: arrow_column(pa, name, values) for name, values in columns.items()})
+
+def negotiate(request, rows, headers=None):
+    # Encodes a list of flat dicts according to the Accept header: msgpack, an
+    # Arrow IPC stream, or JSON. The returned Response skips FastAPI's
+    # jsonable_encoder pass, so endpoints that set headers pass them here.
+    accept = request.headers.get("accept", "")
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        import msgpack
+
+        return Response(msgpack.packb(rows, default=serializable), media_type=MSGPACK_MEDIA_TYPES[0], headers=headers)
+    if ARROW_MEDIA_TYPE in accept:
+        import pyarrow as pa
+
+        table = arrow_table(rows)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue().to_pybytes(), media_type=ARROW_MEDIA_TYPE, headers=headers)
+    return FastJSONResponse(rows, headers=headers)
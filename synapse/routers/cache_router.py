@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException, Depends
+from deps import get_cache_handler
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/cache/stats")
+async def get_cache_stats(cache_handler=Depends(get_cache_handler)):
+    if not cache_handler:
+        raise HTTPException(status_code=404, detail="Cache is disabled")
+    try:
+        return await cache_handler.get_stats()
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post("/cache/clear")
+async def clear_cache(cache_handler=Depends(get_cache_handler)):
+    if not cache_handler:
+        raise HTTPException(status_code=404, detail="Cache is disabled")
+    try:
+        await cache_handler.clear()
+        return {"message": "Cache cleared"}
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -1,12 +1,11 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from ollama import Client
-from typing import List
+from typing import List, Optional
+from deps import get_cortex_handler, get_embedding_handler, get_embedding_pipeline_handler
+import json
 
-api_router = APIRouter()
-
-# Define the Ollama client
-ollama_client = Client(host='http://cortex:11434')
+router = APIRouter()
 
 # Define Pydantic models for request and response bodies
 class ChatMessage(BaseModel):
@@ -34,41 +33,132 @@ class EmbeddingRequest(BaseModel):
 class EmbeddingResponse(BaseModel):
     embeddings: List[float]
 
+class BatchEmbeddingRequest(BaseModel):
+    model: str
+    prompts: List[str]
+
+class BatchEmbeddingResponse(BaseModel):
+    embeddings: List[List[float]]
+
 class ImageAnalysisRequest(BaseModel):
     image_base64: str
 
 class ImageAnalysisResponse(BaseModel):
     description: str
 
+async def event_stream(stream):
+    # Server-sent events: one `data` event per chunk with {"content": ...}, then
+    # a `done` event with the generation stats. The first chunk is awaited before
+    # the response starts, so an unknown model or a down server is still a 500.
+    try:
+        first = await anext(stream)
+    except StopAsyncIteration:
+        first = None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        try:
+            chunk = first
+            while chunk is not None:
+                if isinstance(chunk, dict):
+                    yield f"event: done\ndata: {json.dumps(chunk)}\n\n"
+                else:
+                    yield f"data: {json.dumps({'content': chunk})}\n\n"
+                chunk = await anext(stream, None)
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+        finally:
+            # Also reached when the client disconnects, which cancels the upstream request
+            await stream.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 # Define the chat endpoint
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, cortex_handler=Depends(get_cortex_handler)):
     try:
-        response = ollama_client.chat(model=request.model, messages=[message.dict() for message in request.messages])
-        return ChatResponse(content=response['message']['content'])
+        content = await cortex_handler.chat(request.model, [message.dict() for message in request.messages])
+        return ChatResponse(content=content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/stream")
+async def stream_chat(request: ChatRequest, cortex_handler=Depends(get_cortex_handler)):
+    return await event_stream(cortex_handler.stream_chat(request.model, [message.dict() for message in request.messages]))
+
 # Define the generate endpoint
-@api_router.post("/generate", response_model=GenerateResponse)
-async def generate(request: GenerateRequest):
+@router.post("/generate", response_model=GenerateResponse)
+async def generate(request: GenerateRequest, cortex_handler=Depends(get_cortex_handler)):
     try:
-        response = ollama_client.generate(model=request.model, prompt=request.prompt)
-        return GenerateResponse(content=response)
+        content = await cortex_handler.generate(request.model, request.prompt)
+        return GenerateResponse(content=content)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/generate/stream")
+async def stream_generate(request: GenerateRequest, cortex_handler=Depends(get_cortex_handler)):
+    return await event_stream(cortex_handler.stream_generate(request.model, request.prompt))
+
+@router.get("/cortex/stats")
+async def cortex_stats(cortex_handler=Depends(get_cortex_handler)):
+    return cortex_handler.get_stats()
+
 # Define the embeddings endpoint
-@api_router.post("/embeddings", response_model=EmbeddingResponse)
-async def embeddings(request: EmbeddingRequest):
+@router.post("/embeddings", response_model=EmbeddingResponse)
+async def embeddings(request: EmbeddingRequest, embedding_handler=Depends(get_embedding_handler)):
+    try:
+        vectors = await embedding_handler.embed(request.model, [request.prompt])
+        return EmbeddingResponse(embeddings=vectors[0])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Many prompts in one call; unchanged texts are served from the embedding cache
+@router.post("/embeddings/batch", response_model=BatchEmbeddingResponse)
+async def batch_embeddings(request: BatchEmbeddingRequest, embedding_handler=Depends(get_embedding_handler)):
     try:
-        response = ollama_client.embeddings(model=request.model, prompt=request.prompt)
-        return EmbeddingResponse(embeddings=response['embeddings'])
+        vectors = await embedding_handler.embed(request.model, request.prompts)
+        return BatchEmbeddingResponse(embeddings=vectors)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/embeddings/stats")
+async def embedding_stats(embedding_handler=Depends(get_embedding_handler)):
+    return await embedding_handler.get_stats()
+
+class ReembedRequest(BaseModel):
+    labels: Optional[List[str]] = None
+    force: bool = False
+
+# Queue the nodes whose vectors were made with another model or version
+@router.post("/embeddings/reembed")
+async def reembed(request: ReembedRequest, embedding_pipeline_handler=Depends(get_embedding_pipeline_handler)):
+    if not embedding_pipeline_handler:
+        raise HTTPException(status_code=404, detail="Embedding pipeline is disabled")
+    try:
+        if request.labels:
+            return embedding_pipeline_handler.reembed(request.labels, request.force)
+        return embedding_pipeline_handler.reembed(force=request.force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/embeddings/reembed/{job_id}")
+async def get_reembed_job(job_id: str, embedding_pipeline_handler=Depends(get_embedding_pipeline_handler)):
+    job = embedding_pipeline_handler.get_job(job_id) if embedding_pipeline_handler else None
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-embed job not found")
+    return job
+
+@router.get("/embeddings/pipeline")
+async def embedding_pipeline_status(embedding_pipeline_handler=Depends(get_embedding_pipeline_handler)):
+    if not embedding_pipeline_handler:
+        raise HTTPException(status_code=404, detail="Embedding pipeline is disabled")
+    return embedding_pipeline_handler.get_status()
+
 # Define the image analysis endpoint
-@api_router.post("/image-analysis", response_model=ImageAnalysisResponse)
+@router.post("/image-analysis", response_model=ImageAnalysisResponse)
 async def image_analysis(request: ImageAnalysisRequest):
     try:
         # Here, you would include your image analysis logic
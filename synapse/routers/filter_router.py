@@ -1,56 +1,67 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from typing import Optional, Dict, Any
-from deps import get_db_handler
+from fastapi import APIRouter, HTTPException, Response, Query, Depends
+from pydantic import BaseModel
+from typing import List, Optional, Any, Literal
+from deps import get_filter_handler
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+class Predicate(BaseModel):
+    field: str
+    op: Literal['eq', 'ne', 'lt', 'lte', 'gt', 'gte', 'in', 'contains', 'starts_with', 'ends_with', 'exists'] = 'eq'
+    value: Any = None
+
+class RelatedFilter(BaseModel):
+    direction: Literal['in', 'out', 'any'] = 'any'
+    relation_types: List[str] = []
+    min_hops: int = 1
+    max_hops: Optional[int] = None
+    labels: List[str] = []
+    where: List[Predicate] = []
+
+class FilterQuery(BaseModel):
+    labels: List[str] = []
+    where: List[Predicate] = []
+    related: List[RelatedFilter] = []
+    after: Optional[str] = None
+    limit: int = 100
+    explain: Optional[Literal['explain', 'profile']] = None
+
 @router.get("/search")
-def search_elements(
+async def search_elements(
+    response: Response,
     username: Optional[str] = Query(None),
     place_name: Optional[str] = Query(None),
     thing_name: Optional[str] = Query(None),
-    db_handler=Depends(get_db_handler)
+    after: Optional[str] = Query(None, description="Return elements after this id (from X-Next-Cursor)"),
+    limit: int = Query(100, ge=1, le=1000),
+    filter_handler=Depends(get_filter_handler)
 ):
     try:
-        match_clauses = []
-        where_clauses = []
-        parameters = {}
-
-        if username:
-            match_clauses.append("(u:User)-[r]->(e)")
-            where_clauses.append("u.username = $username")
-            parameters['username'] = username
-
-        if place_name:
-            match_clauses.append("(p:Place)-[r]->(e)")
-            where_clauses.append("p.name = $place_name")
-            parameters['place_name'] = place_name
-
-        if thing_name:
-            match_clauses.append("(t:Thing)")
-            where_clauses.append("t.name = $thing_name")
-            parameters['thing_name'] = thing_name
+        elements = await filter_handler.search_elements(username, place_name, thing_name, after, limit)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if len(elements) == limit:
+        response.headers["X-Next-Cursor"] = elements[-1]['id']
+    return elements
 
-        match_clause = " MATCH " + ", ".join(match_clauses) if match_clauses else ""
-        where_clause = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
-        
-        query = f"""
-        {match_clause}
-        {where_clause}
-        RETURN e, elementId(e) AS id
-        """
-        result = db_handler.execute_query(query, parameters)
-        
-        elements = []
-        for record in result:
-            element = dict(record['e'])
-            element['id'] = record['id']
-            elements.append(element)
-        
-        return elements
+@router.post("/search/query")
+async def filter_elements(filter_query: FilterQuery, response: Response, filter_handler=Depends(get_filter_handler)):
+    if not 1 <= filter_query.limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    filter = filter_query.dict(exclude={'after', 'limit', 'explain'})
+    try:
+        if filter_query.explain:
+            return await filter_handler.explain(filter, filter_query.after, filter_query.limit, filter_query.explain == 'profile')
+        elements = await filter_handler.filter_elements(filter, filter_query.after, filter_query.limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    if len(elements) == filter_query.limit:
+        response.headers["X-Next-Cursor"] = elements[-1]['id']
+    return elements
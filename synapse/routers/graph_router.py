@@ -0,0 +1,100 @@
+from fastapi import APIRouter, HTTPException, Request, Query, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import List, Optional
+from datetime import datetime
+from deps import get_graph_handler, get_snapshot_handler, get_query_builder
+from handlers.QueryBuilder import NODE_LABELS
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+EXPORT_MEDIA_TYPES = {
+    "msgpack": "application/vnd.msgpack",
+    "arrow": "application/vnd.apache.arrow.stream"
+}
+
+def import_format(content_type):
+    if content_type.startswith("text/csv"):
+        return "csv"
+    if "msgpack" in content_type:
+        return "msgpack"
+    return "ndjson"
+
+@router.post("/graph/import")
+async def import_graph(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv|msgpack)$", description="Defaults to the body's content type (text/csv, application/vnd.msgpack), ndjson otherwise"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    job_id: Optional[str] = Query(None, description="Id to poll the import under at /graph/import/{job_id}"),
+    resume: bool = Query(False, description="Continue the failed job `job_id` after its last committed line"),
+    skip_lines: int = Query(0, ge=0, description="Skip the first lines of the body, e.g. committed_line of an earlier attempt"),
+    graph_handler=Depends(get_graph_handler)
+):
+    # The body is read as a stream, so files of any size can be uploaded
+    if format is None:
+        format = import_format(request.headers.get("content-type", ""))
+    try:
+        job = await graph_handler.import_graph(request.stream(), format, batch_size, job_id, resume, skip_lines)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if job['state'] == 'failed':
+        raise HTTPException(status_code=400, detail=job)
+    # Accepted: the import runs in the background, poll /graph/import/{job_id}
+    return JSONResponse(job, status_code=202)
+
+@router.get("/graph/export")
+async def export_graph(
+    format: str = Query("msgpack", pattern="^(msgpack|arrow)$"),
+    labels: List[str] = Query(list(NODE_LABELS)),
+    chunk_size: int = Query(1000, ge=1, le=100000),
+    snapshot_handler=Depends(get_snapshot_handler),
+    query_builder=Depends(get_query_builder)
+):
+    try:
+        labels = [query_builder.label(label) for label in labels]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    export = snapshot_handler.export_arrow if format == "arrow" else snapshot_handler.export_msgpack
+    filename = f"synapse-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{'arrows' if format == 'arrow' else 'msgpack'}"
+    return StreamingResponse(
+        export(labels, chunk_size),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/graph/neighborhood/{id}")
+async def get_neighborhood(
+    id: str,
+    depth: int = Query(2, ge=1, le=4),
+    limit: int = Query(200, ge=1, le=1000, description="Maximum number of nodes, the start node included"),
+    fanout: int = Query(25, ge=1, le=500, description="Maximum number of relationships followed from each node per hop"),
+    types: Optional[List[str]] = Query(None, description="Only follow these relation types"),
+    cache: bool = Query(True, description="Serve the subgraph from the cache while the graph is unchanged"),
+    graph_handler=Depends(get_graph_handler)
+):
+    try:
+        subgraph = await graph_handler.get_neighborhood(id, depth, limit, fanout, types, cache)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if subgraph is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return subgraph
+
+@router.get("/graph/import")
+async def get_import_jobs(graph_handler=Depends(get_graph_handler)):
+    return graph_handler.get_jobs()
+
+@router.get("/graph/import/{job_id}")
+async def get_import_job(job_id: str, graph_handler=Depends(get_graph_handler)):
+    job = graph_handler.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
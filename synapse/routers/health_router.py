@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException, Request
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Liveness: the process is up and serving
+@router.get("/health/live")
+async def live():
+    return {"status": "live"}
+
+# Readiness: startup finished (database reachable, pool warmed up, schema and
+# vector index loaded) and shutdown has not begun
+@router.get("/health/ready")
+async def ready(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        raise HTTPException(status_code=503, detail="Not ready")
+    return {"status": "ready"}
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import PlainTextResponse
+from deps import get_metrics_handler
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(metrics_handler=Depends(get_metrics_handler)):
+    return PlainTextResponse(metrics_handler.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/metrics/queries")
+async def get_query_metrics(
+    sort_by: str = Query("total", pattern="^(total|mean|max|calls|rows|variants)$"),
+    limit: int = Query(50, ge=1, le=1000),
+    metrics_handler=Depends(get_metrics_handler)
+):
+    return metrics_handler.get_query_stats(sort_by, limit)
+
+@router.get("/metrics/plan-cache")
+async def get_plan_cache_metrics(metrics_handler=Depends(get_metrics_handler)):
+    return metrics_handler.get_plan_cache_stats()
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException, Depends
+from pydantic import BaseModel
+from typing import List, Optional
+from deps import get_node_loader_handler
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+MAX_BATCH_IDS = 10000
+
+class BatchGetRequest(BaseModel):
+    ids: List[str]
+    label: Optional[str] = None
+
+@router.post("/nodes/batch-get")
+async def batch_get_nodes(request: BatchGetRequest, node_loader_handler=Depends(get_node_loader_handler)):
+    # Nodes in the order of `ids`; ids that match no node are listed in `missing`
+    if len(request.ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    try:
+        nodes = await node_loader_handler.load_many(request.label, request.ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    return {
+        "nodes": [node for node in nodes if node is not None],
+        "missing": [id for id, node in zip(request.ids, nodes) if node is None]
+    }
+
+@router.get("/nodes/loader/stats")
+async def get_node_loader_stats(node_loader_handler=Depends(get_node_loader_handler)):
+    return node_loader_handler.get_stats()
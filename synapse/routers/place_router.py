@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Response, Query, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any
 from deps import get_place_handler
-import json
+from responses import dumps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,9 +22,9 @@ class PlaceUpdate(BaseModel):
     metadata: dict = None
 
 @router.post("/places/")
-def create_place(place: Place, place_handler=Depends(get_place_handler)):
+async def create_place(place: Place, place_handler=Depends(get_place_handler)):
     try:
-        created_place = place_handler.create_place(place.name, place.description, place.metadata)
+        created_place = await place_handler.create_place(place.name, place.description, place.metadata)
         return {
             "message": "Place created successfully",
             "id": created_place['id'],
@@ -39,32 +40,78 @@ def create_place(place: Place, place_handler=Depends(get_place_handler)):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.post("/places/bulk")
+async def create_places(
+    places: List[Dict[str, Any]],
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    place_handler=Depends(get_place_handler)
+):
+    valid_places = []
+    errors = []
+    for index, item in enumerate(places):
+        try:
+            valid_places.append((index, Place(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        created, failed = await place_handler.create_places(valid_places, chunk_size)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    errors.extend(failed)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "message": f"{len(created)} of {len(places)} places created",
+        "created": created,
+        "errors": errors
+    }
+
 @router.get("/places/{id}")
-def get_place_by_id(id: str, place_handler=Depends(get_place_handler)):
-    place = place_handler.get_place_by_id(id)
+async def get_place_by_id(id: str, place_handler=Depends(get_place_handler)):
+    place = await place_handler.get_place_by_id(id)
     if place is None:
         raise HTTPException(status_code=404, detail="Place not found")
     return place
 
 @router.get("/places/name/{name}")
-def get_place_by_name(name: str, place_handler=Depends(get_place_handler)):
-    place = place_handler.get_place_by_name(name)
+async def get_place_by_name(name: str, place_handler=Depends(get_place_handler)):
+    place = await place_handler.get_place_by_name(name)
     if place is None:
         raise HTTPException(status_code=404, detail="Place not found")
     return place
 
 @router.get("/places/")
-def get_all_places(place_handler=Depends(get_place_handler)):
+async def get_all_places(
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor of the next page (from X-Next-Cursor)"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    stream: bool = Query(False, description="Stream all places as NDJSON"),
+    place_handler=Depends(get_place_handler)
+):
     try:
-        places = place_handler.get_all_places()
+        if stream:
+            # The cursor is checked before the stream starts, since its 200 goes out with the first line
+            page = place_handler.query_builder.page_parameters(after)
+            lines = (dumps(place) + b"\n" async for place in place_handler.stream_all_places(page))
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+        places, cursor = await place_handler.get_all_places(after, limit)
+        if cursor:
+            response.headers["X-Next-Cursor"] = cursor
         return places
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.put("/places/{id}")
-def update_place(id: str, place_update: PlaceUpdate, place_handler=Depends(get_place_handler)):
-    place = place_handler.update_place(id, place_update.name, place_update.description, place_update.metadata)
+async def update_place(id: str, place_update: PlaceUpdate, place_handler=Depends(get_place_handler)):
+    try:
+        place = await place_handler.update_place(id, place_update.name, place_update.description, place_update.metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not place:
         raise HTTPException(status_code=404, detail="Place not found")
     return {
@@ -76,8 +123,8 @@ def update_place(id: str, place_update: PlaceUpdate, place_handler=Depends(get_p
     }
 
 @router.delete("/places/{id}")
-def delete_place(id: str, place_handler=Depends(get_place_handler)):
-    deleted_id = place_handler.delete_place(id)
+async def delete_place(id: str, place_handler=Depends(get_place_handler)):
+    deleted_id = await place_handler.delete_place(id)
     if not deleted_id:
         raise HTTPException(status_code=404, detail="Place not found")
     return {"message": "Place deleted successfully", "id": deleted_id}
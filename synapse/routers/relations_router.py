@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Path
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from deps import get_db_handler
-import json
+from fastapi import APIRouter, HTTPException, Depends, Query, Path, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any
+from deps import get_db_handler, get_metadata_handler, get_cache_handler, get_query_builder, get_graph_handler
+from responses import negotiate, dumps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,47 +20,83 @@ class UpdateRelationRequest(BaseModel):
     properties: Optional[Dict[str, Any]] = None
 
 @router.post("/relations/")
-def create_relation(request: CreateRelationRequest, db_handler=Depends(get_db_handler)):
+async def create_relation(
+    request: CreateRelationRequest,
+    db_handler=Depends(get_db_handler),
+    metadata_handler=Depends(get_metadata_handler),
+    cache_handler=Depends(get_cache_handler),
+    query_builder=Depends(get_query_builder)
+):
     properties = request.properties or {}
 
-    if 'metadata' in properties:
-        properties['metadata'] = json.dumps(properties['metadata'])  # Serialize metadata to JSON string
-    
-    properties_str = ', '.join([f'{k}: ${k}' for k in properties.keys()])
-    
-    query = f"""
-    MATCH (source), (target)
-    WHERE elementId(source) = $source_id AND elementId(target) = $target_id
-    CREATE (source)-[r:{request.relation_type} {{{properties_str}}}]->(target)
-    RETURN elementId(r) AS relation_id
-    """
-    
-    parameters = {**properties, 'source_id': request.source_id, 'target_id': request.target_id}
-    
     try:
-        result = db_handler.execute_query(query, parameters)
-        if result:
-            return {"relation_id": result[0]['relation_id']}
-        else:
-            raise HTTPException(status_code=404, detail="Source or target not found")
+        metadata_properties = metadata_handler.encode(properties.pop('metadata', None))
+        query = query_builder.create_relation(request.relation_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    parameters = {
+        'properties': properties,
+        'metadata_properties': metadata_properties,
+        'source_id': request.source_id,
+        'target_id': request.target_id
+    }
+
+    try:
+        result = await db_handler.execute_write(query, parameters)
+        if cache_handler:
+            await cache_handler.invalidate(request.source_id, request.target_id)
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    if not result:
+        raise HTTPException(status_code=404, detail="Source or target not found")
+    return {"relation_id": result[0]['relation_id']}
+
+@router.post("/relations/bulk")
+async def create_relations(
+    relations: List[Dict[str, Any]],
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    graph_handler=Depends(get_graph_handler)
+):
+    valid_relations = []
+    errors = []
+    for index, item in enumerate(relations):
+        try:
+            valid_relations.append((index, CreateRelationRequest(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        created, failed = await graph_handler.create_relations(valid_relations, chunk_size)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    errors.extend(failed)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "message": f"{len(created)} of {len(relations)} relations created",
+        "created": created,
+        "errors": errors
+    }
 
 @router.delete("/relations/{relation_id}")
-def delete_relation(relation_id: str, db_handler=Depends(get_db_handler)):
+async def delete_relation(relation_id: str, db_handler=Depends(get_db_handler), cache_handler=Depends(get_cache_handler)):
     query = """
     MATCH ()-[r]->() WHERE elementId(r) = $relation_id
-    WITH r, elementId(r) AS relation_id
+    WITH r, elementId(r) AS relation_id, elementId(startNode(r)) AS source_id, elementId(endNode(r)) AS target_id
     DELETE r
-    RETURN relation_id
+    RETURN relation_id, source_id, target_id
     """
     
     parameters = {'relation_id': relation_id}
     
     try:
-        result = db_handler.execute_query(query, parameters)
+        result = await db_handler.execute_write(query, parameters)
         if result:
+            if cache_handler:
+                await cache_handler.invalidate(result[0]['source_id'], result[0]['target_id'])
             return {"message": "Relation deleted successfully", "relation_id": result[0]['relation_id']}
         else:
             raise HTTPException(status_code=404, detail="Relation not found")
@@ -74,111 +111,110 @@ def delete_relation(relation_id: str, db_handler=Depends(get_db_handler)):
 
 
 @router.get("/relations/")
-def get_relations(
+async def get_relations(
     source_id: Optional[str] = Query(None),
     target_id: Optional[str] = Query(None),
     relation_type: Optional[str] = Query(None),
-    db_handler=Depends(get_db_handler)
+    db_handler=Depends(get_db_handler),
+    metadata_handler=Depends(get_metadata_handler),
+    query_builder=Depends(get_query_builder)
 ):
-    match_clause = ""
-    where_clause = ""
-    parameters = {}
-
-    if source_id and target_id:
-        match_clause = "(source)-[r]->(target)"
-        where_clause = "elementId(source) = $source_id AND elementId(target) = $target_id"
-        parameters['source_id'] = source_id
-        parameters['target_id'] = target_id
-    elif source_id:
-        match_clause = "(source)-[r]->()"
-        where_clause = "elementId(source) = $source_id"
-        parameters['source_id'] = source_id
-    elif target_id:
-        match_clause = "()-[r]->(target)"
-        where_clause = "elementId(target) = $target_id"
-        parameters['target_id'] = target_id
-    elif relation_type:
-        match_clause = f"()-[r:{relation_type}]->()"
-        where_clause = "true"
-    else:
-        raise HTTPException(status_code=400, detail="Either source_id, target_id, or relation_type must be provided")
-
-    if relation_type and (source_id or target_id):
-        match_clause = match_clause.replace("[r]->", f"[r:{relation_type}]->")
-
-    query = f"""
-    MATCH {match_clause}
-    WHERE {where_clause}
-    RETURN r, elementId(r) AS relation_id
-    """
+    try:
+        query, parameters = query_builder.get_relations(source_id, target_id, relation_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     try:
-        result = db_handler.execute_query(query, parameters)
-        relations = [{"relation_id": record['relation_id'], "properties": dict(record['r'])} for record in result]
+        result = await db_handler.execute_read(query, parameters)
+        relations = [{"relation_id": record['relation_id'], "properties": relation_properties(record['r'], metadata_handler)} for record in result]
         return relations
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+def relation_properties(relation, metadata_handler):
+    properties = dict(relation)
+    metadata = metadata_handler.decode(properties)
+    if metadata is not None:
+        properties['metadata'] = metadata
+    return properties
+
+def relation_from_record(record, metadata_handler):
+    return {
+        "relation_id": record['relation_id'],
+        "source_id": record['source_id'],
+        "source_name": record['source_name'],
+        "source_labels": record['source_labels'],
+        "target_id": record['target_id'],
+        "target_name": record['target_name'],
+        "target_labels": record['target_labels'],
+        "relation_type": record['relation_type'],
+        "properties": relation_properties(record['r'], metadata_handler)
+    }
+
 @router.get("/relations/all")
-def get_all_relations(db_handler=Depends(get_db_handler)):
-    query = """
+async def get_all_relations(
+    request: Request,
+    after: Optional[str] = Query(None, description="Return relations after this id (from X-Next-Cursor)"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    stream: bool = Query(False, description="Stream all relations as NDJSON"),
+    db_handler=Depends(get_db_handler),
+    metadata_handler=Depends(get_metadata_handler)
+):
+    # Relationships carry no indexed property across types, so pages are ordered
+    # by elementId and each one scans the relationships; prefer stream=true for
+    # full exports of large graphs
+    query = f"""
     MATCH (source)-[r]->(target)
+    WHERE $after IS NULL OR elementId(r) > $after
     RETURN elementId(source) AS source_id, source.name AS source_name, labels(source) AS source_labels, 
            elementId(target) AS target_id, target.name AS target_name, labels(target) AS target_labels, 
            type(r) AS relation_type, r, elementId(r) AS relation_id
+    {"ORDER BY relation_id LIMIT $limit" if limit and not stream else ""}
     """
+    parameters = {'after': after, 'limit': limit}
 
     try:
-        result = db_handler.execute_query(query)
-        relations = []
-        for record in result:
-            relation = {
-                "relation_id": record['relation_id'],
-                "source_id": record['source_id'],
-                "source_name": record['source_name'],
-                "source_labels": record['source_labels'],
-                "target_id": record['target_id'],
-                "target_name": record['target_name'],
-                "target_labels": record['target_labels'],
-                "relation_type": record['relation_type'],
-                "properties": dict(record['r'])
-            }
-            relations.append(relation)
-        return relations
+        if stream:
+            # Records are encoded as they come off the cursor, so memory stays flat
+            lines = (dumps(relation_from_record(record, metadata_handler)) + b"\n" async for record in db_handler.stream_query(query, parameters))
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+
+        result = await db_handler.execute_read(query, parameters)
+        relations = [relation_from_record(record, metadata_handler) for record in result]
+        headers = {"X-Next-Cursor": relations[-1]['relation_id']} if limit and len(relations) == limit else None
+        return negotiate(request, relations, headers)
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.put("/relations/{relation_id}")
-def update_relation(relation_id: str, request: UpdateRelationRequest, db_handler=Depends(get_db_handler)):
+async def update_relation(
+    relation_id: str,
+    request: UpdateRelationRequest,
+    db_handler=Depends(get_db_handler),
+    metadata_handler=Depends(get_metadata_handler),
+    cache_handler=Depends(get_cache_handler),
+    query_builder=Depends(get_query_builder)
+):
     properties = request.properties or {}
+    update_metadata = 'metadata' in properties
+    try:
+        metadata_properties = metadata_handler.encode(properties.pop('metadata', None))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    if 'metadata' in properties:
-        properties['metadata'] = json.dumps(properties['metadata'])  # Serialize metadata to JSON string
-
-    # Prepare the SET clause for the properties
-    set_clauses = ', '.join([f'r.{key} = ${key}' for key in properties.keys()])
-
-    # Prepare the REMOVE clause for the properties that need to be removed
-    remove_clauses = ', '.join([f'r.{key}' for key in properties.keys() if properties[key] is None])
-
-    query = f"""
-    MATCH ()-[r]->()
-    WHERE elementId(r) = $relation_id
-    SET {set_clauses}
-    {f"REMOVE {remove_clauses}" if remove_clauses else ""}
-    RETURN elementId(r) AS relation_id
-    """
-
-    parameters = {**properties, 'relation_id': relation_id}
+    # Properties set to null are removed by +=
+    work = query_builder.update_relation(update_metadata)
+    parameters = {'properties': properties, 'metadata_properties': metadata_properties, 'relation_id': relation_id}
 
     try:
-        result = db_handler.execute_query(query, parameters)
-        if result:
-            return {"relation_id": result[0]['relation_id']}
-        else:
-            raise HTTPException(status_code=404, detail="Relation not found")
+        result = await db_handler.run_in_transaction(work, parameters)
+        if result and cache_handler:
+            await cache_handler.invalidate(result[0]['source_id'], result[0]['target_id'])
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+    if not result:
+        raise HTTPException(status_code=404, detail="Relation not found")
+    return {"relation_id": result[0]['relation_id']}
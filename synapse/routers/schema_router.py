@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException, Depends
+from deps import get_schema_handler
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+@router.get("/schema/")
+async def get_schema(schema_handler=Depends(get_schema_handler)):
+    try:
+        indexes = await schema_handler.get_indexes()
+        constraints = await schema_handler.get_constraints()
+        return {"indexes": indexes, "constraints": constraints}
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
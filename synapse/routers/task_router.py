@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Query, Depends
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any
 from deps import get_task_handler
+from responses import negotiate
 import json
 import logging
 
@@ -20,15 +21,16 @@ class TaskUpdate(BaseModel):
     title: str = None
     description: str = None
     metadata: dict = None
+    vector: List[float] = None
 
 class SimilarityRequest(BaseModel):
     vector: List[float]
     top_n: int = 5
 
 @router.post("/tasks/")
-def create_task(task: Task, task_handler=Depends(get_task_handler)):
+async def create_task(task: Task, task_handler=Depends(get_task_handler)):
     try:
-        created_task = task_handler.create_task(task.title, task.description, task.metadata, task.vector)
+        created_task = await task_handler.create_task(task.title, task.description, task.metadata, task.vector)
         return {
             "message": "Task created successfully",
             "id": created_task['id'],
@@ -44,23 +46,82 @@ def create_task(task: Task, task_handler=Depends(get_task_handler)):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.post("/tasks/bulk")
+async def create_tasks(
+    tasks: List[Dict[str, Any]],
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    task_handler=Depends(get_task_handler)
+):
+    valid_tasks = []
+    errors = []
+    for index, item in enumerate(tasks):
+        try:
+            valid_tasks.append((index, Task(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        created, failed = await task_handler.create_tasks(valid_tasks, chunk_size)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    errors.extend(failed)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "message": f"{len(created)} of {len(tasks)} tasks created",
+        "created": created,
+        "errors": errors
+    }
+
+@router.get("/tasks/search")
+async def search_tasks(
+    request: Request,
+    title: Optional[str] = Query(None),
+    description: Optional[str] = Query(None),
+    metadata: Optional[str] = Query(None),
+    q: Optional[str] = Query(None, description="Full-text query over title, description and metadata"),
+    fuzzy: bool = Query(False),
+    prefix: bool = Query(False),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    meta: List[str] = Query([], description="Metadata filters as key:value or key:op:value (op: eq, ne, lt, lte, gt, gte, prefix)"),
+    fields: Optional[str] = Query(None, description="Comma-separated properties to return, e.g. name,description"),
+    include: Optional[str] = Query(None, pattern="^vector$", description="include=vector adds the vector as base64 little-endian float32"),
+    task_handler=Depends(get_task_handler)
+):
+    try:
+        metadata_dict = json.loads(metadata) if metadata else None
+        meta_filters = task_handler.metadata_handler.parse_filters(meta)
+        fields = task_handler.query_builder.fields(fields)
+        tasks = await task_handler.search_tasks(title, description, metadata_dict, q, fuzzy, prefix, skip, limit, meta_filters, fields, include == "vector")
+        return negotiate(request, tasks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 @router.get("/tasks/{id}")
-def get_task_by_id(id: str, task_handler=Depends(get_task_handler)):
-    task = task_handler.get_task_by_id(id)
+async def get_task_by_id(id: str, task_handler=Depends(get_task_handler)):
+    task = await task_handler.get_task_by_id(id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 @router.get("/tasks/title/{title}")
-def get_task_by_title(title: str, task_handler=Depends(get_task_handler)):
-    task = task_handler.get_task_by_title(title)
+async def get_task_by_title(title: str, task_handler=Depends(get_task_handler)):
+    task = await task_handler.get_task_by_title(title)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 @router.put("/tasks/{id}")
-def update_task(id: str, task_update: TaskUpdate, task_handler=Depends(get_task_handler)):
-    task = task_handler.update_task(id, task_update.title, task_update.description, task_update.metadata)
+async def update_task(id: str, task_update: TaskUpdate, task_handler=Depends(get_task_handler)):
+    try:
+        task = await task_handler.update_task(id, task_update.title, task_update.description, task_update.metadata, task_update.vector)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     return {
@@ -72,34 +133,28 @@ def update_task(id: str, task_update: TaskUpdate, task_handler=Depends(get_task_
     }
 
 @router.delete("/tasks/{id}")
-def delete_task(id: str, task_handler=Depends(get_task_handler)):
-    deleted_id = task_handler.delete_task(id)
+async def delete_task(id: str, task_handler=Depends(get_task_handler)):
+    deleted_id = await task_handler.delete_task(id)
     if not deleted_id:
         raise HTTPException(status_code=404, detail="Task not found")
     return {"message": "Task deleted successfully", "id": deleted_id}
 
-@router.get("/tasks/search")
-def search_tasks(
-    title: Optional[str] = Query(None),
-    description: Optional[str] = Query(None),
-    metadata: Optional[str] = Query(None),
+@router.post("/tasks/similar")
+async def find_similar_tasks(
+    request: Request,
+    similarity_request: SimilarityRequest,
+    fields: Optional[str] = Query(None, description="Comma-separated properties to return, e.g. name,description"),
+    include: Optional[str] = Query(None, pattern="^vector$", description="include=vector adds the vector as base64 little-endian float32"),
     task_handler=Depends(get_task_handler)
 ):
-    try:
-        metadata_dict = json.loads(metadata) if metadata else None
-        tasks = task_handler.search_tasks(title, description, metadata_dict)
-        return tasks
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.post("/tasks/similar")
-def find_similar_tasks(similarity_request: SimilarityRequest, task_handler=Depends(get_task_handler)):
     try:
         vector = similarity_request.vector
         top_n = similarity_request.top_n
-        similar_tasks = task_handler.find_similar_tasks(vector, top_n)
-        return similar_tasks
+        fields = task_handler.query_builder.fields(fields)
+        similar_tasks = await task_handler.find_similar_tasks(vector, top_n, fields, include == "vector")
+        return negotiate(request, similar_tasks)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
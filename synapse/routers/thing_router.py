@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Query, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any
 from deps import get_thing_handler
+from responses import negotiate, dumps
 import json
 import logging
 
@@ -20,15 +22,24 @@ class ThingUpdate(BaseModel):
     name: str = None
     description: str = None
     metadata: dict = None
+    vector: List[float] = None
+
+class ThingRelation(BaseModel):
+    target_id: str
+    relation_type: str
+    metadata: dict = None
+
+class ThingWithRelations(Thing):
+    relations: List[ThingRelation] = []
 
 class SimilarityRequest(BaseModel):
     vector: List[float]
     top_n: int = 5
 
 @router.post("/things/")
-def create_thing(thing: Thing, thing_handler=Depends(get_thing_handler)):
+async def create_thing(thing: Thing, thing_handler=Depends(get_thing_handler)):
     try:
-        created_thing = thing_handler.create_thing(thing.name, thing.description, thing.metadata, thing.vector)
+        created_thing = await thing_handler.create_thing(thing.name, thing.description, thing.metadata, thing.vector)
         return {
             "message": "Thing created successfully",
             "id": created_thing['id'],
@@ -44,32 +55,134 @@ def create_thing(thing: Thing, thing_handler=Depends(get_thing_handler)):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.post("/things/with-relations")
+async def create_thing_with_relations(thing: ThingWithRelations, thing_handler=Depends(get_thing_handler)):
+    try:
+        created_thing = await thing_handler.create_thing_with_relations(
+            thing.name, thing.description, thing.metadata, thing.vector, [relation.dict() for relation in thing.relations]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    return {
+        "message": "Thing created successfully",
+        "id": created_thing['id'],
+        "name": created_thing['name'],
+        "description": created_thing['description'],
+        "metadata": created_thing['metadata'],
+        "relations": created_thing['relations'],
+        "link": f"/things/{created_thing['id']}"
+    }
+
+@router.post("/things/bulk")
+async def create_things(
+    things: List[Dict[str, Any]],
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    thing_handler=Depends(get_thing_handler)
+):
+    valid_things = []
+    errors = []
+    for index, item in enumerate(things):
+        try:
+            valid_things.append((index, Thing(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        created, failed = await thing_handler.create_things(valid_things, chunk_size)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    errors.extend(failed)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "message": f"{len(created)} of {len(things)} things created",
+        "created": created,
+        "errors": errors
+    }
+
+@router.get("/things/search")
+async def search_things(
+    request: Request,
+    name: Optional[str] = Query(None),
+    description: Optional[str] = Query(None),
+    metadata: Optional[str] = Query(None),
+    q: Optional[str] = Query(None, description="Full-text query over name, description and metadata"),
+    fuzzy: bool = Query(False),
+    prefix: bool = Query(False),
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    meta: List[str] = Query([], description="Metadata filters as key:value or key:op:value (op: eq, ne, lt, lte, gt, gte, prefix)"),
+    fields: Optional[str] = Query(None, description="Comma-separated properties to return, e.g. name,description"),
+    include: Optional[str] = Query(None, pattern="^vector$", description="include=vector adds the vector as base64 little-endian float32"),
+    thing_handler=Depends(get_thing_handler)
+):
+    try:
+        metadata_dict = json.loads(metadata) if metadata else None
+        meta_filters = thing_handler.metadata_handler.parse_filters(meta)
+        fields = thing_handler.query_builder.fields(fields)
+        things = await thing_handler.search_things(name, description, metadata_dict, q, fuzzy, prefix, skip, limit, meta_filters, fields, include == "vector")
+        return negotiate(request, things)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 @router.get("/things/{id}")
-def get_thing_by_id(id: str, thing_handler=Depends(get_thing_handler)):
-    thing = thing_handler.get_thing_by_id(id)
+async def get_thing_by_id(id: str, thing_handler=Depends(get_thing_handler)):
+    thing = await thing_handler.get_thing_by_id(id)
     if thing is None:
         raise HTTPException(status_code=404, detail="Thing not found")
     return thing
 
 @router.get("/things/name/{name}")
-def get_thing_by_name(name: str, thing_handler=Depends(get_thing_handler)):
-    thing = thing_handler.get_thing_by_name(name)
+async def get_thing_by_name(name: str, thing_handler=Depends(get_thing_handler)):
+    thing = await thing_handler.get_thing_by_name(name)
     if thing is None:
         raise HTTPException(status_code=404, detail="Thing not found")
     return thing
 
 @router.get("/things/")
-def get_all_things(thing_handler=Depends(get_thing_handler)):
+async def get_all_things(
+    request: Request,
+    after: Optional[str] = Query(None, description="Cursor of the next page (from X-Next-Cursor)"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    stream: bool = Query(False, description="Stream all things as NDJSON"),
+    fields: Optional[str] = Query(None, description="Comma-separated properties to return, e.g. name,description"),
+    include: Optional[str] = Query(None, pattern="^vector$", description="include=vector adds the vector as base64 little-endian float32"),
+    thing_handler=Depends(get_thing_handler)
+):
+    try:
+        fields = thing_handler.query_builder.fields(fields)
+        # Checked before a stream starts, since its 200 goes out with the first line
+        page = thing_handler.query_builder.page_parameters(after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     try:
-        things = thing_handler.get_all_things()
-        return things
+        if stream:
+            lines = (dumps(thing) + b"\n" async for thing in thing_handler.stream_all_things(page, fields, include == "vector"))
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+        things, cursor = await thing_handler.get_all_things(after, limit, fields, include == "vector")
+        headers = {"X-Next-Cursor": cursor} if cursor else None
+        return negotiate(request, things, headers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.put("/things/{id}")
-def update_thing(id: str, thing_update: ThingUpdate, thing_handler=Depends(get_thing_handler)):
-    thing = thing_handler.update_thing(id, thing_update.name, thing_update.description, thing_update.metadata)
+async def update_thing(id: str, thing_update: ThingUpdate, thing_handler=Depends(get_thing_handler)):
+    try:
+        thing = await thing_handler.update_thing(id, thing_update.name, thing_update.description, thing_update.metadata, thing_update.vector)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not thing:
         raise HTTPException(status_code=404, detail="Thing not found")
     return {
@@ -81,34 +194,28 @@ def update_thing(id: str, thing_update: ThingUpdate, thing_handler=Depends(get_t
     }
 
 @router.delete("/things/{id}")
-def delete_thing(id: str, thing_handler=Depends(get_thing_handler)):
-    deleted_id = thing_handler.delete_thing(id)
+async def delete_thing(id: str, thing_handler=Depends(get_thing_handler)):
+    deleted_id = await thing_handler.delete_thing(id)
     if not deleted_id:
         raise HTTPException(status_code=404, detail="Thing not found")
     return {"message": "Thing deleted successfully", "id": deleted_id}
 
-@router.get("/things/search")
-def search_things(
-    name: Optional[str] = Query(None),
-    description: Optional[str] = Query(None),
-    metadata: Optional[str] = Query(None),
+@router.post("/things/similar")
+async def find_similar_things(
+    request: Request,
+    similarity_request: SimilarityRequest,
+    fields: Optional[str] = Query(None, description="Comma-separated properties to return, e.g. name,description"),
+    include: Optional[str] = Query(None, pattern="^vector$", description="include=vector adds the vector as base64 little-endian float32"),
     thing_handler=Depends(get_thing_handler)
 ):
-    try:
-        metadata_dict = json.loads(metadata) if metadata else None
-        things = thing_handler.search_things(name, description, metadata_dict)
-        return things
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.post("/things/similar")
-def find_similar_things(similarity_request: SimilarityRequest, thing_handler=Depends(get_thing_handler)):
     try:
         vector = similarity_request.vector
         top_n = similarity_request.top_n
-        similar_things = thing_handler.find_similar_things(vector, top_n)
-        return similar_things
+        fields = thing_handler.query_builder.fields(fields)
+        similar_things = await thing_handler.find_similar_things(vector, top_n, fields, include == "vector")
+        return negotiate(request, similar_things)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
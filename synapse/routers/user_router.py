@@ -1,6 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Response, Query, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any
 from deps import get_user_handler
+from responses import dumps
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,9 +22,9 @@ class UserUpdate(BaseModel):
     metadata: dict = None
 
 @router.post("/users/")
-def create_user(user: User, user_handler=Depends(get_user_handler)):
+async def create_user(user: User, user_handler=Depends(get_user_handler)):
     try:
-        user_id = user_handler.create_user(user.username, user.email, user.metadata)
+        user_id = await user_handler.create_user(user.username, user.email, user.metadata)
         if user_id is None:
             raise HTTPException(status_code=500, detail="User creation failed")
         return {
@@ -38,32 +41,78 @@ def create_user(user: User, user_handler=Depends(get_user_handler)):
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@router.post("/users/bulk")
+async def create_users(
+    users: List[Dict[str, Any]],
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    user_handler=Depends(get_user_handler)
+):
+    valid_users = []
+    errors = []
+    for index, item in enumerate(users):
+        try:
+            valid_users.append((index, User(**item).dict()))
+        except ValidationError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    try:
+        created, failed = await user_handler.create_users(valid_users, chunk_size)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    errors.extend(failed)
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "message": f"{len(created)} of {len(users)} users created",
+        "created": created,
+        "errors": errors
+    }
+
 @router.get("/users/username/{username}")
-def get_user_by_username(username: str, user_handler=Depends(get_user_handler)):
-    user = user_handler.get_user_by_username(username)
+async def get_user_by_username(username: str, user_handler=Depends(get_user_handler)):
+    user = await user_handler.get_user_by_username(username)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.get("/users/id/{user_id}")
-def get_user_by_id(user_id: str, user_handler=Depends(get_user_handler)):
-    user = user_handler.get_user_by_id(user_id)
+async def get_user_by_id(user_id: str, user_handler=Depends(get_user_handler)):
+    user = await user_handler.get_user_by_id(user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.get("/users/")
-def get_all_users(user_handler=Depends(get_user_handler)):
+async def get_all_users(
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor of the next page (from X-Next-Cursor)"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    stream: bool = Query(False, description="Stream all users as NDJSON"),
+    user_handler=Depends(get_user_handler)
+):
     try:
-        users = user_handler.get_all_users()
+        if stream:
+            # The cursor is checked before the stream starts, since its 200 goes out with the first line
+            page = user_handler.query_builder.page_parameters(after)
+            lines = (dumps(user) + b"\n" async for user in user_handler.stream_all_users(page))
+            return StreamingResponse(lines, media_type="application/x-ndjson")
+        users, cursor = await user_handler.get_all_users(after, limit)
+        if cursor:
+            response.headers["X-Next-Cursor"] = cursor
         return users
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @router.put("/users/{user_id}")
-def update_user(user_id: str, user_update: UserUpdate, user_handler=Depends(get_user_handler)):
-    user = user_handler.update_user(user_id, user_update.username, user_update.email, user_update.metadata)
+async def update_user(user_id: str, user_update: UserUpdate, user_handler=Depends(get_user_handler)):
+    try:
+        user = await user_handler.update_user(user_id, user_update.username, user_update.email, user_update.metadata)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {
@@ -75,8 +124,8 @@ def update_user(user_id: str, user_update: UserUpdate, user_handler=Depends(get_
     }
 
 @router.delete("/users/{user_id}")
-def delete_user(user_id: str, user_handler=Depends(get_user_handler)):
-    user_id = user_handler.delete_user(user_id)
+async def delete_user(user_id: str, user_handler=Depends(get_user_handler)):
+    user_id = await user_handler.delete_user(user_id)
     if user_id is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"message": "User deleted successfully", "user_id": user_id}
@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+import handlers.CacheHandler as cache_module
+from handlers.CacheHandler import CacheHandler, LRUCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, 'monotonic', clock)
+    return clock
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+def test_ttl_expiry(clock):
+    cache = LRUCache(ttl=10)
+    run(cache.set('a', {'id': 'a'}, 'a'))
+
+    clock.now += 9
+    assert run(cache.get('a')) == {'id': 'a'}
+    clock.now += 2
+    assert run(cache.get('a')) is None
+    assert cache.stats['expirations'] == 1
+    assert cache.entries == {} and cache.tags == {}
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    run(cache.set('a', 1, 'a'))
+    run(cache.set('b', 2, 'b'))
+    # Reading a makes b the least recently used
+    run(cache.get('a'))
+    run(cache.set('c', 3, 'c'))
+
+    assert run(cache.get('b')) is None
+    assert run(cache.get('a')) == 1
+    assert run(cache.get('c')) == 3
+    assert cache.stats['evictions'] == 1
+    assert 'b' not in cache.tags
+
+def test_values_are_copied_in_and_out():
+    cache = LRUCache()
+    value = {'id': 'a', 'metadata': {'tags': ['red']}}
+    run(cache.set('a', value, 'a'))
+    value['metadata']['tags'].append('blue')
+
+    first = run(cache.get('a'))
+    first['metadata']['tags'].append('green')
+
+    assert run(cache.get('a')) == {'id': 'a', 'metadata': {'tags': ['red']}}
+
+def test_invalidate_drops_every_key_of_a_tag():
+    cache = LRUCache()
+    run(cache.set('Thing:id:a', {'id': 'a'}, 'a'))
+    run(cache.set('Thing:name:lamp', {'id': 'a'}, 'a'))
+    run(cache.set('Thing:id:b', {'id': 'b'}, 'b'))
+
+    run(cache.invalidate('a'))
+
+    assert run(cache.get('Thing:id:a')) is None
+    assert run(cache.get('Thing:name:lamp')) is None
+    assert run(cache.get('Thing:id:b')) == {'id': 'b'}
+    assert cache.stats['invalidations'] == 2
+
+def test_overwriting_a_key_moves_its_tag():
+    cache = LRUCache()
+    run(cache.set('Thing:name:lamp', {'id': 'a'}, 'a'))
+    run(cache.set('Thing:name:lamp', {'id': 'b'}, 'b'))
+
+    run(cache.invalidate('a'))
+
+    assert run(cache.get('Thing:name:lamp')) == {'id': 'b'}
+
+def test_cache_handler_invalidation_retires_subgraphs():
+    handler = CacheHandler(LRUCache())
+
+    async def scenario():
+        await handler.set('Thing', 'id', 'a', {'id': 'a'})
+        version = await handler.graph_version()
+        await handler.set_subgraph(version, 'a:2', 'a', {'nodes': []})
+
+        await handler.invalidate('b', None)
+
+        return (
+            await handler.get('Thing', 'id', 'a'),
+            await handler.get_subgraph(await handler.graph_version(), 'a:2')
+        )
+
+    assert run(scenario()) == ({'id': 'a'}, None)
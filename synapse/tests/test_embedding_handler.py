@@ -0,0 +1,141 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from ollama import AsyncClient
+
+from handlers.EmbeddingHandler import EmbeddingHandler
+
+class FakeOllama:
+    # A local HTTP server answering /api/embed like Ollama: one vector per
+    # input, derived from the text. Records the prompts of every request and
+    # the largest number of requests in flight at once.
+    def __init__(self, delay=0.0, drop=0):
+        self.delay = delay
+        # Number of vectors left off every response
+        self.drop = drop
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @staticmethod
+    def vector(text):
+        return [float(len(text)), float(sum(map(ord, text)) % 997), 1.0]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.requests.append(body['input'])
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                time.sleep(fake.delay)
+                with fake.lock:
+                    fake.in_flight -= 1
+                embeddings = [fake.vector(text) for text in body['input']]
+                payload = json.dumps({'model': body['model'], 'embeddings': embeddings[:len(embeddings) - fake.drop]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def ollama():
+    with FakeOllama() as server:
+        yield server
+
+def embed(handler, texts, model='test-model'):
+    return asyncio.run(handler.embed(model, texts))
+
+def test_embeds_in_order_and_deduplicates(ollama):
+    handler = EmbeddingHandler(AsyncClient(host=ollama.host))
+
+    vectors = embed(handler, ['lamp', 'desk', 'lamp'])
+
+    assert vectors == [FakeOllama.vector('lamp'), FakeOllama.vector('desk'), FakeOllama.vector('lamp')]
+    assert ollama.requests == [['lamp', 'desk']]
+
+def test_memory_cache_skips_ollama(ollama):
+    handler = EmbeddingHandler(AsyncClient(host=ollama.host))
+
+    embed(handler, ['lamp'])
+    embed(handler, ['lamp', 'desk'])
+
+    assert ollama.requests == [['lamp'], ['desk']]
+    assert handler.stats['memory_hits'] == 1
+
+def test_cache_is_per_model(ollama):
+    handler = EmbeddingHandler(AsyncClient(host=ollama.host))
+
+    embed(handler, ['lamp'], model='a')
+    embed(handler, ['lamp'], model='b')
+
+    assert len(ollama.requests) == 2
+
+def test_store_survives_restart(ollama, tmp_path):
+    path = str(tmp_path / 'embeddings.sqlite')
+    handler = EmbeddingHandler(AsyncClient(host=ollama.host), store_path=path)
+    embed(handler, ['lamp', 'desk'])
+    handler.close()
+
+    restarted = EmbeddingHandler(AsyncClient(host=ollama.host), store_path=path)
+    vectors = embed(restarted, ['desk', 'lamp'])
+    restarted.close()
+
+    assert vectors == [FakeOllama.vector('desk'), FakeOllama.vector('lamp')]
+    assert len(ollama.requests) == 1
+    assert restarted.stats['store_hits'] == 2
+
+def test_batches_with_bounded_concurrency():
+    with FakeOllama(delay=0.05) as ollama:
+        handler = EmbeddingHandler(AsyncClient(host=ollama.host), batch_size=2, max_concurrency=2)
+
+        vectors = embed(handler, [f"text {index}" for index in range(9)])
+
+    assert vectors == [FakeOllama.vector(f"text {index}") for index in range(9)]
+    assert sorted(len(batch) for batch in ollama.requests) == [1, 2, 2, 2, 2]
+    assert ollama.max_in_flight <= 2
+
+def test_too_many_prompts(ollama):
+    handler = EmbeddingHandler(AsyncClient(host=ollama.host), max_prompts=2)
+
+    with pytest.raises(ValueError):
+        embed(handler, ['a', 'b', 'c'])
+    assert ollama.requests == []
+
+def test_fewer_vectors_than_prompts():
+    with FakeOllama(drop=1) as ollama:
+        handler = EmbeddingHandler(AsyncClient(host=ollama.host))
+
+        with pytest.raises(RuntimeError, match="returned 1 embeddings for 2 prompts"):
+            embed(handler, ['lamp', 'desk'])
+
+    # Nothing from the bad response is cached
+    assert handler.entries == {}
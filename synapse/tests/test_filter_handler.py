@@ -0,0 +1,82 @@
+import pytest
+
+from handlers.FilterHandler import FilterHandler, MAX_HOPS
+from handlers.MetadataHandler import MetadataHandler
+
+@pytest.fixture
+def handler():
+    return FilterHandler(None, MetadataHandler('properties'))
+
+def compile(handler, filter, **kwargs):
+    query, parameters = handler.compile(filter, **kwargs)
+    return ' '.join(query.split()), parameters
+
+def test_predicates_without_anchor(handler):
+    query, parameters = compile(handler, {
+        'labels': ['Thing'],
+        'where': [{'field': 'name', 'op': 'contains', 'value': 'lamp'}, {'field': 'metadata.brand', 'value': 'Acme'}]
+    })
+
+    assert query == (
+        "MATCH (e:Thing) WHERE e.`name` CONTAINS $p2 AND e.`meta_brand` = $p3 "
+        "AND ($after IS NULL OR elementId(e) > $after) "
+        "WITH e ORDER BY elementId(e) LIMIT $limit RETURN e, labels(e) AS labels, elementId(e) AS id"
+    )
+    assert parameters == {'after': None, 'limit': 100, 'p2': 'lamp', 'p3': 'Acme'}
+
+def test_equality_filter_anchors_and_others_become_exists(handler):
+    query, parameters = compile(handler, {
+        'labels': ['Thing'],
+        'related': [
+            {'direction': 'out', 'relation_types': ['LOCATED_IN'], 'where': [{'field': 'name', 'op': 'starts_with', 'value': 'K'}]},
+            {'direction': 'in', 'relation_types': ['OWNS'], 'labels': ['User'], 'where': [{'field': 'username', 'value': 'bob'}]}
+        ]
+    }, after='4:x:1', limit=10)
+
+    assert query == (
+        "MATCH (e:Thing)<-[:OWNS]-(anchor:User) WHERE anchor.`username` = $p2 "
+        "AND EXISTS { MATCH (e)-[:LOCATED_IN]->(n0) WHERE n0.`name` STARTS WITH $p3 } "
+        "AND ($after IS NULL OR elementId(e) > $after) "
+        "WITH DISTINCT e ORDER BY elementId(e) LIMIT $limit RETURN e, labels(e) AS labels, elementId(e) AS id"
+    )
+    assert parameters == {'after': '4:x:1', 'limit': 10, 'p2': 'bob', 'p3': 'K'}
+
+def test_hop_range_and_label_union(handler):
+    query, _ = compile(handler, {
+        'labels': ['Thing', 'Task'],
+        'related': [{'direction': 'any', 'min_hops': 2, 'max_hops': 3, 'relation_types': ['A', 'B']}]
+    })
+
+    assert query == (
+        "MATCH (e) WHERE (e:Thing OR e:Task) AND EXISTS { MATCH (e)-[:A|B*2..3]-(n0) } "
+        "AND ($after IS NULL OR elementId(e) > $after) "
+        "WITH e ORDER BY elementId(e) LIMIT $limit RETURN e, labels(e) AS labels, elementId(e) AS id"
+    )
+
+def test_single_hop_has_no_range(handler):
+    query, _ = compile(handler, {'related': [{'direction': 'out', 'min_hops': 1, 'max_hops': 1}]})
+
+    assert "EXISTS { MATCH (e)-[]->(n0) }" in query
+
+@pytest.mark.parametrize('related', [
+    {'min_hops': 0},
+    {'min_hops': 3, 'max_hops': 2},
+    {'max_hops': MAX_HOPS + 1},
+    {'direction': 'up'}
+])
+def test_invalid_related(handler, related):
+    with pytest.raises(ValueError):
+        handler.compile({'related': [related]})
+
+@pytest.mark.parametrize('filter', [
+    {'where': [{'field': 'name', 'op': 'like', 'value': 'x'}]},
+    {'where': [{'field': 'name` = 1 //', 'value': 'x'}]},
+    {'labels': ['Thing) DETACH DELETE (x']}
+])
+def test_invalid_filter(handler, filter):
+    with pytest.raises(ValueError):
+        handler.compile(filter)
+
+def test_metadata_fields_need_properties_storage():
+    with pytest.raises(ValueError):
+        FilterHandler(None, MetadataHandler('json')).compile({'where': [{'field': 'metadata.brand', 'value': 'Acme'}]})
@@ -0,0 +1,123 @@
+import pytest
+
+from handlers.MetadataHandler import MetadataHandler
+
+METADATA = {
+    'brand': 'Acme',
+    'tags': ['red', 'blue'],
+    'specs': {'ram': 16, 'cpu': {'cores': 8}},
+    'notes': None,
+    'mixed': [1, 'one'],
+    'empty': [],
+    'version.major': 2
+}
+
+@pytest.fixture
+def handler():
+    return MetadataHandler('properties')
+
+def test_flatten_nested_keys(handler):
+    assert dict(handler.flatten(METADATA)) == {
+        'meta_brand': 'Acme',
+        'meta_tags': ['red', 'blue'],
+        'meta_specs__ram': 16,
+        'meta_specs__cpu__cores': 8,
+        'metajson_notes': 'null',
+        'metajson_mixed': '[1, "one"]',
+        'metajson_empty': '[]',
+        'meta_version.major': 2
+    }
+
+@pytest.mark.parametrize('storage', MetadataHandler.STORAGES)
+def test_round_trip(storage):
+    handler = MetadataHandler(storage)
+    properties = {'name': 'lamp', **handler.encode(METADATA)}
+
+    assert handler.decode(properties) == METADATA
+    assert properties == {'name': 'lamp'}
+
+def test_decode_reads_both_storages(handler):
+    properties = {'metadata': '{"brand": "Acme"}', 'meta_specs__ram': 16}
+
+    assert handler.decode(properties) == {'brand': 'Acme', 'specs': {'ram': 16}}
+
+def test_empty_metadata(handler):
+    assert handler.encode({}) == {}
+    assert handler.decode({'name': 'lamp'}) is None
+
+@pytest.mark.parametrize('metadata', [
+    {'a__b': 1},
+    {'specs': {'a__b': 1}},
+    {'specs': {'_ram': 16}},
+    {'specs_': {'ram': 16}}
+])
+def test_rejects_keys_that_do_not_round_trip(handler, metadata):
+    with pytest.raises(ValueError):
+        handler.encode(metadata)
+
+def test_underscores_that_round_trip(handler):
+    metadata = {'_id': 1, 'serial_no': 'x', 'specs': {'ram_': 16}}
+
+    assert handler.decode(handler.encode(metadata)) == metadata
+
+def test_json_storage_accepts_any_key():
+    handler = MetadataHandler('json')
+    metadata = {'a__b': 1}
+
+    assert handler.decode(handler.encode(metadata)) == metadata
+
+@pytest.mark.parametrize('key, segments', [
+    ('brand', ['brand']),
+    ('specs.ram', ['specs', 'ram']),
+    ('version\\.major', ['version.major']),
+    ('path\\\\.x', ['path\\', 'x']),
+    ('', [''])
+])
+def test_split_and_join_key(handler, key, segments):
+    assert handler.split_key(key) == segments
+    assert handler.join_key(segments) == key
+
+def test_split_key_trailing_escape(handler):
+    with pytest.raises(ValueError):
+        handler.split_key('brand\\')
+
+def test_property_name(handler):
+    assert handler.property_name('specs.cpu.cores') == 'meta_specs__cpu__cores'
+    assert handler.property_name('version\\.major') == 'meta_version.major'
+    with pytest.raises(ValueError):
+        handler.property_name('a__b')
+    with pytest.raises(ValueError):
+        handler.property_name('specs._ram')
+
+def test_parse_filters(handler):
+    assert handler.parse_filters(['brand:Acme', 'specs.ram:gte:16', 'url:http://x', 'tags:["a"]', 'name:lt']) == [
+        ('brand', 'eq', 'Acme'),
+        ('specs.ram', 'gte', 16),
+        ('url', 'eq', 'http://x'),
+        ('tags', 'eq', ['a']),
+        ('name', 'eq', 'lt')
+    ]
+
+@pytest.mark.parametrize('expression', ['brand', ':Acme'])
+def test_parse_filters_invalid(handler, expression):
+    with pytest.raises(ValueError):
+        handler.parse_filters([expression])
+
+def test_filter_conditions(handler):
+    parameters = {}
+    conditions = handler.filter_conditions('n', [('specs.ram', 'gte', 16), ('version\\.major', 'eq', 2)], parameters)
+
+    assert conditions == ['n.`meta_specs__ram` >= $meta_filter_0', 'n.`meta_version.major` = $meta_filter_1']
+    assert parameters == {'meta_filter_0': 16, 'meta_filter_1': 2}
+
+def test_filter_conditions_need_properties_storage():
+    with pytest.raises(ValueError):
+        MetadataHandler('json').filter_conditions('n', [('brand', 'eq', 'Acme')], {})
+
+def test_match_conditions(handler):
+    parameters = {}
+    conditions = handler.match_conditions('n', {'specs': {'ram': 16}, 'version.major': 2}, parameters)
+
+    assert conditions == ['n.`meta_specs__ram` = $meta_filter_0', 'n.`meta_version.major` = $meta_filter_1']
+    with pytest.raises(ValueError):
+        handler.match_conditions('n', {'notes': None}, {})
@@ -0,0 +1,29 @@
+import handlers.MetricsHandler as metrics_module
+from handlers.MetricsHandler import MetricsHandler
+
+def run(handler, query):
+    handler.observe_query(query, {}, 0.001, 1)
+
+def test_plan_cache_hits_and_misses():
+    handler = MetricsHandler(slow_query_threshold=None)
+    run(handler, "MATCH (n:Thing) RETURN n")
+    run(handler, "MATCH (n:Thing) RETURN n")
+    run(handler, "MATCH (n:Task) RETURN n")
+
+    stats = handler.get_plan_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['distinct_queries']) == (1, 2, 2)
+
+def test_plan_cache_keeps_recent_texts_when_full(monkeypatch):
+    monkeypatch.setattr(metrics_module, 'MAX_TRACKED_QUERIES', 2)
+    handler = MetricsHandler(slow_query_threshold=None)
+    run(handler, "RETURN 'a'")
+    run(handler, "RETURN 'b'")
+    # Running a makes b the least recently run text, which c pushes out
+    run(handler, "RETURN 'a'")
+    run(handler, "RETURN 'c'")
+    run(handler, "RETURN 'a'")
+    run(handler, "RETURN 'c'")
+    run(handler, "RETURN 'b'")
+
+    stats = handler.get_plan_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['distinct_queries']) == (3, 4, 2)
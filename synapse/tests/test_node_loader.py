@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from handlers.MetadataHandler import MetadataHandler
+from handlers.NodeLoaderHandler import NodeLoaderHandler
+
+class FakeDB:
+    # Answers the loader's UNWIND $ids query from a dict of id -> properties,
+    # after `delay` seconds, and records the ids of every query
+    def __init__(self, nodes, delay=0.01, error=None):
+        self.nodes = nodes
+        self.delay = delay
+        self.error = error
+        self.queries = []
+
+    async def execute_read(self, query, parameters=None):
+        self.queries.append(sorted(parameters['ids']))
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return [
+            {'id': id, 'n': self.nodes[id], 'labels': ['Thing']}
+            for id in parameters['ids'] if id in self.nodes
+        ]
+
+NODES = {'a': {'name': 'lamp'}, 'b': {'name': 'desk'}}
+
+def loader(db, **kwargs):
+    return NodeLoaderHandler(db, MetadataHandler(), **kwargs)
+
+def test_concurrent_loads_of_one_id_share_a_query():
+    db = FakeDB(NODES)
+    handler = loader(db)
+
+    async def scenario():
+        return await asyncio.gather(*(handler.load('Thing', 'a') for _ in range(10)))
+
+    nodes = asyncio.run(scenario())
+
+    assert db.queries == [['a']]
+    assert [node['name'] for node in nodes] == ['lamp'] * 10
+    assert handler.stats == {'loads': 10, 'shared': 9, 'queries': 1}
+    assert handler.get_stats()['in_flight'] == 0
+
+def test_load_joins_a_query_in_flight():
+    db = FakeDB(NODES, delay=0.05)
+    handler = loader(db, batch_window=0.001)
+
+    async def scenario():
+        first = asyncio.create_task(handler.load('Thing', 'a'))
+        # Past the batch window, so the first query has been sent
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(first, handler.load('Thing', 'a'))
+
+    asyncio.run(scenario())
+
+    assert db.queries == [['a']]
+
+def test_batches_ids_and_returns_copies():
+    db = FakeDB(NODES)
+    handler = loader(db)
+
+    async def scenario():
+        nodes = await handler.load_many('Thing', ['a', 'b', 'a', 'missing'])
+        nodes[0]['name'] = 'changed'
+        return nodes
+
+    nodes = asyncio.run(scenario())
+
+    assert db.queries == [['a', 'b', 'missing']]
+    assert nodes[2]['name'] == 'lamp'
+    assert nodes[3] is None
+
+def test_max_batch_size_splits_queries():
+    db = FakeDB({id: {'name': id} for id in 'abcde'})
+    handler = loader(db, max_batch_size=2)
+
+    asyncio.run(handler.load_many('Thing', list('abcde')))
+
+    assert db.queries == [['a', 'b'], ['c', 'd'], ['e']]
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    db = FakeDB(NODES, error=RuntimeError("down"))
+    handler = loader(db)
+
+    async def scenario():
+        return await asyncio.gather(*(handler.load('Thing', 'a') for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    db.error = None
+    assert asyncio.run(handler.load('Thing', 'a'))['name'] == 'lamp'
+    assert len(db.queries) == 2
+
+def test_unknown_label():
+    with pytest.raises(ValueError):
+        asyncio.run(loader(FakeDB(NODES)).load('Secret', 'a'))
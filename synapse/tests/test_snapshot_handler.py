@@ -0,0 +1,54 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from handlers.MetadataHandler import MetadataHandler
+from handlers.QueryBuilder import QueryBuilder
+from handlers.SnapshotHandler import SnapshotHandler, read_snapshot
+
+msgpack = pytest.importorskip('msgpack')
+
+VECTOR = [0.1, 0.2, 1 / 3]
+
+class FakeDB:
+    # Streams one Thing with a vector and no relations
+    async def stream_query(self, query, parameters=None):
+        if 'MATCH (n:Thing)' in query:
+            yield {'id': '4:x:1', 'key': 'lamp', 'properties': {'name': 'lamp', 'vector': VECTOR}}
+
+async def chunks(data):
+    yield data
+
+def export_and_read():
+    async def scenario():
+        handler = SnapshotHandler(FakeDB(), QueryBuilder(MetadataHandler()))
+        data = b''.join([chunk async for chunk in handler.export_msgpack(labels=('Thing',))])
+        return [item async for _, item in read_snapshot(chunks(data))]
+    return asyncio.run(scenario())
+
+def test_vectors_round_trip_exactly():
+    items = export_and_read()
+
+    assert items == [{'type': 'node', 'label': 'Thing', 'key': 'lamp', 'properties': {'name': 'lamp', 'vector': VECTOR}}]
+
+def test_reads_version_1_float32_vectors():
+    data = b''.join([
+        msgpack.packb({'kind': 'header', 'format': 'synapse-snapshot', 'version': 1}),
+        msgpack.packb({'kind': 'node', 'label': 'Thing', 'key': 'lamp', 'properties': {}, 'vector': np.asarray(VECTOR, dtype='<f4').tobytes()})
+    ])
+
+    async def scenario():
+        return [item async for _, item in read_snapshot(chunks(data))]
+
+    vector = asyncio.run(scenario())[0]['properties']['vector']
+    assert vector == pytest.approx(VECTOR, rel=1e-6)
+
+def test_rejects_unknown_versions():
+    data = msgpack.packb({'kind': 'header', 'format': 'synapse-snapshot', 'version': 99})
+
+    async def scenario():
+        return [item async for _, item in read_snapshot(chunks(data))]
+
+    with pytest.raises(ValueError):
+        asyncio.run(scenario())
@@ -0,0 +1,85 @@
+import asyncio
+
+import numpy as np
+
+from handlers.VectorIndexHandler import ExactVectorIndex, IVFVectorIndex, VectorIndexHandler
+
+def random_vectors(count, dimension=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+
+def brute_force(vectors, query, top_n):
+    scores = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query))
+    return [str(index) for index in np.argsort(-scores)[:top_n]]
+
+def test_exact_matches_brute_force():
+    vectors = random_vectors(500)
+    index = ExactVectorIndex()
+    index.add_many([str(i) for i in range(len(vectors))], vectors)
+
+    for query in random_vectors(20, seed=1):
+        hits = index.search(query, top_n=10)
+        assert [id for id, _ in hits] == brute_force(vectors, query, 10)
+        scores = [score for _, score in hits]
+        assert scores == sorted(scores, reverse=True)
+
+def test_exact_skips_removed_and_reuses_slots():
+    index = ExactVectorIndex()
+    index.add('a', [1.0, 0.0])
+    index.add('b', [0.9, 0.1])
+    index.remove('a')
+    index.add('c', [0.0, 1.0])
+
+    assert [id for id, _ in index.search([1.0, 0.0], top_n=5)] == ['b', 'c']
+    assert len(index.ids) == 2
+
+def test_ivf_recall():
+    # Clustered like real embeddings, so the lists mean something
+    centers = random_vectors(16, seed=3)
+    vectors = centers[np.arange(4000) % 16] + 0.3 * random_vectors(4000)
+    index = IVFVectorIndex(nlist=16, nprobe=4)
+    index.add_many([str(i) for i in range(len(vectors))], vectors)
+    index.train()
+
+    queries = centers[np.arange(50) % 16] + 0.3 * random_vectors(50, seed=2)
+    found = sum(
+        len(set(id for id, _ in index.search(query, top_n=10)) & set(brute_force(vectors, query, 10)))
+        for query in queries
+    )
+    assert found / (len(queries) * 10) >= 0.8
+
+class FakeDB:
+    # Answers the mark and rebuild reads of VectorIndexHandler from a dict of
+    # id -> vector, and counts the rebuilds
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.updated_at = '2024-01-01T00:00:00'
+        self.rebuilds = 0
+
+    async def execute_read(self, query, parameters=None):
+        if 'count(n)' in query:
+            return [{'count': len(self.vectors), 'updated_at': self.updated_at, 'embedded_at': None}]
+        self.rebuilds += 1
+        return [{'id': id, 'vector': vector} for id, vector in self.vectors.items()]
+
+def test_load_or_build_uses_current_file(tmp_path):
+    db = FakeDB({'a': [1.0, 0.0], 'b': [0.0, 1.0]})
+    asyncio.run(VectorIndexHandler(db, str(tmp_path), labels=('Thing',)).load_or_build())
+
+    handler = VectorIndexHandler(db, str(tmp_path), labels=('Thing',))
+    asyncio.run(handler.load_or_build())
+
+    assert db.rebuilds == 1
+    assert handler.search('Thing', [1.0, 0.1], top_n=1)[0][0] == 'a'
+
+def test_stale_mark_rebuilds(tmp_path):
+    db = FakeDB({'a': [1.0, 0.0]})
+    asyncio.run(VectorIndexHandler(db, str(tmp_path), labels=('Thing',)).load_or_build())
+
+    # A write the file missed
+    db.vectors['b'] = [0.0, 1.0]
+    db.updated_at = '2024-01-02T00:00:00'
+    handler = VectorIndexHandler(db, str(tmp_path), labels=('Thing',))
+    asyncio.run(handler.load_or_build())
+
+    assert db.rebuilds == 2
+    assert handler.search('Thing', [0.0, 1.0], top_n=1)[0][0] == 'b'